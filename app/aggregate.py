@@ -1,246 +1,882 @@
 #!/usr/bin/env python3.13
 import argparse
 import json
+import multiprocessing
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
+from app import db
 from app.db import (
+    bucket_range,
+    create_shadow_table,
+    get_ingest_db,
     get_ingest_db_readonly,
     get_releases_db,
+    init_ingest_db,
     init_releases_db,
+    iter_rows,
+    poster_bucket,
+    register_shard_function,
+    swap_shadow_tables,
 )
-from app.release_utils import extract_filename, format_bytes, normalize_subject, parse_part
+from app.ingest import backfill_release_buckets, backfill_subject_columns
+from app.part_coverage import PartCoverage
+from app.release_utils import FILENAME_PRIORITY, analyze_subject, filename_rank, format_bytes
+from app.settings import get_int_setting, get_setting
 
+WATERMARK_KEY = "ingest_watermark"
+SEGMENT_WATERMARK_KEY = "segment_watermark"
+REBUILD_WATERMARK_KEY = "rebuild_watermark"
+ENGINES = ("sql", "python")
+RECORD_TYPES = ("header", "nzb_file", "nzb_failed")
+SUBJECT_SAMPLE_SIZE = 5
+_LOOKUP_BATCH = 500
 
-def iter_records(conn):
-    rows = conn.execute(
-        "SELECT type, group_name, article, subject, poster, date, bytes, message_id, payload FROM ingest ORDER BY id"
-    ).fetchall()
-    for row in rows:
-        payload = row["payload"]
-        if payload:
-            try:
-                payload = json.loads(payload)
-            except json.JSONDecodeError:
-                payload = None
-        yield {
-            "type": row["type"],
-            "group": row["group_name"],
-            "article": row["article"],
-            "subject": row["subject"],
-            "poster": row["poster"],
-            "date": row["date"],
-            "bytes": row["bytes"],
-            "message_id": row["message_id"],
-            "payload": payload,
+
+_RECORD_COLUMNS = "id, type, group_name, article, subject, poster, date, bytes, message_id, payload"
+
+
+def row_to_record(row) -> dict:
+    payload = row["payload"]
+    if payload:
+        try:
+            payload = json.loads(payload)
+        except json.JSONDecodeError:
+            payload = None
+    return {
+        "id": row["id"],
+        "type": row["type"],
+        "group": row["group_name"],
+        "article": row["article"],
+        "subject": row["subject"],
+        "poster": row["poster"],
+        "date": row["date"],
+        "bytes": row["bytes"],
+        "message_id": row["message_id"],
+        "payload": payload,
+    }
+
+
+def scope_filter(
+    after_id: int = 0,
+    upto_id: int | None = None,
+    shard: tuple[int, int] | None = None,
+    alias: str = "",
+) -> tuple[str, list]:
+    prefix = f"{alias}." if alias else ""
+    where = f"{prefix}id > ?"
+    params: list = [after_id]
+    if upto_id is not None:
+        where += f" AND {prefix}id <= ?"
+        params.append(upto_id)
+    if shard is not None:
+        where += f" AND {prefix}release_bucket BETWEEN ? AND ?"
+        params.extend(bucket_range(shard))
+    return where, params
+
+
+def iter_records(
+    conn,
+    after_id: int = 0,
+    types: tuple[str, ...] | None = None,
+    upto_id: int | None = None,
+    shard: tuple[int, int] | None = None,
+):
+    where, params = scope_filter(after_id, upto_id, shard)
+    if types:
+        where += f" AND type IN ({','.join(['?'] * len(types))})"
+        params.extend(types)
+    for row in iter_rows(conn, f"SELECT {_RECORD_COLUMNS} FROM ingest WHERE {where} ORDER BY id", params):
+        yield row_to_record(row)
+
+
+def record_key(record: dict) -> tuple | None:
+    rtype = record.get("type")
+    if rtype == "nzb_failed":
+        return ("nzb_failed", record.get("poster", ""), record.get("group", ""))
+    if rtype not in {"nzb_file", "header"}:
+        return None
+    norm = analyze_subject(record.get("subject", "")).normalized
+    return (norm, record.get("poster", ""), record.get("group", ""))
+
+
+def encode_key(key: tuple) -> str:
+    return json.dumps(list(key))
+
+
+def new_entry(record: dict) -> dict:
+    rtype = record.get("type")
+    subject = record.get("subject", "")
+    parsed = analyze_subject(subject)
+    if rtype == "nzb_failed":
+        return {
+            "name": subject or "NZB fetch failed",
+            "normalized_name": parsed.normalized,
+            "filename_hint": parsed.filename,
+            "poster": record.get("poster", ""),
+            "group": record.get("group", ""),
+            "first_seen": record.get("date", ""),
+            "last_seen": record.get("date", ""),
+            "bytes": 0,
+            "parts": PartCoverage(),
+            "part_total": 0,
+            "subjects": [],
+            "subject_count": 0,
+            "subject_seen": set(),
+            "filename_subject": None,
+            "filename_rank": None,
+            "articles": 0,
+            "source": "nzb",
+            "nzb_source_subject": subject,
+            "nzb_article": record.get("article"),
+            "nzb_message_id": record.get("message_id"),
+            "nzb_fetch_failed": True,
+        }
+    norm = parsed.normalized
+    if rtype == "nzb_file":
+        payload = record.get("payload") or {}
+        return {
+            "name": norm or subject,
+            "normalized_name": norm or subject,
+            "filename_hint": parsed.filename,
+            "poster": record.get("poster", ""),
+            "group": record.get("group", ""),
+            "first_seen": record.get("date", ""),
+            "last_seen": record.get("date", ""),
+            "bytes": 0,
+            "parts": PartCoverage(),
+            "part_total": 0,
+            "subjects": [],
+            "subject_count": 0,
+            "subject_seen": set(),
+            "filename_subject": None,
+            "filename_rank": None,
+            "articles": 0,
+            "source": "nzb",
+            "nzb_source_subject": payload.get("nzb_source_subject"),
+            "nzb_article": payload.get("nzb_article"),
+            "nzb_message_id": payload.get("nzb_message_id"),
         }
+    return {
+        "name": norm or subject,
+        "normalized_name": norm or subject,
+        "filename_hint": None,
+        "poster": record.get("poster", ""),
+        "group": record.get("group", ""),
+        "first_seen": record.get("date", ""),
+        "last_seen": record.get("date", ""),
+        "bytes": 0,
+        "parts": PartCoverage(),
+        "part_total": 0,
+        "subjects": [],
+        "subject_count": 0,
+        "subject_seen": set(),
+        "filename_subject": None,
+        "filename_rank": None,
+        "articles": 0,
+        "source": "header",
+        "message_id": record.get("message_id"),
+    }
 
 
-def build_releases() -> None:
-    ingest_conn = get_ingest_db_readonly()
-    if ingest_conn is None:
+def offer_filename(entry: dict, rank: int, subject: str) -> None:
+    best = entry["filename_subject"]
+    if best is None or (rank, subject) < (entry["filename_rank"], best):
+        entry["filename_subject"] = subject
+        entry["filename_rank"] = rank
+
+
+def note_subject(entry: dict, subject: str) -> None:
+    # subject_count is the number of distinct subjects, like COUNT(DISTINCT
+    # subject) in the SQL engine; reposts of a subject do not add to it.
+    seen = entry["subject_seen"]
+    if not subject or subject in seen:
         return
-    releases_conn = get_releases_db()
-    init_releases_db(releases_conn)
-    releases = {}
-
-    for record in iter_records(ingest_conn):
-        rtype = record.get("type")
-        if rtype == "nzb_failed":
-            key = ("nzb_failed", record.get("poster", ""), record.get("group", ""))
-            entry = releases.setdefault(
-                key,
-                {
-                    "name": record.get("subject", "") or "NZB fetch failed",
-                    "normalized_name": normalize_subject(record.get("subject", "")),
-                    "filename_hint": extract_filename(record.get("subject", "")),
-                    "poster": record.get("poster", ""),
-                    "group": record.get("group", ""),
-                    "first_seen": record.get("date", ""),
-                    "last_seen": record.get("date", ""),
-                    "bytes": 0,
-                    "parts": set(),
-                    "part_total": 0,
-                    "subjects": set(),
-                    "articles": 0,
-                    "source": "nzb",
-                    "nzb_source_subject": record.get("subject", ""),
-                    "nzb_article": record.get("article"),
-                    "nzb_message_id": record.get("message_id"),
-                    "nzb_fetch_failed": True,
-                },
-            )
-            entry["subjects"].add(record.get("subject", ""))
+    seen.add(subject)
+    entry["subject_count"] += 1
+    sample = entry["subjects"]
+    if len(sample) < SUBJECT_SAMPLE_SIZE and subject not in sample:
+        sample.append(subject)
+    guess = analyze_subject(subject).filename_guess
+    if guess:
+        offer_filename(entry, filename_rank(guess), subject)
+
+
+def merge_record(entry: dict, record: dict) -> None:
+    rtype = record.get("type")
+    subject = record.get("subject", "")
+    if rtype == "nzb_failed":
+        note_subject(entry, subject)
+        return
+
+    if rtype == "nzb_file":
+        payload = record.get("payload") or {}
+        entry["bytes"] += int(record.get("bytes") or 0)
+        segments = 0
+        if payload:
+            segments = int(payload.get("segments") or 0)
+        entry["articles"] += segments
+        note_subject(entry, subject)
+        if segments:
+            entry["parts"].add_range(1, segments)
+            entry["part_total"] = max(entry["part_total"], segments)
+        return
+
+    parsed = analyze_subject(subject)
+    entry["bytes"] += int(record.get("bytes") or 0)
+    entry["articles"] += 1
+    if record.get("date"):
+        entry["last_seen"] = record.get("date")
+        if not entry["first_seen"]:
+            entry["first_seen"] = record.get("date")
+    if parsed.part_num:
+        entry["parts"].add(parsed.part_num)
+    if parsed.part_total:
+        entry["part_total"] = max(entry["part_total"], parsed.part_total)
+    if subject:
+        note_subject(entry, subject)
+        if not entry["filename_hint"]:
+            entry["filename_hint"] = parsed.filename
+
+
+def aggregate_records(records, releases: dict | None = None) -> dict:
+    releases = {} if releases is None else releases
+    for record in records:
+        key = record_key(record)
+        if key is None:
             continue
+        entry = releases.get(key)
+        if entry is None:
+            entry = releases[key] = new_entry(record)
+        merge_record(entry, record)
+    return releases
+
+
+def merge_entry(entry: dict, other: dict) -> None:
+    # Folds a grouped header entry into an existing one, in id order.
+    entry["bytes"] += other["bytes"]
+    entry["articles"] += other["articles"]
+    if other["last_seen"]:
+        entry["last_seen"] = other["last_seen"]
+        if not entry["first_seen"]:
+            entry["first_seen"] = other["first_seen"]
+    entry["parts"].merge(other["parts"])
+    entry["part_total"] = max(entry["part_total"], other["part_total"])
+    # Only incremental runs merge into an existing entry, and build_releases
+    # recounts distinct subjects for those keys afterwards (recount_subjects).
+    entry["subject_count"] += other["subject_count"]
+    sample = entry["subjects"]
+    for subject in other["subjects"]:
+        if len(sample) >= SUBJECT_SAMPLE_SIZE:
+            break
+        if subject not in sample:
+            sample.append(subject)
+    if other["filename_subject"] is not None:
+        offer_filename(entry, other["filename_rank"], other["filename_subject"])
+    if not entry["filename_hint"]:
+        entry["filename_hint"] = other["filename_hint"]
+
+
+_SQL_GROUPS = """
+    WITH grouped AS (
+        SELECT
+            normalized_subject AS norm,
+            poster,
+            group_name,
+            MIN(id) AS first_id,
+            MIN(CASE WHEN date IS NOT NULL AND date <> '' THEN id END) AS first_dated_id,
+            MAX(CASE WHEN date IS NOT NULL AND date <> '' THEN id END) AS last_dated_id,
+            MIN(CASE WHEN subject <> '' AND filename IS NOT NULL AND filename <> '' THEN id END) AS filename_id,
+            COUNT(*) AS articles,
+            SUM(COALESCE(bytes, 0)) AS bytes,
+            MAX(COALESCE(part_total, 0)) AS part_total,
+            json_group_array(DISTINCT part_num) FILTER (WHERE part_num > 0) AS parts,
+            COUNT(DISTINCT subject) FILTER (WHERE subject <> '') AS subject_count,
+            MIN(printf('%02d', filename_rank) || subject)
+                FILTER (WHERE filename_rank IS NOT NULL AND subject <> '') AS filename_key
+        FROM ingest
+        WHERE type = 'header' AND {scope}
+        GROUP BY normalized_subject, poster, group_name
+    )
+    SELECT
+        grouped.*,
+        f.subject AS first_subject,
+        f.date AS first_date,
+        f.message_id AS first_message_id,
+        fd.date AS first_dated,
+        ld.date AS last_dated,
+        fn.filename AS filename
+    FROM grouped
+    JOIN ingest f ON f.id = grouped.first_id
+    LEFT JOIN ingest fd ON fd.id = grouped.first_dated_id
+    LEFT JOIN ingest ld ON ld.id = grouped.last_dated_id
+    LEFT JOIN ingest fn ON fn.id = grouped.filename_id
+"""
+
+
+_SQL_SUBJECT_SAMPLE = """
+    SELECT subject FROM ingest INDEXED BY idx_ingest_release
+    WHERE normalized_subject IS ? AND poster IS ? AND group_name IS ?
+      AND type = 'header' AND {scope} AND subject <> ''
+    ORDER BY id
+"""
+
+
+def subject_sample(conn, key: tuple, after_id: int = 0, upto_id: int | None = None) -> list[str]:
+    sample = []
+    where, params = scope_filter(after_id, upto_id)
+    cursor = conn.execute(_SQL_SUBJECT_SAMPLE.format(scope=where), (*key, *params))
+    for row in cursor:
+        if row["subject"] not in sample:
+            sample.append(row["subject"])
+            if len(sample) >= SUBJECT_SAMPLE_SIZE:
+                break
+    cursor.close()
+    return sample
 
-        if rtype == "nzb_file":
-            subject = record.get("subject", "")
-            poster = record.get("poster", "")
-            group = record.get("group", "")
-            norm = normalize_subject(subject)
-            payload = record.get("payload") or {}
-            key = (norm, poster, group)
-            entry = releases.setdefault(
-                key,
-                {
-                    "name": norm or subject,
-                    "normalized_name": norm or subject,
-                    "filename_hint": extract_filename(subject),
-                    "poster": poster,
-                    "group": group,
-                    "first_seen": record.get("date", ""),
-                    "last_seen": record.get("date", ""),
-                    "bytes": 0,
-                    "parts": set(),
-                    "part_total": 0,
-                    "subjects": set(),
-                    "articles": 0,
-                    "source": "nzb",
-                    "nzb_source_subject": payload.get("nzb_source_subject"),
-                    "nzb_article": payload.get("nzb_article"),
-                    "nzb_message_id": payload.get("nzb_message_id"),
-                },
+
+def group_to_entry(row, sample: list[str]) -> dict:
+    norm = row["norm"]
+    filename_key = row["filename_key"]
+    first_seen = row["first_date"]
+    last_seen = row["first_date"]
+    if row["last_dated"]:
+        last_seen = row["last_dated"]
+        if not first_seen:
+            first_seen = row["first_dated"]
+    return {
+        "name": norm or row["first_subject"],
+        "normalized_name": norm or row["first_subject"],
+        "filename_hint": row["filename"],
+        "poster": row["poster"],
+        "group": row["group_name"],
+        "first_seen": first_seen,
+        "last_seen": last_seen,
+        "bytes": int(row["bytes"] or 0),
+        "parts": PartCoverage(sorted(json.loads(row["parts"]))),
+        "part_total": int(row["part_total"] or 0),
+        "subjects": sample,
+        "subject_count": int(row["subject_count"] or 0),
+        "subject_seen": set(),
+        "filename_subject": filename_key[2:] if filename_key else None,
+        "filename_rank": int(filename_key[:2]) if filename_key else None,
+        "articles": int(row["articles"]),
+        "source": "header",
+        "message_id": row["first_message_id"],
+    }
+
+
+def collect_sql(
+    conn,
+    after_id: int = 0,
+    upto_id: int | None = None,
+    shard: tuple[int, int] | None = None,
+) -> tuple[dict, list[dict]]:
+    """Groups header rows in SQLite and returns (entries, records).
+
+    Keys that also have nzb_file rows are returned as ordered raw records
+    instead, since the first row's type decides how their entry is built.
+    """
+    records = list(iter_records(conn, after_id, ("nzb_file", "nzb_failed"), upto_id, shard))
+    mixed = {record_key(record) for record in records if record.get("type") == "nzb_file"}
+    if mixed:
+        # Keys travel as one JSON parameter: reader connections are query_only,
+        # which rules out a TEMP table.
+        where, params = scope_filter(after_id, upto_id, alias="i")
+        rows = conn.execute(
+            f"""
+            WITH k AS MATERIALIZED (
+              SELECT DISTINCT value ->> 0 AS norm, value ->> 1 AS poster, value ->> 2 AS group_name
+              FROM json_each(?)
             )
-            entry["bytes"] += int(record.get("bytes") or 0)
-            segments = 0
-            if payload:
-                segments = int(payload.get("segments") or 0)
-            entry["articles"] += segments
-            entry["subjects"].add(subject)
-            if segments:
-                entry["parts"].update(range(1, segments + 1))
-                entry["part_total"] = max(entry["part_total"], segments)
-            continue
+            SELECT i.* FROM k
+            CROSS JOIN ingest i
+              ON k.norm IS i.normalized_subject AND k.poster IS i.poster AND k.group_name IS i.group_name
+            WHERE i.type = 'header' AND {where}
+            """,
+            (json.dumps(list(mixed)), *params),
+        ).fetchall()
+        records.extend(row_to_record(row) for row in rows)
+        records.sort(key=lambda r: r["id"])
 
-        if rtype != "header":
+    entries = {}
+    where, params = scope_filter(after_id, upto_id, shard)
+    for row in iter_rows(conn, _SQL_GROUPS.format(scope=where), params):
+        key = (row["norm"], row["poster"], row["group_name"])
+        if key in mixed:
             continue
+        entries[key] = group_to_entry(row, subject_sample(conn, key, after_id, upto_id))
+    return entries, records
 
-        subject = record.get("subject", "")
-        poster = record.get("poster", "")
-        group = record.get("group", "")
-        norm = normalize_subject(subject)
-        part_num, part_total = parse_part(subject)
-
-        key = (norm, poster, group)
-        entry = releases.setdefault(
-            key,
-            {
-                "name": norm or subject,
-                "normalized_name": norm or subject,
-                "filename_hint": None,
-                "poster": poster,
-                "group": group,
-                "first_seen": record.get("date", ""),
-                "last_seen": record.get("date", ""),
-                "bytes": 0,
-                "parts": set(),
-                "part_total": 0,
-                "subjects": set(),
-                "articles": 0,
-                "source": "header",
-                "message_id": record.get("message_id"),
-            },
-        )
 
-        entry["bytes"] += int(record.get("bytes") or 0)
-        entry["articles"] += 1
-        if record.get("date"):
-            entry["last_seen"] = record.get("date")
-            if not entry["first_seen"]:
-                entry["first_seen"] = record.get("date")
-        if part_num:
-            entry["parts"].add(part_num)
-        if part_total:
-            entry["part_total"] = max(entry["part_total"], part_total)
-        if subject:
-            entry["subjects"].add(subject)
-            if not entry["filename_hint"]:
-                entry["filename_hint"] = extract_filename(subject)
-
-    payload = []
-    for info in releases.values():
-        parts_received = len(info["parts"]) if info["parts"] else 0
-        parts_expected = info["part_total"] or (parts_received or 0)
-        payload.append(
-            {
-                "key": f"{info['group']}|{info['poster']}|{info['name']}",
-                "name": info["name"],
-                "normalized_name": info["normalized_name"],
-                "filename_hint": info.get("filename_hint"),
-                "poster": info["poster"],
-                "group": info["group"],
-                "source": info.get("source"),
-                "message_id": info.get("message_id"),
-                "nzb_source_subject": info.get("nzb_source_subject"),
-                "nzb_article": info.get("nzb_article"),
-                "nzb_message_id": info.get("nzb_message_id"),
-                "nzb_fetch_failed": info.get("nzb_fetch_failed"),
-                "first_seen": info["first_seen"],
-                "last_seen": info["last_seen"],
-                "bytes": info["bytes"],
-                "size_human": format_bytes(int(info["bytes"] or 0)),
-                "parts_received": parts_received,
-                "parts_expected": parts_expected or None,
-                "part_numbers": sorted(info["parts"]),
-                "part_total": info["part_total"] or None,
-                "articles": info["articles"],
-                "subjects": sorted(info["subjects"]),
-            }
+def collect_python(
+    conn,
+    after_id: int = 0,
+    upto_id: int | None = None,
+    shard: tuple[int, int] | None = None,
+) -> tuple[dict, Iterable[dict]]:
+    # A type filter lets shards seek idx_ingest_type_bucket; other types have no key anyway.
+    types = RECORD_TYPES if shard is not None else None
+    return {}, iter_records(conn, after_id, types, upto_id, shard)
+
+
+def fold_entries(releases: dict, entries: dict) -> dict:
+    for key, entry in entries.items():
+        existing = releases.get(key)
+        if existing is None:
+            releases[key] = entry
+        else:
+            merge_entry(existing, entry)
+    return releases
+
+
+def aggregate_shard(
+    ingest_path: str,
+    engine: str,
+    after_id: int,
+    upto_id: int,
+    shard: tuple[int, int],
+) -> dict:
+    # Process pool worker: every key includes (poster, group), so each
+    # shard owns its releases outright and the partial maps are disjoint.
+    # It reads only its own release_bucket range through idx_ingest_type_bucket.
+    conn = get_ingest_db_readonly(ingest_path)
+    if conn is None:
+        return {}
+    try:
+        collect = collect_sql if engine == "sql" else collect_python
+        entries, records = collect(conn, after_id, upto_id, shard)
+        return fold_entries(aggregate_records(records), entries)
+    finally:
+        conn.close()
+
+
+def resolve_workers(workers: int | None = None) -> int:
+    if workers is None:
+        workers = get_int_setting("TRICERAPOST_AGGREGATE_WORKERS", 1)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn, not fork: the GUI server calls this from a threaded process.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def resolve_engine(engine: str | None = None) -> str:
+    engine = (engine or get_setting("TRICERAPOST_AGGREGATE_ENGINE") or "sql").strip().lower()
+    return engine if engine in ENGINES else "sql"
+
+
+def entry_to_row(key: tuple, info: dict) -> dict:
+    parts_received = info["parts"].count()
+    parts_expected = info["part_total"] or (parts_received or 0)
+    return {
+        "key": f"{info['group']}|{info['poster']}|{info['name']}",
+        "agg_key": encode_key(key),
+        "name": info["name"],
+        "normalized_name": info["normalized_name"],
+        "filename_hint": info.get("filename_hint"),
+        "poster": info["poster"],
+        "poster_bucket": poster_bucket(info["poster"]),
+        "group": info["group"],
+        "source": info.get("source"),
+        "message_id": info.get("message_id"),
+        "nzb_source_subject": info.get("nzb_source_subject"),
+        "nzb_article": info.get("nzb_article"),
+        "nzb_message_id": info.get("nzb_message_id"),
+        "nzb_fetch_failed": info.get("nzb_fetch_failed"),
+        "first_seen": info["first_seen"],
+        "last_seen": info["last_seen"],
+        "bytes": info["bytes"],
+        "size_human": format_bytes(int(info["bytes"] or 0)),
+        "parts_received": parts_received,
+        "parts_expected": parts_expected or None,
+        "part_numbers": info["parts"].encode(),
+        "part_total": info["part_total"] or None,
+        "articles": info["articles"],
+        "subjects": info["subjects"],
+        "subject_count": info["subject_count"],
+        "filename_subject": info["filename_subject"],
+        "filename_guess": (
+            analyze_subject(info["filename_subject"]).filename_guess if info["filename_subject"] else None
+        ),
+    }
+
+
+def row_to_entry(row) -> dict:
+    subjects = json.loads(row["subjects"]) if row["subjects"] else []
+    entry = {
+        "name": row["name"],
+        "normalized_name": row["normalized_name"],
+        "filename_hint": row["filename_hint"],
+        "poster": row["poster"],
+        "group": row["group_name"],
+        "first_seen": row["first_seen"],
+        "last_seen": row["last_seen"],
+        "bytes": int(row["bytes"] or 0),
+        "parts": PartCoverage.decode(row["part_numbers"]),
+        "part_total": int(row["part_total"] or 0),
+        "subjects": subjects[:SUBJECT_SAMPLE_SIZE],
+        "subject_count": int(row["subject_count"] or 0),
+        "subject_seen": set(),
+        "filename_subject": row["filename_subject"],
+        "filename_rank": None,
+        "articles": int(row["articles"] or 0),
+        "source": row["source"],
+        "message_id": row["message_id"],
+        "nzb_source_subject": row["nzb_source_subject"],
+        "nzb_article": row["nzb_article"],
+        "nzb_message_id": row["nzb_message_id"],
+        "nzb_fetch_failed": bool(row["nzb_fetch_failed"]),
+    }
+    if row["subject_count"] is None:
+        # Rows written before sampling kept every distinct subject.
+        entry["subjects"] = []
+        for subject in subjects:
+            note_subject(entry, subject)
+    elif entry["filename_subject"]:
+        guess = analyze_subject(entry["filename_subject"]).filename_guess
+        entry["filename_rank"] = filename_rank(guess) if guess else len(FILENAME_PRIORITY)
+    return entry
+
+
+def load_entries(conn, keys: list[tuple]) -> dict:
+    by_agg_key = {encode_key(key): key for key in keys}
+    encoded = list(by_agg_key)
+    entries = {}
+    for start in range(0, len(encoded), _LOOKUP_BATCH):
+        batch = encoded[start : start + _LOOKUP_BATCH]
+        placeholders = ",".join(["?"] * len(batch))
+        rows = conn.execute(
+            f"SELECT * FROM releases WHERE agg_key IN ({placeholders})",
+            batch,
+        ).fetchall()
+        for row in rows:
+            entries[by_agg_key[row["agg_key"]]] = row_to_entry(row)
+    return entries
+
+
+def iter_release_subjects(conn, agg_key: str):
+    key = json.loads(agg_key)
+    if key[0] == "nzb_failed":
+        where = "type = 'nzb_failed' AND poster IS ? AND group_name IS ?"
+        params = key[1:]
+    else:
+        where = "normalized_subject IS ? AND poster IS ? AND group_name IS ? AND type IN ('header', 'nzb_file')"
+        params = key
+    query = f"SELECT DISTINCT subject FROM ingest WHERE {where} AND subject <> '' ORDER BY subject"
+    for row in iter_rows(conn, query, params):
+        yield row["subject"]
+
+
+_SQL_RECOUNT_SUBJECTS = """
+    WITH k AS MATERIALIZED (
+      SELECT DISTINCT value ->> 0 AS norm, value ->> 1 AS poster, value ->> 2 AS group_name
+      FROM json_each(?)
+    )
+    SELECT k.norm, k.poster, k.group_name, COUNT(DISTINCT i.subject) AS subject_count FROM k
+    CROSS JOIN ingest i
+      ON k.norm IS i.normalized_subject AND k.poster IS i.poster AND k.group_name IS i.group_name
+    WHERE i.type IN ('header', 'nzb_file') AND i.subject <> '' AND i.id <= ?
+    GROUP BY k.norm, k.poster, k.group_name
+"""
+
+
+def recount_subjects(conn, releases: dict, upto_id: int) -> None:
+    """Set subject_count on each entry to its distinct subjects in ingest.
+
+    An incremental run only sees the new rows, so it cannot tell a repost
+    of a known subject from a new one; the touched keys are recounted here
+    through idx_ingest_release instead.
+    """
+    keys = [key for key in releases if key[0] != "nzb_failed"]
+    counts = {}
+    if keys:
+        rows = conn.execute(_SQL_RECOUNT_SUBJECTS, (json.dumps([list(key) for key in keys]), upto_id))
+        counts = {(row["norm"], row["poster"], row["group_name"]): row["subject_count"] for row in rows}
+    if len(keys) < len(releases):
+        rows = conn.execute(
+            "SELECT poster, group_name, COUNT(DISTINCT subject) AS subject_count FROM ingest "
+            "WHERE type = 'nzb_failed' AND subject <> '' AND id <= ? GROUP BY poster, group_name",
+            (upto_id,),
         )
+        counts.update((("nzb_failed", row["poster"], row["group_name"]), row["subject_count"]) for row in rows)
+    for key, entry in releases.items():
+        entry["subject_count"] = int(counts.get(key) or 0)
 
-    payload.sort(key=lambda r: r.get("last_seen") or "", reverse=True)
-
-    releases_conn.execute("DELETE FROM releases")
-    for row in payload:
-        releases_conn.execute(
-            """
-            INSERT INTO releases(
-                key, name, normalized_name, filename_hint, poster, group_name, source,
-                message_id, nzb_source_subject, nzb_article, nzb_message_id, nzb_fetch_failed,
-                first_seen, last_seen, bytes, size_human, parts_received, parts_expected,
-                part_numbers, part_total, articles, subjects
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                row.get("key"),
-                row.get("name"),
-                row.get("normalized_name"),
-                row.get("filename_hint"),
-                row.get("poster"),
-                row.get("group"),
-                row.get("source"),
-                row.get("message_id"),
-                row.get("nzb_source_subject"),
-                row.get("nzb_article"),
-                row.get("nzb_message_id"),
-                1 if row.get("nzb_fetch_failed") else 0,
-                row.get("first_seen"),
-                row.get("last_seen"),
-                row.get("bytes"),
-                row.get("size_human"),
-                row.get("parts_received"),
-                row.get("parts_expected"),
-                json.dumps(row.get("part_numbers")),
-                row.get("part_total"),
-                row.get("articles"),
-                json.dumps(row.get("subjects")),
-            ),
+
+def load_watermark(conn, name: str = WATERMARK_KEY) -> int:
+    row = conn.execute("SELECT value FROM aggregate_state WHERE name = ?", (name,)).fetchone()
+    return int(row["value"]) if row else 0
+
+
+def save_watermark(conn, value: int, name: str = WATERMARK_KEY) -> None:
+    conn.execute(
+        "INSERT INTO aggregate_state(name, value) VALUES(?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+        (name, int(value)),
+    )
+
+
+def iter_segments(conn, after_id: int = 0, upto_id: int | None = None):
+    where, params = scope_filter(after_id, upto_id)
+    query = f"""
+        SELECT id, subject, normalized_subject, poster, group_name, part_num, message_id, bytes
+        FROM ingest
+        WHERE type = 'header' AND message_id <> '' AND {where}
+        ORDER BY id
+    """
+    for row in iter_rows(conn, query, params):
+        norm = row["normalized_subject"]
+        part_num = row["part_num"]
+        if norm is None:
+            # Not backfilled yet (the python engine skips the backfill).
+            info = analyze_subject(row["subject"] or "")
+            norm, part_num = info.normalized, info.part_num
+        if not part_num or part_num <= 0:
+            continue
+        yield (
+            norm,
+            row["poster"] or "",
+            row["group_name"] or "",
+            part_num,
+            row["id"],
+            row["message_id"],
+            int(row["bytes"] or 0),
         )
+
+
+def write_segments(
+    conn,
+    ingest_conn,
+    after_id: int = 0,
+    upto_id: int | None = None,
+    table: str = "release_segments",
+) -> None:
+    """Index header segments by (normalized_subject, poster, group_name, part_num).
+
+    The first article seen for a part wins, matching the ingest id order.
+    """
+    conn.executemany(
+        f"INSERT OR IGNORE INTO {table}"
+        "(normalized_subject, poster, group_name, part_num, ingest_id, message_id, bytes) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        iter_segments(ingest_conn, after_id, upto_id),
+    )
+
+
+def _row_values(row: dict, change_seq: int) -> tuple:
+    return (
+        row.get("key"),
+        row.get("name"),
+        row.get("normalized_name"),
+        row.get("filename_hint"),
+        row.get("poster"),
+        row.get("group"),
+        row.get("source"),
+        row.get("message_id"),
+        row.get("nzb_source_subject"),
+        row.get("nzb_article"),
+        row.get("nzb_message_id"),
+        1 if row.get("nzb_fetch_failed") else 0,
+        row.get("first_seen"),
+        row.get("last_seen"),
+        row.get("bytes"),
+        row.get("size_human"),
+        row.get("parts_received"),
+        row.get("parts_expected"),
+        row.get("part_numbers"),
+        row.get("part_total"),
+        row.get("articles"),
+        json.dumps(row.get("subjects")),
+        row.get("agg_key"),
+        change_seq,
+        row.get("subject_count"),
+        row.get("filename_subject"),
+        row.get("filename_guess"),
+        row.get("poster_bucket"),
+    )
+
+
+_UPSERT_SQL = """
+    INSERT INTO {table}(
+        key, name, normalized_name, filename_hint, poster, group_name, source,
+        message_id, nzb_source_subject, nzb_article, nzb_message_id, nzb_fetch_failed,
+        first_seen, last_seen, bytes, size_human, parts_received, parts_expected,
+        part_numbers, part_total, articles, subjects, agg_key, change_seq,
+        subject_count, filename_subject, filename_guess, poster_bucket
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET
+        name=excluded.name,
+        normalized_name=excluded.normalized_name,
+        filename_hint=excluded.filename_hint,
+        poster=excluded.poster,
+        group_name=excluded.group_name,
+        source=excluded.source,
+        message_id=excluded.message_id,
+        nzb_source_subject=excluded.nzb_source_subject,
+        nzb_article=excluded.nzb_article,
+        nzb_message_id=excluded.nzb_message_id,
+        nzb_fetch_failed=excluded.nzb_fetch_failed,
+        first_seen=excluded.first_seen,
+        last_seen=excluded.last_seen,
+        bytes=excluded.bytes,
+        size_human=excluded.size_human,
+        parts_received=excluded.parts_received,
+        parts_expected=excluded.parts_expected,
+        part_numbers=excluded.part_numbers,
+        part_total=excluded.part_total,
+        articles=excluded.articles,
+        subjects=excluded.subjects,
+        agg_key=excluded.agg_key,
+        change_seq=excluded.change_seq,
+        subject_count=excluded.subject_count,
+        filename_subject=excluded.filename_subject,
+        filename_guess=excluded.filename_guess,
+        poster_bucket=excluded.poster_bucket
+"""
+
+
+def write_releases(conn, releases: dict, change_seq: int, table: str = "releases") -> set[str]:
+    changed = set()
+
+    def values():
+        for key, info in releases.items():
+            row = entry_to_row(key, info)
+            changed.add(row["key"])
+            yield _row_values(row, change_seq)
+
+    conn.executemany(_UPSERT_SQL.format(table=table), values())
+    return changed
+
+
+def backfill_poster_buckets(conn) -> int:
+    # Release rows written before poster_bucket existed.
+    register_shard_function(conn)
+    filled = conn.execute(
+        "UPDATE releases SET poster_bucket = release_shard(?, poster) WHERE poster_bucket IS NULL",
+        (db.RELEASE_BUCKETS,),
+    ).rowcount
+    conn.commit()
+    return filled
+
+
+def _max_ingest_id(conn) -> int:
+    row = conn.execute("SELECT MAX(id) FROM ingest").fetchone()
+    return int(row[0] or 0) if row else 0
+
+
+def build_releases(full: bool = False, engine: str | None = None, workers: int | None = None) -> set[str]:
+    """Fold new ingest rows into the releases table.
+
+    Only rows past the stored ingest watermark are read and merged into
+    their existing release rows. A full rebuild runs when asked for, when
+    there is no watermark yet, or when the ingest table was reset. Returns
+    the keys of the releases that changed; each changed row also gets
+    change_seq set to the new watermark. Full rebuilds are written into a
+    shadow table and swapped in, so readers never see a partial table.
+    The release_segments index (part number -> article) is kept in step
+    for NZB generation.
+
+    The "sql" engine (default, TRICERAPOST_AGGREGATE_ENGINE) groups header
+    rows inside SQLite; "python" folds every row in Python. Both produce
+    the same rows. With more than one worker (TRICERAPOST_AGGREGATE_WORKERS),
+    full rebuilds are split by (poster, group) across a process pool.
+    """
+    engine = resolve_engine(engine)
+    workers = resolve_workers(workers)
+    ingest_path = db.INGEST_DB_PATH
+    if os.path.exists(ingest_path):
+        # The SQL engine groups on the precomputed columns, and incremental
+        # runs of either engine recount subjects through them.
+        conn = get_ingest_db(ingest_path)
+        init_ingest_db(conn)
+        backfill_subject_columns(conn)
+        conn.close()
+
+    ingest_conn = get_ingest_db_readonly(ingest_path)
+    if ingest_conn is None:
+        return set()
+    releases_conn = get_releases_db()
+    init_releases_db(releases_conn)
+    backfill_poster_buckets(releases_conn)
+
+    watermark = load_watermark(releases_conn)
+    segment_watermark = load_watermark(releases_conn, SEGMENT_WATERMARK_KEY)
+    max_id = _max_ingest_id(ingest_conn)
+    if max_id < watermark:
+        full = True
+    if watermark <= 0:
+        full = True
+    if not full and max_id == watermark == segment_watermark:
+        releases_conn.close()
+        ingest_conn.close()
+        return set()
+
+    collect = collect_sql if engine == "sql" else collect_python
+    if full and workers > 1:
+        conn = get_ingest_db(ingest_path)
+        init_ingest_db(conn)
+        backfill_release_buckets(conn)
+        conn.close()
+        releases = {}
+        with process_pool(workers) as pool:
+            futures = [
+                pool.submit(aggregate_shard, ingest_path, engine, 0, max_id, (idx, workers))
+                for idx in range(workers)
+            ]
+            for future in futures:
+                releases.update(future.result())
+    elif full:
+        entries, records = collect(ingest_conn, 0, max_id)
+        releases = fold_entries(aggregate_records(records), entries)
+    else:
+        entries, records = collect(ingest_conn, watermark, max_id)
+        records = list(records)
+        keys = set(entries) | {key for key in (record_key(record) for record in records) if key is not None}
+        releases = load_entries(releases_conn, list(keys))
+        fold_entries(aggregate_records(records, releases), entries)
+        recount_subjects(ingest_conn, releases, max_id)
+
+    if full:
+        shadow = create_shadow_table(releases_conn, "releases")
+        changed = write_releases(releases_conn, releases, max_id, shadow)
+        shadow = create_shadow_table(releases_conn, "release_segments")
+        write_segments(releases_conn, ingest_conn, 0, max_id, shadow)
+        swap_shadow_tables(releases_conn, "releases", "release_segments")
+        save_watermark(releases_conn, max_id, REBUILD_WATERMARK_KEY)
+    else:
+        changed = write_releases(releases_conn, releases, max_id)
+        write_segments(releases_conn, ingest_conn, min(segment_watermark, watermark), max_id)
+    save_watermark(releases_conn, max_id)
+    save_watermark(releases_conn, max_id, SEGMENT_WATERMARK_KEY)
     releases_conn.commit()
     releases_conn.close()
     ingest_conn.close()
+    return changed
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="Aggregate ingested headers into releases.")
-    parser.parse_args()
+    parser.add_argument("--full", action="store_true", help="Rebuild all releases instead of merging new rows")
+    parser.add_argument("--engine", choices=ENGINES, help="Override TRICERAPOST_AGGREGATE_ENGINE")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Processes for full rebuilds (0 = all cores); overrides TRICERAPOST_AGGREGATE_WORKERS",
+    )
+    args = parser.parse_args()
 
-    build_releases()
-    print("Wrote releases to SQLite")
+    changed = build_releases(full=args.full, engine=args.engine, workers=args.workers)
+    print(f"Wrote {len(changed)} releases to SQLite")
     return 0
 
 
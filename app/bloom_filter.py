@@ -0,0 +1,41 @@
+#!/usr/bin/env python3.13
+import hashlib
+import math
+
+
+class BloomFilter:
+    """Fixed-size set membership test with no false negatives.
+
+    Sized for `capacity` items at roughly `error_rate` false positives;
+    adding more than that raises the false-positive rate.
+    """
+
+    __slots__ = ("capacity", "_bits", "_size", "_hashes", "_count")
+
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.01):
+        self.capacity = max(int(capacity), 1)
+        self._size = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self._hashes = max(round(self._size / self.capacity * math.log(2)), 1)
+        self._bits = bytearray((self._size + 7) // 8)
+        self._count = 0
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode("utf-8", errors="ignore"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for idx in range(self._hashes):
+            yield (first + idx * second) % self._size
+
+    def add(self, value: str) -> None:
+        for pos in self._positions(value):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+        self._count += 1
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def is_full(self) -> bool:
+        return self._count >= self.capacity
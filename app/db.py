@@ -1,6 +1,9 @@
 #!/usr/bin/env python3.13
 import os
 import sqlite3
+import threading
+import zlib
+from dataclasses import dataclass
 from typing import Optional
 
 def _bool_env(key: str) -> bool:
@@ -38,25 +41,317 @@ NZB_DB_PATH = os.environ.get(
 )
 
 
-def _connect(path: str) -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
+FETCH_ARRAYSIZE = int(os.environ.get("TRICERAPOST_DB_ARRAYSIZE", "1000") or 1000)
+
+
+def iter_rows(conn: sqlite3.Connection, query: str, params=(), arraysize: Optional[int] = None):
+    cursor = conn.execute(query, params)
+    cursor.arraysize = arraysize or FETCH_ARRAYSIZE
+    try:
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def shard_of(count: int, *values) -> int:
+    # crc32 rather than hash(): it must agree across worker processes.
+    text = "\x00".join("" if value is None else str(value) for value in values)
+    return zlib.crc32(text.encode("utf-8")) % max(int(count), 1)
+
+
+# Ingest rows store shard_of(RELEASE_BUCKETS, poster, group_name) in
+# release_bucket; a sharded rebuild hands each worker a contiguous range.
+RELEASE_BUCKETS = 256
+
+
+def release_bucket(poster: Optional[str], group_name: Optional[str]) -> int:
+    return shard_of(RELEASE_BUCKETS, poster, group_name)
+
+
+def poster_bucket(poster: Optional[str]) -> int:
+    # Releases store shard_of(RELEASE_BUCKETS, poster) in poster_bucket; the
+    # release filter dedupes per poster, so its shards split on poster alone.
+    return shard_of(RELEASE_BUCKETS, poster)
+
+
+def bucket_range(shard: tuple[int, int]) -> tuple[int, int]:
+    """Inclusive release_bucket range owned by shard (index, count)."""
+    index, count = shard
+    return index * RELEASE_BUCKETS // count, (index + 1) * RELEASE_BUCKETS // count - 1
+
+
+def register_shard_function(conn: sqlite3.Connection) -> None:
+    conn.create_function("release_shard", -1, shard_of, deterministic=True)
+
+
+def shadow_name(table: str) -> str:
+    return f"{table}__shadow"
+
+
+def create_shadow_table(conn: sqlite3.Connection, table: str) -> str:
+    """Create an empty copy of table (same columns, no indexes) to rebuild into."""
+    shadow = shadow_name(table)
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    if row is None:
+        raise ValueError(f"unknown table: {table}")
+    ddl = row[0]
+    body = ddl[ddl.index("(") :]
+    conn.execute(f"DROP TABLE IF EXISTS {shadow}")
+    conn.execute(f"CREATE TABLE {shadow} {body}")
+    conn.commit()
+    return shadow
+
+
+def swap_shadow_tables(conn: sqlite3.Connection, *tables: str) -> None:
+    """Replace each table with its filled shadow copy and rebuild its indexes.
+
+    Commits pending work, then opens a write transaction and leaves it open
+    so the caller can record related state before committing. WAL readers
+    keep seeing the old table until that commit.
+    """
+    placeholders = ",".join("?" * len(tables))
+    indexes = [
+        row[0]
+        for row in conn.execute(
+            "SELECT sql FROM sqlite_master "
+            f"WHERE type = 'index' AND tbl_name IN ({placeholders}) AND sql IS NOT NULL",
+            tables,
+        )
+    ]
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    for table in tables:
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {shadow_name(table)} RENAME TO {table}")
+    for sql in indexes:
+        conn.execute(sql)
+
+
+def _int_env(key: str, default: int) -> int:
+    try:
+        return int(os.environ.get(key, "") or default)
+    except ValueError:
+        return default
+
+
+@dataclass(frozen=True, slots=True)
+class PragmaProfile:
+    """Per-connection PRAGMAs applied when the manager opens a connection.
+
+    Sizes are in MiB; `wal_autocheckpoint` is in pages. Readers also get
+    `query_only`, writers get the WAL checkpoint size.
+    """
+
+    cache_mb: int = 16
+    mmap_mb: int = 128
+    wal_autocheckpoint: int = 4000
+    temp_store_memory: bool = True
+
+    @classmethod
+    def from_env(cls) -> "PragmaProfile":
+        default = cls()
+        return cls(
+            cache_mb=max(_int_env("TRICERAPOST_SQLITE_CACHE_MB", default.cache_mb), 0),
+            mmap_mb=max(_int_env("TRICERAPOST_SQLITE_MMAP_MB", default.mmap_mb), 0),
+            wal_autocheckpoint=max(_int_env("TRICERAPOST_SQLITE_WAL_AUTOCHECKPOINT", default.wal_autocheckpoint), 0),
+            temp_store_memory=os.environ.get("TRICERAPOST_SQLITE_TEMP_STORE", "memory").strip().lower() != "file",
+        )
+
+    def statements(self, readonly: bool) -> list[str]:
+        pragmas = [
+            "PRAGMA busy_timeout = 30000",
+            f"PRAGMA cache_size = {-self.cache_mb * 1024}",
+            f"PRAGMA mmap_size = {self.mmap_mb * 1024 * 1024}",
+            f"PRAGMA temp_store = {'MEMORY' if self.temp_store_memory else 'DEFAULT'}",
+        ]
+        if readonly:
+            pragmas.append("PRAGMA query_only = 1")
+        else:
+            pragmas.append("PRAGMA synchronous = NORMAL")
+            pragmas.append(f"PRAGMA wal_autocheckpoint = {self.wal_autocheckpoint}")
+        return pragmas
+
+
+class ManagedConnection(sqlite3.Connection):
+    """Connection leased from a ConnectionManager.
+
+    close() rolls back anything uncommitted and hands the connection back
+    to the manager's idle pool instead of closing it.
+    """
+
+    _manager: Optional["ConnectionManager"] = None
+    _key: tuple[str, bool] = ("", False)
+    _identity: Optional[tuple[int, int]] = None
+    _leased = False
+
+    def close(self) -> None:
+        if self._manager is None:
+            super().close()
+        elif self._leased:
+            self._manager.release(self)
+
+    def discard(self) -> None:
+        self._leased = False
+        super().close()
+
+
+def _file_identity(path: str) -> Optional[tuple[int, int]]:
     if path.startswith("file:"):
-        conn = sqlite3.connect(path, timeout=30, uri=True)
-    else:
-        conn = sqlite3.connect(path, timeout=30)
-    conn.row_factory = sqlite3.Row
-    return conn
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+class ConnectionManager:
+    """Hands out SQLite connections per database and reuses idle ones.
+
+    Each (path, read-only) pair keeps up to `pool_size` idle connections.
+    A connection is leased to one thread at a time and returns to the pool
+    when the caller closes it; the most recently released one is handed out
+    first so a thread that reconnects usually gets its warm page cache back.
+    Idle connections whose file was deleted or replaced are dropped.
+    """
+
+    def __init__(self, profile: Optional[PragmaProfile] = None, pool_size: Optional[int] = None):
+        self.profile = profile or PragmaProfile.from_env()
+        self.pool_size = max(_int_env("TRICERAPOST_DB_POOL_SIZE", 4) if pool_size is None else pool_size, 0)
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, bool], list[ManagedConnection]] = {}
+        self._stats: dict[tuple[str, bool], dict[str, int]] = {}
+
+    def _counters(self, key: tuple[str, bool]) -> dict[str, int]:
+        counters = self._stats.get(key)
+        if counters is None:
+            counters = {"opened": 0, "reused": 0, "closed": 0, "in_use": 0, "peak_in_use": 0}
+            self._stats[key] = counters
+        return counters
+
+    def _open(self, path: str, readonly: bool) -> ManagedConnection:
+        uri = path.startswith("file:")
+        if readonly and not uri and not _bool_env("TRICERAPOST_DB_IN_MEMORY"):
+            target, uri = f"file:{path}?mode=ro", True
+        else:
+            target = path
+        conn = sqlite3.connect(target, timeout=30, uri=uri, check_same_thread=False, factory=ManagedConnection)
+        for statement in self.profile.statements(readonly):
+            conn.execute(statement)
+        conn._manager = self
+        conn._key = (path, readonly)
+        conn._identity = _file_identity(path)
+        return conn
+
+    def _prune_locked(self) -> None:
+        for key, idle in list(self._idle.items()):
+            keep = [conn for conn in idle if conn._identity is None or conn._identity == _file_identity(key[0])]
+            for conn in idle:
+                if conn not in keep:
+                    conn.discard()
+                    self._counters(key)["closed"] += 1
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+
+    def acquire(self, path: str, readonly: bool = False) -> Optional[ManagedConnection]:
+        """A connection to `path`, or None for a read-only request on a missing file."""
+        if readonly and not path.startswith("file:") and not os.path.exists(path):
+            return None
+        key = (path, readonly)
+        identity = _file_identity(path)
+        conn = None
+        with self._lock:
+            counters = self._counters(key)
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate = idle.pop()
+                if candidate._identity is None or candidate._identity == identity:
+                    conn = candidate
+                    counters["reused"] += 1
+                    break
+                candidate.discard()
+                counters["closed"] += 1
+            if conn is None:
+                self._prune_locked()
+            counters["in_use"] += 1
+            counters["peak_in_use"] = max(counters["peak_in_use"], counters["in_use"])
+        if conn is None:
+            try:
+                if not readonly and not path.startswith("file:"):
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                conn = self._open(path, readonly)
+            except Exception:
+                with self._lock:
+                    counters["in_use"] -= 1
+                raise
+            with self._lock:
+                counters["opened"] += 1
+        conn.row_factory = sqlite3.Row
+        conn._leased = True
+        return conn
+
+    def release(self, conn: ManagedConnection) -> None:
+        conn._leased = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            reusable = conn._identity is None or conn._identity == _file_identity(conn._key[0])
+        except sqlite3.Error:
+            reusable = False
+        with self._lock:
+            counters = self._counters(conn._key)
+            counters["in_use"] -= 1
+            idle = self._idle.setdefault(conn._key, [])
+            if reusable and len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+            if not idle:
+                del self._idle[conn._key]
+            counters["closed"] += 1
+        conn.discard()
+
+    def close_idle(self) -> None:
+        """Close every pooled connection; leased ones are unaffected."""
+        with self._lock:
+            for key, idle in self._idle.items():
+                for conn in idle:
+                    conn.discard()
+                self._counters(key)["closed"] += len(idle)
+            self._idle.clear()
+
+    def _after_fork(self) -> None:
+        # SQLite handles must not cross fork(); the child starts empty.
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._stats = {}
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            report = {}
+            for (path, readonly), counters in self._stats.items():
+                entry = dict(counters, idle=len(self._idle.get((path, readonly), [])))
+                report[f"{os.path.basename(path) or path}{' (ro)' if readonly else ''}"] = entry
+            return report
+
+
+CONNECTIONS = ConnectionManager()
+os.register_at_fork(after_in_child=CONNECTIONS._after_fork)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    return CONNECTIONS.acquire(path)
 
 
 def _connect_readonly(path: str) -> Optional[sqlite3.Connection]:
-    if not os.path.exists(path):
-        return None
-    if _bool_env("TRICERAPOST_DB_IN_MEMORY"):
-        conn = sqlite3.connect(path, timeout=30, uri=path.startswith("file:"))
-    else:
-        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return CONNECTIONS.acquire(path, readonly=True)
 
 
 def _apply_pragmas(conn: sqlite3.Connection) -> None:
@@ -132,11 +427,37 @@ def init_ingest_db(conn: sqlite3.Connection) -> None:
             bytes INTEGER,
             message_id TEXT,
             payload TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            normalized_subject TEXT,
+            part_num INTEGER,
+            part_total INTEGER,
+            filename TEXT,
+            filename_rank INTEGER,
+            release_bucket INTEGER
         )
         """
     )
+    cols = {row[1] for row in conn.execute("PRAGMA table_info(ingest)").fetchall()}
+    for name, decl in (
+        ("normalized_subject", "TEXT"),
+        ("part_num", "INTEGER"),
+        ("part_total", "INTEGER"),
+        ("filename", "TEXT"),
+    ):
+        if name not in cols:
+            conn.execute(f"ALTER TABLE ingest ADD COLUMN {name} {decl}")
+    if "filename_rank" not in cols:
+        conn.execute("ALTER TABLE ingest ADD COLUMN filename_rank INTEGER")
+        # Let the aggregate backfill recompute every precomputed column.
+        conn.execute("UPDATE ingest SET normalized_subject = NULL")
+    if "release_bucket" not in cols:
+        # Filled in by backfill_release_buckets before the next sharded rebuild.
+        conn.execute("ALTER TABLE ingest ADD COLUMN release_bucket INTEGER")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_group ON ingest(group_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_type_bucket ON ingest(type, release_bucket)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ingest_release ON ingest(normalized_subject, poster, group_name)"
+    )
     conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_type ON ingest(type)")
     conn.commit()
 
@@ -167,10 +488,53 @@ def init_releases_db(conn: sqlite3.Connection) -> None:
             part_numbers TEXT,
             part_total INTEGER,
             articles INTEGER,
-            subjects TEXT
+            subjects TEXT,
+            agg_key TEXT,
+            change_seq INTEGER DEFAULT 0,
+            subject_count INTEGER,
+            filename_subject TEXT,
+            filename_guess TEXT,
+            poster_bucket INTEGER
         )
         """
     )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS aggregate_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """
+    )
+    cols = {row[1] for row in conn.execute("PRAGMA table_info(releases)").fetchall()}
+    if "agg_key" not in cols:
+        conn.execute("ALTER TABLE releases ADD COLUMN agg_key TEXT")
+    if "change_seq" not in cols:
+        conn.execute("ALTER TABLE releases ADD COLUMN change_seq INTEGER DEFAULT 0")
+    for name in ("subject_count INTEGER", "filename_subject TEXT", "filename_guess TEXT"):
+        if name.split()[0] not in cols:
+            conn.execute(f"ALTER TABLE releases ADD COLUMN {name}")
+    if "poster_bucket" not in cols:
+        # Filled in by backfill_poster_buckets before the next sharded filter run.
+        conn.execute("ALTER TABLE releases ADD COLUMN poster_bucket INTEGER")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS release_segments (
+            normalized_subject TEXT NOT NULL,
+            poster TEXT NOT NULL,
+            group_name TEXT NOT NULL,
+            part_num INTEGER NOT NULL,
+            ingest_id INTEGER,
+            message_id TEXT,
+            bytes INTEGER,
+            PRIMARY KEY (normalized_subject, poster, group_name, part_num)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_releases_agg_key ON releases(agg_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_releases_change_seq ON releases(change_seq)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_releases_bucket ON releases(normalized_name, poster)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_releases_poster_bucket ON releases(poster_bucket)")
     conn.commit()
 
 
@@ -218,6 +582,26 @@ def init_complete_db(conn: sqlite3.Connection) -> None:
         conn.execute("ALTER TABLE releases_complete ADD COLUMN download_failed INTEGER DEFAULT 0")
     if "tags" not in cols:
         conn.execute("ALTER TABLE releases_complete ADD COLUMN tags TEXT")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS complete_buckets (
+            bucket_key TEXT PRIMARY KEY,
+            normalized_name TEXT,
+            poster TEXT,
+            complete_key TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_releases_complete_last_seen ON releases_complete(last_seen, key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_complete_buckets_key ON complete_buckets(complete_key)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS filter_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """
+    )
     conn.commit()
 
 
@@ -259,9 +643,36 @@ def init_nzb_db(conn: sqlite3.Connection) -> None:
         conn.execute("ALTER TABLE nzbs ADD COLUMN payload BLOB")
     if "tags" not in cols:
         conn.execute("ALTER TABLE nzbs ADD COLUMN tags TEXT")
+    if "codec" not in cols:
+        conn.execute("ALTER TABLE nzbs ADD COLUMN codec TEXT")
+    if "payload_hash" not in cols:
+        conn.execute("ALTER TABLE nzbs ADD COLUMN payload_hash TEXT")
     cols_invalid = {row[1] for row in conn.execute("PRAGMA table_info(nzb_invalid)").fetchall()}
     if "payload" not in cols_invalid:
         conn.execute("ALTER TABLE nzb_invalid ADD COLUMN payload BLOB")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_nzbs_release_key ON nzbs(release_key)")
     conn.execute("CREATE INDEX IF NOT EXISTS idx_nzbs_source ON nzbs(source)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_nzbs_payload_hash ON nzbs(payload_hash)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS nzb_blobs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT,
+            bytes INTEGER NOT NULL,
+            payload BLOB NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS segment_status (
+            message_id TEXT PRIMARY KEY,
+            present INTEGER NOT NULL,
+            checked_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_segment_status_missing ON segment_status(checked_at) WHERE present = 0"
+    )
     conn.commit()
@@ -12,12 +12,16 @@ if BASE_DIR not in sys.path:
 
 from app.nntp_client import NNTPClient
 from app.db import (
+    RELEASE_BUCKETS,
     get_ingest_db,
     get_state_db,
     init_ingest_db,
     init_state_db,
+    register_shard_function,
+    release_bucket,
 )
-from app.release_utils import NZB_RE, parse_nzb, strip_article_headers
+from app.nzb_utils import read_nzb_body
+from app.release_utils import analyze_subject, filename_rank, strip_article_headers
 from app.settings import get_bool_setting, get_int_setting, get_setting
 
 
@@ -63,12 +67,24 @@ def parse_groups(args_group: Optional[str], env_group: Optional[str], env_groups
     return []
 
 
+SUBJECT_TYPES = ("header", "nzb_file", "nzb_failed")
+
+
+def subject_columns(record_type: str | None, subject: str | None) -> tuple:
+    if record_type not in SUBJECT_TYPES:
+        return (None, None, None, None, None)
+    parsed = analyze_subject(subject or "")
+    rank = filename_rank(parsed.filename_guess) if parsed.filename_guess else None
+    return (parsed.normalized, parsed.part_num, parsed.part_total, parsed.filename, rank)
+
+
 def append_record(conn, record: dict) -> None:
     conn.execute(
         """
         INSERT INTO ingest(
-            group_name, type, article, subject, poster, date, bytes, message_id, payload
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            group_name, type, article, subject, poster, date, bytes, message_id, payload,
+            normalized_subject, part_num, part_total, filename, filename_rank, release_bucket
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
         (
             record.get("group"),
@@ -80,10 +96,48 @@ def append_record(conn, record: dict) -> None:
             record.get("bytes"),
             record.get("message_id"),
             json.dumps(record.get("payload")) if record.get("payload") is not None else None,
+            *subject_columns(record.get("type"), record.get("subject")),
+            release_bucket(record.get("poster"), record.get("group")),
         ),
     )
 
 
+def backfill_subject_columns(conn, batch_size: int = 5000) -> int:
+    # Rows written before the precomputed columns existed.
+    placeholders = ",".join(["?"] * len(SUBJECT_TYPES))
+    filled = 0
+    while True:
+        rows = conn.execute(
+            f"""
+            SELECT id, type, subject FROM ingest
+            WHERE normalized_subject IS NULL AND type IN ({placeholders})
+            LIMIT ?
+            """,
+            (*SUBJECT_TYPES, batch_size),
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            "UPDATE ingest SET normalized_subject=?, part_num=?, part_total=?, filename=?, filename_rank=? "
+            "WHERE id=?",
+            [(*subject_columns(row["type"], row["subject"]), row["id"]) for row in rows],
+        )
+        conn.commit()
+        filled += len(rows)
+    return filled
+
+
+def backfill_release_buckets(conn) -> int:
+    # Rows written before release_bucket existed.
+    register_shard_function(conn)
+    filled = conn.execute(
+        "UPDATE ingest SET release_bucket = release_shard(?, poster, group_name) WHERE release_bucket IS NULL",
+        (RELEASE_BUCKETS,),
+    ).rowcount
+    conn.commit()
+    return filled
+
+
 def parse_overview(overview) -> tuple[str, str, str, int, str]:
     if isinstance(overview, dict):
         subject = overview.get("subject", "")
@@ -183,7 +237,7 @@ def ingest_groups(
                 }
                 append_record(ingest_conn, record)
 
-                if NZB_RE.search(subject):
+                if analyze_subject(subject).is_nzb:
                     nzb_targets.append(
                         {
                             "group": group,
@@ -222,8 +276,8 @@ def ingest_groups(
                         append_record(ingest_conn, fail)
                         continue
 
-                    nzb_files = parse_nzb(body_lines)
-                    for nzb_file in nzb_files:
+                    parsed = read_nzb_body(body_lines)
+                    for nzb_file in parsed.files if parsed else []:
                         record = {
                             "type": "nzb_file",
                             "group": (nzb_file.get("groups") or [group])[0],
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3.13
+import calendar
+import io
+import sqlite3
+import tarfile
+import time
+import zipfile
+import zlib
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+
+from app.db import iter_rows
+from app.nzb_store import decode_payload, nzb_file_name
+
+EXPORT_FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
+EXPORT_CHUNK_SIZE = 64 * 1024
+_KEY_BATCH = 500
+
+_EXPORT_SQL = """
+    SELECT
+        n.key,
+        n.name,
+        n.created_at,
+        COALESCE(b.payload, n.payload) AS payload,
+        CASE WHEN b.hash IS NULL THEN n.codec ELSE b.codec END AS codec
+    FROM nzbs n LEFT JOIN nzb_blobs b ON b.hash = n.payload_hash
+"""
+
+
+def _created_bound(value: str) -> str:
+    # created_at is stored as "YYYY-MM-DD HH:MM:SS" (UTC); accept ISO input too.
+    return value.strip().replace("T", " ").rstrip("Z")
+
+
+def iter_export_rows(
+    conn: sqlite3.Connection,
+    keys: Optional[list[str]] = None,
+    tag: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> Iterator[sqlite3.Row]:
+    """NZBs matching every given filter; until is exclusive."""
+    clauses = []
+    params: list[object] = []
+    if tag:
+        clauses.append("EXISTS (SELECT 1 FROM json_each(n.tags) WHERE lower(json_each.value) = ?)")
+        params.append(tag.strip().lower())
+    if since:
+        clauses.append("n.created_at >= ?")
+        params.append(_created_bound(since))
+    if until:
+        clauses.append("n.created_at < ?")
+        params.append(_created_bound(until))
+    # Payloads are large; fetch a few rows at a time.
+    if keys is None:
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        yield from iter_rows(conn, _EXPORT_SQL + where, params, arraysize=16)
+        return
+    keys = list(dict.fromkeys(keys))
+    for start in range(0, len(keys), _KEY_BATCH):
+        batch = keys[start : start + _KEY_BATCH]
+        where = " AND ".join(clauses + [f"n.key IN ({','.join('?' * len(batch))})"])
+        yield from iter_rows(conn, f"{_EXPORT_SQL} WHERE {where}", params + batch, arraysize=16)
+
+
+class _ChunkedOutput:
+    """Coalesces the archive writers' many small writes into chunk_size writes."""
+
+    def __init__(self, out: BinaryIO, chunk_size: int = EXPORT_CHUNK_SIZE):
+        self._out: Optional[BinaryIO] = out
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        if self._out is None:
+            return len(data)
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self._buffer and self._out is not None:
+            self._out.write(bytes(self._buffer))
+            self._buffer.clear()
+
+    def abort(self) -> None:
+        # Drop everything from here on, including the trailer ZipFile.close()
+        # writes, so a failed export never ends like a complete archive.
+        self._out = None
+        self._buffer.clear()
+
+
+def _created_timestamp(value: Optional[str]) -> float:
+    try:
+        return float(calendar.timegm(time.strptime(value or "", "%Y-%m-%d %H:%M:%S")))
+    except ValueError:
+        return time.time()
+
+
+def write_nzb_archive(
+    out: BinaryIO,
+    rows: Iterable[sqlite3.Row],
+    fmt: str = "zip",
+    on_skip: Optional[Callable[[str, Exception], None]] = None,
+) -> int:
+    """Stream rows as a ZIP or TAR of .nzb files to out; returns the number written.
+
+    Nothing is buffered beyond one payload and one output chunk, so out can
+    be a socket or a pipe. Rows whose stored payload does not decode are
+    left out and reported to on_skip(key, error). If rows raises, the
+    archive is cut off before its trailer.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    stream = _ChunkedOutput(out)
+    count = 0
+    if fmt == "zip":
+        archive = zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED)
+    else:
+        archive = tarfile.open(fileobj=stream, mode="w|")
+    try:
+        count = _write_members(archive, rows, fmt, on_skip)
+    except BaseException:
+        stream.abort()
+        raise
+    finally:
+        archive.close()
+    stream.flush()
+    return count
+
+
+def _write_members(archive, rows: Iterable[sqlite3.Row], fmt: str, on_skip) -> int:
+    count = 0
+    for row in rows:
+        try:
+            payload = decode_payload(row["payload"], row["codec"])
+        except (OSError, EOFError, zlib.error) as exc:
+            if on_skip is not None:
+                on_skip(row["key"], exc)
+            continue
+        if payload is None:
+            continue
+        name = nzb_file_name(row["key"], row["name"])
+        mtime = _created_timestamp(row["created_at"])
+        if fmt == "zip":
+            # ZIP timestamps cannot predate 1980.
+            info = zipfile.ZipInfo(name, date_time=time.gmtime(max(mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            archive.writestr(info, payload)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(payload)
+            info.mtime = mtime
+            info.mode = 0o644
+            archive.addfile(info, io.BytesIO(payload))
+        count += 1
+    return count
@@ -1,20 +1,32 @@
 #!/usr/bin/env python3.13
+import functools
+import gzip
 import hashlib
 import json
 import os
 import random
 import re
 import sqlite3
-from typing import Optional
-
-from app.nntp_client import NNTPClient
-from app.db import get_nzb_db, get_nzb_db_readonly, init_nzb_db
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+
+from app import db
+from app.bloom_filter import BloomFilter
+from app.nntp_client import NNTPClient, NNTPError
+from app.db import get_nzb_db, get_nzb_db_readonly, init_nzb_db, iter_rows
 from app.ingest import load_env
 from app.release_utils import build_tags
 from app.settings import get_bool_setting, get_int_setting, get_setting
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DEFAULT_NZB_DIR = os.path.join(BASE_DIR, "nzbs")
+SAVE_BATCH = 500
+# Stored in nzb_blobs.codec (and nzbs.codec for legacy inline payloads); NULL means raw XML.
+PAYLOAD_CODEC = "gzip"
 
 
 def _nzb_dir() -> str:
@@ -28,6 +40,12 @@ def _auto_save_enabled() -> bool:
     return get_bool_setting("TRICERAPOST_SAVE_NZBS", False)
 
 
+def resolve_nzb_workers(workers: Optional[int] = None) -> int:
+    if workers is None:
+        workers = get_int_setting("TRICERAPOST_NZB_WORKERS", 4)
+    return max(int(workers), 1)
+
+
 def ensure_nzb_dir() -> str:
     path = _nzb_dir()
     os.makedirs(path, exist_ok=True)
@@ -45,6 +63,48 @@ def build_nzb_key(seed: str) -> str:
     return hashlib.sha1(seed.encode("utf-8", errors="ignore")).hexdigest()
 
 
+def encode_payload(payload: bytes) -> bytes:
+    return gzip.compress(payload, compresslevel=6, mtime=0)
+
+
+def decode_payload(data: Optional[bytes], codec: Optional[str]) -> Optional[bytes]:
+    if data is None:
+        return None
+    if codec == PAYLOAD_CODEC:
+        return gzip.decompress(data)
+    return bytes(data)
+
+
+def payload_digest(payload: bytes) -> str:
+    """Content address of an NZB: sha256 of its XML with line endings and indentation normalized."""
+    lines = (line.strip() for line in payload.splitlines())
+    return hashlib.sha256(b"\n".join(line for line in lines if line)).hexdigest()
+
+
+_STORED_PAYLOAD_SQL = """
+    SELECT
+        n.name,
+        n.path,
+        n.payload_hash,
+        COALESCE(b.payload, n.payload) AS payload,
+        CASE WHEN b.hash IS NULL THEN n.codec ELSE b.codec END AS codec
+    FROM nzbs n LEFT JOIN nzb_blobs b ON b.hash = n.payload_hash
+    WHERE n.key = ?
+"""
+
+
+def load_stored_payload(conn: sqlite3.Connection, key: str) -> Optional[sqlite3.Row]:
+    """name, path, payload_hash, payload and codec of an NZB, from its blob or an inline legacy payload."""
+    cols = {row[1] for row in conn.execute("PRAGMA table_info(nzbs)")}
+    if "payload_hash" in cols:
+        return conn.execute(_STORED_PAYLOAD_SQL, (key,)).fetchone()
+    codec = "codec" if "codec" in cols else "NULL"
+    return conn.execute(
+        f"SELECT name, path, NULL AS payload_hash, payload, {codec} AS codec FROM nzbs WHERE key = ?",
+        (key,),
+    ).fetchone()
+
+
 def find_nzb_by_release(release_key: str) -> Optional[str]:
     if not release_key:
         return None
@@ -56,151 +116,510 @@ def find_nzb_by_release(release_key: str) -> Optional[str]:
     return row["key"] if row else None
 
 
-def store_nzb_payload(
-    *,
-    name: str,
-    payload: bytes,
-    source: str,
-    group_name: Optional[str] = None,
-    poster: Optional[str] = None,
-    release_key: Optional[str] = None,
-    nzb_source_subject: Optional[str] = None,
-    nzb_article: Optional[int] = None,
-    nzb_message_id: Optional[str] = None,
-    tags: Optional[list[str]] = None,
-) -> tuple[str, str]:
-    seed = "|".join(
-        [
-            source or "",
-            release_key or "",
-            nzb_message_id or "",
-            name or "",
-            group_name or "",
-        ]
-    )
-    key = build_nzb_key(seed)
-
-    conn = get_nzb_db()
-    init_nzb_db(conn)
-    existing = conn.execute("SELECT key, path FROM nzbs WHERE key = ?", (key,)).fetchone()
-    if existing:
+def load_nzb_release_keys() -> set[str]:
+    conn = get_nzb_db_readonly()
+    if conn is None:
+        return set()
+    try:
+        rows = conn.execute("SELECT DISTINCT release_key FROM nzbs WHERE release_key IS NOT NULL").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
         conn.close()
-        return existing["key"], existing["path"]
+    return {row["release_key"] for row in rows}
+
+
+_PAYLOAD_INSERT_SQL = """
+    INSERT INTO nzbs(
+        key, name, source, group_name, poster, release_key,
+        nzb_source_subject, nzb_article, nzb_message_id, bytes, path, payload_hash, tags
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_BLOB_INSERT_SQL = "INSERT OR IGNORE INTO nzb_blobs(hash, codec, bytes, payload) VALUES (?, ?, ?, ?)"
+_INVALID_INSERT_SQL = """
+    INSERT OR REPLACE INTO nzb_invalid(key, name, source, release_key, reason, payload)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
 
-    filename = sanitize_filename(name)
+
+def _nzb_filename(name: str) -> str:
+    filename = sanitize_filename(name or "nzb")
     if not filename.lower().endswith(".nzb"):
         filename = f"{filename}.nzb"
-    path = ""
+    return filename
 
-    tag_list = tags if tags is not None else build_tags(name, nzb_source_subject or "")
 
-    conn.execute(
-        """
-        INSERT INTO nzbs(
-            key, name, source, group_name, poster, release_key,
-            nzb_source_subject, nzb_article, nzb_message_id, bytes, path, payload, tags
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            key,
-            name,
-            source,
-            group_name,
-            poster,
-            release_key,
-            nzb_source_subject,
-            nzb_article,
-            nzb_message_id,
-            len(payload),
-            path,
-            sqlite3.Binary(payload),
-            json.dumps(tag_list),
-        ),
-    )
-    conn.commit()
-    conn.close()
+def nzb_file_name(key: str, name: str) -> str:
+    return f"{key[:8]}_{_nzb_filename(name)}"
 
-    if _auto_save_enabled():
-        saved_path = save_nzb_to_disk(key)
-        if saved_path:
-            _update_nzb_path(key, saved_path)
-            path = saved_path
-    return key, path
 
+def _nzb_path(key: str, name: str, directory: Optional[str] = None) -> str:
+    return os.path.join(directory or _nzb_dir(), nzb_file_name(key, name))
 
-def store_nzb_invalid(
-    *,
-    name: str,
-    source: str,
-    reason: str,
-    release_key: Optional[str] = None,
-    payload: Optional[bytes] = None,
-) -> None:
-    conn = get_nzb_db()
-    init_nzb_db(conn)
-    key = build_nzb_key("|".join([source or "", release_key or "", name or ""]))
-    conn.execute(
+
+def _replace_atomically(path: str, create: Callable[[str], None]) -> Optional[str]:
+    """Build the file under a temporary name next to path, then rename it into place."""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.part")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        create(tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return None
+    return path
+
+
+def _write_nzb_file(path: str, payload: bytes) -> Optional[str]:
+    def write(tmp_path: str) -> None:
+        with open(tmp_path, "wb") as handle:
+            handle.write(payload)
+
+    return _replace_atomically(path, write)
+
+
+def _link_nzb_file(source: str, path: str) -> Optional[str]:
+    """Hardlink path to an already written copy; None when the filesystem refuses."""
+    try:
+        if os.path.exists(path) and os.path.samefile(source, path):
+            return path
+    except OSError:
+        return None
+    return _replace_atomically(path, lambda tmp_path: os.link(source, tmp_path))
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class NzbStore:
+    """One initialized NZB DB connection shared by many writes.
+
+    Writes join an open transaction that is committed every `batch_size`
+    writes or `batch_seconds`, whichever comes first, and on commit() or a
+    clean close. The SQL text is fixed, so sqlite3 reuses its prepared
+    statements.
+
+    The open transaction holds the DB write lock, so while a store is open
+    it must be the only writer to its NZB DB in this process; other
+    writes go through it (verification results reach it via the segment
+    status cache). A timer commits the batch `batch_seconds` after its
+    first write even if nothing else is written, so writers in other
+    processes wait at most that long. Calls are serialized by a lock.
+    """
+
+    def __init__(self, path: Optional[str] = None, batch_size: int = 100, batch_seconds: float = 2.0):
+        self.batch_size = max(batch_size, 1)
+        self.batch_seconds = batch_seconds
+        self._conn = get_nzb_db(path)
+        init_nzb_db(self._conn)
+        self._pending = 0
+        self._stored: list[str] = []
+        self._committed_at = time.monotonic()
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+        # Segment status rows from verifications join this store's transactions.
+        self._status_cache = segment_status_cache(path)
+        if self._status_cache is not None:
+            self._status_cache.attach(self)
+
+    @_locked
+    def find_by_release(self, release_key: str) -> Optional[str]:
+        if not release_key:
+            return None
+        row = self._conn.execute("SELECT key FROM nzbs WHERE release_key = ?", (release_key,)).fetchone()
+        return row["key"] if row else None
+
+    @_locked
+    def release_keys(self) -> set[str]:
+        rows = self._conn.execute("SELECT DISTINCT release_key FROM nzbs WHERE release_key IS NOT NULL")
+        return {row["release_key"] for row in rows}
+
+    @_locked
+    def store_payload(
+        self,
+        *,
+        name: str,
+        payload: bytes,
+        source: str,
+        group_name: Optional[str] = None,
+        poster: Optional[str] = None,
+        release_key: Optional[str] = None,
+        nzb_source_subject: Optional[str] = None,
+        nzb_article: Optional[int] = None,
+        nzb_message_id: Optional[str] = None,
+        tags: Optional[list[str]] = None,
+    ) -> tuple[str, str]:
+        """Insert an NZB unless its key already exists; returns (key, path).
+
+        The path of a new NZB is empty until it is committed and auto-saved.
         """
-        INSERT OR REPLACE INTO nzb_invalid(key, name, source, release_key, reason, payload)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (key, name, source, release_key, reason, sqlite3.Binary(payload) if payload else None),
-    )
-    conn.commit()
-    conn.close()
+        seed = "|".join(
+            [
+                source or "",
+                release_key or "",
+                nzb_message_id or "",
+                name or "",
+                group_name or "",
+            ]
+        )
+        key = build_nzb_key(seed)
+        existing = self._conn.execute("SELECT key, path FROM nzbs WHERE key = ?", (key,)).fetchone()
+        if existing:
+            return existing["key"], existing["path"]
+
+        digest = payload_digest(payload)
+        if self._conn.execute("SELECT 1 FROM nzb_blobs WHERE hash = ?", (digest,)).fetchone() is None:
+            self._conn.execute(
+                _BLOB_INSERT_SQL,
+                (digest, PAYLOAD_CODEC, len(payload), sqlite3.Binary(encode_payload(payload))),
+            )
+        tag_list = tags if tags is not None else build_tags(name, nzb_source_subject or "")
+        self._conn.execute(
+            _PAYLOAD_INSERT_SQL,
+            (
+                key,
+                name,
+                source,
+                group_name,
+                poster,
+                release_key,
+                nzb_source_subject,
+                nzb_article,
+                nzb_message_id,
+                len(payload),
+                "",
+                digest,
+                json.dumps(tag_list),
+            ),
+        )
+        self._stored.append(key)
+        self._wrote()
+        return key, ""
+
+    @_locked
+    def store_invalid(
+        self,
+        *,
+        name: str,
+        source: str,
+        reason: str,
+        release_key: Optional[str] = None,
+        payload: Optional[bytes] = None,
+    ) -> None:
+        key = build_nzb_key("|".join([source or "", release_key or "", name or ""]))
+        self._conn.execute(
+            _INVALID_INSERT_SQL,
+            (key, name, source, release_key, reason, sqlite3.Binary(payload) if payload else None),
+        )
+        self._wrote()
+
+    @_locked
+    def update_path(self, key: str, path: str) -> None:
+        self._conn.execute("UPDATE nzbs SET path = ? WHERE key = ?", (path, key))
+
+    @_locked
+    def update_paths(self, saved: list[tuple[str, str]]) -> None:
+        self._conn.executemany("UPDATE nzbs SET path = ? WHERE key = ?", [(path, key) for key, path in saved])
+
+    @_locked
+    def save_to_disk(self, keys: list[str], directory: Optional[str] = None) -> dict[str, str]:
+        """Write NZBs to disk and record their paths (uncommitted).
+
+        Each distinct payload is written once; NZBs sharing it are hardlinked
+        to the first copy on disk, falling back to a plain write.
+        """
+        saved = {}
+        copies: dict[str, str] = {}
+        for key in keys:
+            row = self._conn.execute("SELECT name, payload_hash FROM nzbs WHERE key = ?", (key,)).fetchone()
+            if not row:
+                continue
+            digest = row["payload_hash"]
+            path = _nzb_path(key, row["name"], directory)
+            source = (copies.get(digest) or self._saved_copy(digest)) if digest else None
+            written = _link_nzb_file(source, path) if source else None
+            if written is None:
+                stored = load_stored_payload(self._conn, key)
+                if stored is None or stored["payload"] is None:
+                    continue
+                written = _write_nzb_file(path, decode_payload(stored["payload"], stored["codec"]))
+            if written:
+                if digest:
+                    copies.setdefault(digest, written)
+                self.update_path(key, written)
+                saved[key] = written
+        return saved
+
+    def _saved_copy(self, digest: str) -> Optional[str]:
+        for row in self._conn.execute("SELECT path FROM nzbs WHERE payload_hash = ? AND path != ''", (digest,)):
+            if os.path.exists(row["path"]):
+                return row["path"]
+        return None
 
+    def _wrote(self) -> None:
+        self._pending += 1
+        # Commit in batches, but never hold the write lock for long.
+        if self._pending >= self.batch_size or time.monotonic() - self._committed_at >= self.batch_seconds:
+            self.commit()
+        else:
+            self.schedule_commit()
+
+    @_locked
+    def schedule_commit(self) -> None:
+        """Make sure a commit happens within batch_seconds."""
+        if self._timer is None and not self._closed:
+            self._timer = threading.Timer(self.batch_seconds, self._commit_due)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @_locked
+    def _commit_due(self) -> None:
+        self._timer = None
+        if not self._closed:
+            self.commit()
+
+    def _cancel_timer(self) -> None:
+        timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+
+    @_locked
+    def commit(self) -> dict[str, str]:
+        """Commit pending writes, then auto-save the new NZBs; returns their paths."""
+        self._cancel_timer()
+        if self._status_cache is not None:
+            self._status_cache.flush_into(self._conn)
+        self._conn.commit()
+        stored, self._stored = self._stored, []
+        self._pending = 0
+        self._committed_at = time.monotonic()
+        if not stored or not _auto_save_enabled():
+            return {}
+        saved = self.save_to_disk(stored)
+        self._conn.commit()
+        return saved
+
+    @_locked
+    def close(self) -> None:
+        self._cancel_timer()
+        self._closed = True
+        self._conn.close()
+        if self._status_cache is not None:
+            self._status_cache.detach(self)
+            self._status_cache = None
+
+    def __enter__(self) -> "NzbStore":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self.close()
+
+
+def store_nzb_payload(**fields) -> tuple[str, str]:
+    """One-off NzbStore.store_payload, committed and auto-saved before returning."""
+    with NzbStore() as store:
+        key, path = store.store_payload(**fields)
+        path = store.commit().get(key, path)
+    return key, path
 
-def _update_nzb_path(key: str, path: str) -> None:
-    conn = get_nzb_db()
-    init_nzb_db(conn)
-    conn.execute("UPDATE nzbs SET path = ? WHERE key = ?", (path, key))
-    conn.commit()
-    conn.close()
+
+def store_nzb_invalid(**fields) -> None:
+    with NzbStore() as store:
+        store.store_invalid(**fields)
 
 
 def save_nzb_to_disk(key: str, directory: Optional[str] = None) -> Optional[str]:
     conn = get_nzb_db_readonly()
     if conn is None:
         return None
-    row = conn.execute("SELECT name, payload FROM nzbs WHERE key = ?", (key,)).fetchone()
-    conn.close()
-    if not row:
-        return None
-    payload = row["payload"]
-    if payload is None:
+    try:
+        row = load_stored_payload(conn, key)
+    finally:
+        conn.close()
+    if not row or row["payload"] is None:
         return None
+    return _write_nzb_file(_nzb_path(key, row["name"], directory), decode_payload(row["payload"], row["codec"]))
 
-    filename = sanitize_filename(row["name"] or "nzb")
-    if not filename.lower().endswith(".nzb"):
-        filename = f"{filename}.nzb"
-    target_dir = directory or _nzb_dir()
-    path = os.path.join(target_dir, f"{key[:8]}_{filename}")
+
+@dataclass(slots=True)
+class _SaveJob:
+    """Files to write for one distinct payload; source is a copy already on disk."""
+
+    blob_hash: Optional[str]
+    inline_key: Optional[str]
+    source: Optional[str] = None
+    targets: list[tuple[str, str]] = field(default_factory=list)
+
+
+def _pending_saves(conn: sqlite3.Connection, directory: Optional[str]) -> list[_SaveJob]:
+    target_dir = os.path.normpath(directory or _nzb_dir())
+    # One listdir instead of a stat per NZB for files in the target directory.
     try:
-        os.makedirs(target_dir, exist_ok=True)
-        with open(path, "wb") as handle:
-            handle.write(payload)
+        present = set(os.listdir(target_dir))
     except OSError:
-        return None
-    return path
+        present = set()
+
+    def on_disk(path: str) -> bool:
+        if not path:
+            return False
+        if os.path.dirname(os.path.normpath(path)) == target_dir:
+            return os.path.basename(path) in present
+        return os.path.exists(path)
+
+    jobs: dict[str, _SaveJob] = {}
+    for row in iter_rows(conn, "SELECT key, name, path, payload_hash FROM nzbs"):
+        digest = row["payload_hash"]
+        job = jobs.get(digest or row["key"])
+        if job is None:
+            job = jobs[digest or row["key"]] = _SaveJob(digest, None if digest else row["key"])
+        if on_disk(row["path"]):
+            job.source = job.source or row["path"]
+        else:
+            job.targets.append((row["key"], _nzb_path(row["key"], row["name"], directory)))
+    return [job for job in jobs.values() if job.targets]
+
+
+def _iter_save_payloads(
+    conn: sqlite3.Connection, jobs: list[_SaveJob]
+) -> Iterator[tuple[_SaveJob, Optional[bytes], Optional[str]]]:
+    """Yields (job, stored payload, codec), reading payloads a batch at a time."""
+    for start in range(0, len(jobs), SAVE_BATCH):
+        batch = jobs[start : start + SAVE_BATCH]
+        hashes = [job.blob_hash for job in batch if job.source is None and job.blob_hash]
+        keys = [job.inline_key for job in batch if job.source is None and job.inline_key]
+        stored = {}
+        if hashes:
+            marks = ",".join("?" * len(hashes))
+            for row in conn.execute(f"SELECT hash, payload, codec FROM nzb_blobs WHERE hash IN ({marks})", hashes):
+                stored[row["hash"]] = (row["payload"], row["codec"])
+        if keys:
+            marks = ",".join("?" * len(keys))
+            for row in conn.execute(f"SELECT key, payload, codec FROM nzbs WHERE key IN ({marks})", keys):
+                stored[row["key"]] = (row["payload"], row["codec"])
+        for job in batch:
+            yield job, *stored.get(job.blob_hash or job.inline_key, (None, None))
+
+
+def _save_job(job: _SaveJob, data: Optional[bytes], codec: Optional[str]) -> list[tuple[str, str]]:
+    source = job.source
+    saved = []
+    for key, path in job.targets:
+        written = _link_nzb_file(source, path) if source else None
+        if written is None and data is not None:
+            written = _write_nzb_file(path, decode_payload(data, codec))
+        if written:
+            saved.append((key, written))
+            source = source or written
+    return saved
 
 
-def save_all_nzbs_to_disk(directory: Optional[str] = None) -> int:
+def save_all_nzbs_to_disk(
+    directory: Optional[str] = None,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """Write every NZB that is not on disk yet; returns the number saved.
+
+    Payloads are read in batches from one connection and written by a
+    thread pool, once per distinct payload, with duplicates hardlinked.
+    Paths are recorded in a single transaction at the end. progress(done,
+    total) is called as files are finished.
+    """
     conn = get_nzb_db_readonly()
     if conn is None:
         return 0
-    rows = conn.execute("SELECT key, path FROM nzbs").fetchall()
-    conn.close()
-    saved = 0
-    for row in rows:
-        key = row["key"]
-        path = row["path"] or ""
-        if path and os.path.exists(path):
-            continue
-        saved_path = save_nzb_to_disk(key, directory)
-        if saved_path:
-            _update_nzb_path(key, saved_path)
-            saved += 1
-    return saved
+    workers = resolve_nzb_workers(workers)
+    saved: list[tuple[str, str]] = []
+    try:
+        jobs = _pending_saves(conn, directory)
+        total = sum(len(job.targets) for job in jobs)
+        done = 0
+        if progress:
+            progress(done, total)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            in_flight: deque = deque()
+
+            def finish() -> None:
+                nonlocal done
+                job, future = in_flight.popleft()
+                saved.extend(future.result())
+                done += len(job.targets)
+                if progress:
+                    progress(done, total)
+
+            for job, data, codec in _iter_save_payloads(conn, jobs):
+                in_flight.append((job, pool.submit(_save_job, job, data, codec)))
+                if len(in_flight) >= workers * 2:
+                    finish()
+            while in_flight:
+                finish()
+    finally:
+        conn.close()
+    if saved:
+        with NzbStore() as store:
+            store.update_paths(saved)
+    return len(saved)
+
+
+def migrate_stored_payloads(batch_size: int = 200, stop_event: Optional[threading.Event] = None) -> int:
+    """Move inline nzbs.payload values into gzip nzb_blobs; returns the number moved.
+
+    Works through nzbs in rowid order, hashing and compressing outside the
+    write lock and committing one batch at a time, so it can run next to
+    the pipeline.
+    """
+    if not os.path.exists(db.NZB_DB_PATH):
+        return 0
+    conn = get_nzb_db()
+    init_nzb_db(conn)
+    moved = 0
+    last_rowid = 0
+    try:
+        while stop_event is None or not stop_event.is_set():
+            rows = conn.execute(
+                "SELECT rowid, payload, codec FROM nzbs WHERE rowid > ? AND payload IS NOT NULL ORDER BY rowid LIMIT ?",
+                (last_rowid, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            blobs = {}
+            updates = []
+            for row in rows:
+                payload = decode_payload(row["payload"], row["codec"])
+                digest = payload_digest(payload)
+                updates.append((digest, row["rowid"]))
+                if digest in blobs or conn.execute("SELECT 1 FROM nzb_blobs WHERE hash = ?", (digest,)).fetchone():
+                    continue
+                blobs[digest] = (digest, PAYLOAD_CODEC, len(payload), sqlite3.Binary(encode_payload(payload)))
+            conn.executemany(_BLOB_INSERT_SQL, blobs.values())
+            conn.executemany(
+                """
+                UPDATE nzbs SET payload = NULL, codec = NULL, payload_hash = ?
+                WHERE rowid = ? AND payload IS NOT NULL
+                """,
+                updates,
+            )
+            conn.commit()
+            moved += len(rows)
+            last_rowid = rows[-1]["rowid"]
+    finally:
+        conn.close()
+    return moved
 
 
 def _connect_nntp() -> Optional[NNTPClient]:
@@ -227,36 +646,294 @@ def _connect_nntp() -> Optional[NNTPClient]:
     return client
 
 
-def verify_message_ids(message_ids: list[str]) -> tuple[bool, Optional[str]]:
-    if not message_ids:
-        return False, "no segments"
+class NNTPSession:
+    """An NNTP connection opened on first use and kept for later verifications.
+
+    Not thread-safe; Verifier lends each caller its own session.
+    """
+
+    def __init__(self):
+        self._client: Optional[NNTPClient] = None
 
+    def client(self) -> Optional[NNTPClient]:
+        if self._client is None:
+            self._client = _connect_nntp()
+        return self._client
+
+    def close(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                client.quit()
+            except Exception:
+                pass
+
+
+def _verify_targets(message_ids: list[str]) -> list[str]:
     sample = get_int_setting("TRICERAPOST_NZB_VERIFY_SAMPLE", 0)
-    targets = message_ids
-    if sample > 0 and len(message_ids) > sample:
-        head = message_ids[:1]
-        tail = message_ids[-1:]
-        middle = message_ids[1:-1]
-        pick = random.sample(middle, min(sample - len(head) - len(tail), len(middle))) if middle else []
-        targets = list(dict.fromkeys(head + pick + tail))
+    if sample <= 0 or len(message_ids) <= sample:
+        return message_ids
+    head = message_ids[:1]
+    tail = message_ids[-1:]
+    middle = message_ids[1:-1]
+    pick = random.sample(middle, min(sample - len(head) - len(tail), len(middle))) if middle else []
+    return list(dict.fromkeys(head + pick + tail))
+
+
+def _is_status_error(exc: Exception) -> bool:
+    # The server answered with a status line rather than dropping the connection.
+    text = str(exc)
+    return isinstance(exc, NNTPError) and text[:3].isdigit()
+
+
+def _is_missing_article(exc: Exception) -> bool:
+    return _is_status_error(exc) and str(exc)[:3] in {"423", "430"}
+
+
+class SegmentStatusCache:
+    """Remembers STAT results per message-id for `ttl` seconds.
+
+    Rows live in the NZB DB (segment_status). Known-missing ids are also
+    kept in an in-memory Bloom filter so a bad release fails without a
+    query for each of its segments. Safe to share between threads.
+
+    While an NzbStore on the same DB is open it holds the write lock
+    between its batch commits, so new rows wait in memory and the store
+    writes them in its own transaction (flush_into) within its
+    batch_seconds. With no store attached they are written straight away.
+    """
+
+    def __init__(self, path: str, ttl: int):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = get_nzb_db(path)
+        init_nzb_db(self._conn)
+        self._conn.execute("DELETE FROM segment_status WHERE checked_at < ?", (self._cutoff(),))
+        self._conn.commit()
+        self._missing = self._load_missing()
+        self._pending: dict[str, tuple[int, int]] = {}
+        self._writers: list["NzbStore"] = []
+
+    def _cutoff(self) -> int:
+        return int(time.time()) - self.ttl
+
+    def _load_missing(self, capacity: int = 0) -> BloomFilter:
+        rows = self._conn.execute(
+            "SELECT message_id FROM segment_status WHERE present = 0 AND checked_at >= ?", (self._cutoff(),)
+        ).fetchall()
+        bloom = BloomFilter(max(capacity, len(rows) * 2, 10_000))
+        for row in rows:
+            bloom.add(row[0])
+        return bloom
+
+    def known_missing(self, message_ids: list[str]) -> Optional[str]:
+        """First id recently seen missing, if any."""
+        with self._lock:
+            for msg in message_ids:
+                if msg not in self._missing:
+                    continue
+                if msg in self._pending:
+                    if self._pending[msg][0] == 0:
+                        return msg
+                    continue
+                row = self._conn.execute(
+                    "SELECT 1 FROM segment_status WHERE message_id = ? AND present = 0 AND checked_at >= ?",
+                    (msg, self._cutoff()),
+                ).fetchone()
+                if row:
+                    return msg
+        return None
+
+    def unchecked(self, message_ids: list[str]) -> list[str]:
+        """The ids not recently seen present."""
+        with self._lock:
+            fresh = {msg for msg in message_ids if self._pending.get(msg, (0, 0))[0] == 1}
+            for idx in range(0, len(message_ids), 500):
+                chunk = message_ids[idx : idx + 500]
+                rows = self._conn.execute(
+                    f"SELECT message_id FROM segment_status WHERE message_id IN ({','.join('?' * len(chunk))}) "
+                    "AND present = 1 AND checked_at >= ?",
+                    (*chunk, self._cutoff()),
+                ).fetchall()
+                fresh.update(row[0] for row in rows if row[0] not in self._pending)
+        return [msg for msg in message_ids if msg not in fresh]
+
+    def record(self, present: list[str], missing: Optional[str] = None) -> None:
+        now = int(time.time())
+        rows = [(msg, 1, now) for msg in present]
+        if missing:
+            rows.append((missing, 0, now))
+        if not rows:
+            return
+        with self._lock:
+            for msg, present_flag, checked_at in rows:
+                self._pending[msg] = (present_flag, checked_at)
+            if missing:
+                if self._missing.is_full():
+                    self._missing = self._load_missing(self._missing.capacity * 2)
+                self._missing.add(missing)
+            writers = list(self._writers)
+            if not writers:
+                self._flush_locked(self._conn)
+                self._conn.commit()
+        if writers:
+            # Outside our lock: the store's commit takes its lock, then ours.
+            writers[0].schedule_commit()
+
+    def _flush_locked(self, conn: sqlite3.Connection) -> None:
+        if self._pending:
+            conn.executemany(
+                "INSERT OR REPLACE INTO segment_status VALUES (?, ?, ?)",
+                [(msg, present, checked_at) for msg, (present, checked_at) in self._pending.items()],
+            )
+            self._pending.clear()
+
+    def flush_into(self, conn: sqlite3.Connection) -> None:
+        """Write buffered rows on conn; the caller commits."""
+        with self._lock:
+            self._flush_locked(conn)
+
+    def attach(self, store: "NzbStore") -> None:
+        with self._lock:
+            self._writers.append(store)
+
+    def detach(self, store: "NzbStore") -> None:
+        with self._lock:
+            if store in self._writers:
+                self._writers.remove(store)
+            if not self._writers and self._pending:
+                self._flush_locked(self._conn)
+                self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_STATUS_CACHES: dict[str, SegmentStatusCache] = {}
+_STATUS_CACHES_LOCK = threading.Lock()
+
+
+def segment_status_cache(path: Optional[str] = None) -> Optional[SegmentStatusCache]:
+    """Shared cache for the NZB DB at path (default: the current one); None when TRICERAPOST_SEGMENT_STATUS_TTL is 0."""
+    ttl = get_int_setting("TRICERAPOST_SEGMENT_STATUS_TTL", 7 * 24 * 3600)
+    if ttl <= 0:
+        return None
+    path = path or db.NZB_DB_PATH
+    with _STATUS_CACHES_LOCK:
+        cache = _STATUS_CACHES.get(path)
+        if cache is None or cache.ttl != ttl:
+            if cache is not None:
+                cache.close()
+            cache = _STATUS_CACHES[path] = SegmentStatusCache(path, ttl)
+    return cache
+
+
+def verify_message_ids(
+    message_ids: list[str],
+    session: Optional[NNTPSession] = None,
+    cache: Optional[SegmentStatusCache] = None,
+) -> tuple[bool, Optional[str]]:
+    """STAT every (or a sample of) message-id; returns (ok, reason).
+
+    Ids with a fresh entry in the segment status cache are not STAT'ed
+    again, and a recently missing id fails the check at once. A session
+    keeps its connection for the next call unless the server answers with
+    anything other than a missing-article status. If the connection drops,
+    it is reopened and the check retried once.
+    """
+    if not message_ids:
+        return False, "no segments"
 
+    targets = []
+    for msg_id in _verify_targets(message_ids):
+        msg = msg_id.strip()
+        if not msg:
+            return False, "missing message-id"
+        targets.append(msg if msg.startswith("<") else f"<{msg}>")
+
+    if cache is None:
+        cache = segment_status_cache()
+    if cache is not None:
+        missing = cache.known_missing(targets)
+        if missing:
+            return False, f"430 {missing} (cached)"
+        targets = cache.unchecked(targets)
+        if not targets:
+            return True, None
+
+    owned = session is None
+    if owned:
+        session = NNTPSession()
+    present: list[str] = []
+    missing = None
     try:
-        client = _connect_nntp()
-        if client is None:
-            return False, "NNTP_HOST not set"
-        for msg_id in targets:
-            msg = msg_id.strip()
-            if not msg:
-                return False, "missing message-id"
-            if not msg.startswith("<"):
-                msg = f"<{msg}>"
-            client.stat(msg)
-        return True, None
-    except Exception as exc:
-        return False, str(exc)
+        for attempt in range(2):
+            try:
+                client = session.client()
+                if client is None:
+                    return False, "NNTP_HOST not set"
+                for msg in targets[len(present) :]:
+                    current = msg
+                    client.stat(msg)
+                    present.append(msg)
+                return True, None
+            except Exception as exc:
+                if _is_missing_article(exc):
+                    # "430 No such article": the connection is still good.
+                    missing = current
+                    return False, str(exc)
+                # Any other failure, including a status such as "480 Authentication
+                # required" or "502 Service unavailable", may leave the connection
+                # unusable, so the session reconnects on its next use.
+                session.close()
+                if attempt or _is_status_error(exc):
+                    return False, str(exc)
     finally:
+        if cache is not None:
+            cache.record(present, missing)
+        if owned:
+            session.close()
+
+
+class Verifier:
+    """Verifies message-ids over NNTP sessions kept open between calls.
+
+    Safe to share between threads: each call borrows an idle session or
+    opens a new one, so there are never more sessions than concurrent
+    callers. Close it (or use it as a context manager) when done.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle: list[NNTPSession] = []
+        self._sessions: list[NNTPSession] = []
+
+    def verify(self, message_ids: list[str]) -> tuple[bool, Optional[str]]:
+        with self._lock:
+            if self._idle:
+                session = self._idle.pop()
+            else:
+                session = NNTPSession()
+                self._sessions.append(session)
         try:
-            if "client" in locals() and client is not None:
-                client.quit()
-        except Exception:
-            pass
+            return verify_message_ids(message_ids, session)
+        finally:
+            with self._lock:
+                self._idle.append(session)
+
+    def session_count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions, self._idle = self._sessions, [], []
+        for session in sessions:
+            session.close()
+
+    def __enter__(self) -> "Verifier":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -1,42 +1,212 @@
 #!/usr/bin/env python3.13
+import codecs
+import io
+import re
 import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from itertools import chain
+from typing import BinaryIO, Iterable, Iterator, Optional
 
-from app.release_utils import NZB_HINT_RE, decode_yenc
+from app.release_utils import decode_yenc
 
 type NzbSegment = dict[str, int | str]
 
-def build_nzb_payload(lines: list[str]) -> bytes | None:
-    text = "\n".join(lines)
-    if NZB_HINT_RE.search(text):
-        return text.encode("utf-8", errors="ignore")
+NZB_HINT_BYTES_RE = re.compile(rb"<nzb\b", re.IGNORECASE)
+PARSE_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass(slots=True)
+class ParsedNzb:
+    payload: bytes
+    files: list[dict]
+    segments: list[NzbSegment]
+
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def _int_attr(elem: ET.Element, name: str) -> int:
+    try:
+        return int(elem.attrib.get(name, "0"))
+    except ValueError:
+        return 0
+
+
+def iter_nzb_events(payload: bytes) -> Iterator[tuple[str, dict]]:
+    """Single incremental pass over NZB XML.
+
+    Yields ("segment", segment) as each segment closes and ("file", summary)
+    as each file closes. Parsed elements are detached as soon as they are
+    handled, so memory stays flat however many segments the NZB has.
+    Raises ET.ParseError on malformed XML.
+
+    The payload is UTF-8 (article lines are decoded before it is built), so
+    it is fed to the parser as text: an encoding="iso-8859-1" declaration
+    would otherwise make expat decode the UTF-8 bytes a second time.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    view = memoryview(payload)
+    open_elems: list[ET.Element] = []
+    current: Optional[dict] = None
+    chunks = (view[start : start + PARSE_CHUNK_SIZE] for start in range(0, len(view), PARSE_CHUNK_SIZE))
+    for chunk in chain(chunks, [None]):
+        if chunk is None:
+            parser.feed(decoder.decode(b"", final=True))
+            parser.close()
+        else:
+            parser.feed(decoder.decode(chunk))
+        for event, elem in parser.read_events():
+            if event == "start":
+                open_elems.append(elem)
+                if _local_name(elem.tag) == "file":
+                    current = {
+                        "subject": elem.attrib.get("subject", ""),
+                        "poster": elem.attrib.get("poster", ""),
+                        "groups": [],
+                        "segments": 0,
+                        "bytes": 0,
+                    }
+                continue
+            open_elems.pop()
+            name = _local_name(elem.tag)
+            if name == "segment":
+                size = _int_attr(elem, "bytes")
+                if current is not None:
+                    current["segments"] += 1
+                    current["bytes"] += size
+                message_id = (elem.text or "").strip()
+                if message_id.startswith("<") and message_id.endswith(">"):
+                    message_id = message_id.removeprefix("<").removesuffix(">").strip()
+                if message_id:
+                    yield "segment", {"message_id": message_id, "bytes": size, "number": _int_attr(elem, "number")}
+            elif name == "group" and current is not None and elem.text and elem.text.strip():
+                current["groups"].append(elem.text.strip())
+            elif name == "file" and current is not None:
+                yield "file", current
+                current = None
+        # Everything below an open element has been handled; drop it.
+        for elem in open_elems:
+            del elem[:]
+
+
+def nzb_payload_from_lines(lines: list[str]) -> bytes | None:
+    """The NZB XML carried by an article body, plain or yEnc-encoded; None when there is none."""
+    payload = b"\n".join(line.encode("utf-8", errors="ignore") for line in lines)
+    if NZB_HINT_BYTES_RE.search(payload):
+        return payload
     if any(line.startswith("=ybegin") for line in lines):
-        decoded = decode_yenc(lines).decode("utf-8", errors="ignore")
-        if NZB_HINT_RE.search(decoded):
-            return decoded.encode("utf-8")
+        decoded = decode_yenc(lines).decode("utf-8", errors="ignore").encode("utf-8")
+        if NZB_HINT_BYTES_RE.search(decoded):
+            return decoded
     return None
 
 
+def read_nzb_body(lines: list[str]) -> ParsedNzb | None:
+    """Payload, file summaries and segments of an NZB article body, parsed in one pass.
+
+    None when the body holds no NZB; malformed XML keeps the payload with no
+    files or segments.
+    """
+    payload = nzb_payload_from_lines(lines)
+    if payload is None:
+        return None
+    parsed = ParsedNzb(payload, [], [])
+    try:
+        for kind, value in iter_nzb_events(payload):
+            if kind == "segment":
+                parsed.segments.append(value)
+            else:
+                parsed.files.append(value)
+    except ET.ParseError:
+        parsed.files.clear()
+        parsed.segments.clear()
+    return parsed
+
+
 def parse_nzb_segments(payload: bytes) -> list[NzbSegment]:
     try:
-        root = ET.fromstring(payload)
+        return [value for kind, value in iter_nzb_events(payload) if kind == "segment"]
     except ET.ParseError:
         return []
-    segments = []
-    for seg in root.findall(".//{*}segments/{*}segment"):
-        message_id = (seg.text or "").strip()
-        if message_id.startswith("<") and message_id.endswith(">"):
-            message_id = message_id.removeprefix("<").removesuffix(">").strip()
-        try:
-            size = int(seg.attrib.get("bytes", "0"))
-        except ValueError:
-            size = 0
-        try:
-            number = int(seg.attrib.get("number", "0"))
-        except ValueError:
-            number = 0
-        if message_id:
-            segments.append({"message_id": message_id, "bytes": size, "number": number})
-    return segments
+
+
+NZB_XMLNS = "http://www.newzbin.com/DTD/2003/nzb"
+WRITE_CHUNK_SIZE = 64 * 1024
+_CDATA_ESCAPES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+_ATTRIB_ESCAPES = str.maketrans(
+    {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "\r": "&#13;", "\n": "&#10;", "\t": "&#09;"}
+)
+
+
+def _attr(value: object) -> str:
+    return str(value).translate(_ATTRIB_ESCAPES)
+
+
+def group_segments_by_file(segments: Iterable[NzbSegment], name: str) -> list[tuple[str, list[NzbSegment]]]:
+    """Split segments into (subject, segments) per "filename"; segments without one belong to name."""
+    files: dict[str, list[NzbSegment]] = {}
+    for segment in segments:
+        files.setdefault(str(segment.get("filename") or name), []).append(segment)
+    return list(files.items()) or [(name, [])]
+
+
+def write_nzb_xml(
+    out: BinaryIO,
+    *,
+    poster: str | None,
+    groups: list[str],
+    files: Iterable[tuple[str, Iterable[NzbSegment]]],
+) -> int:
+    """Stream NZB XML for (subject, segments) files to out; returns the bytes written.
+
+    The output is byte-for-byte what ElementTree.tostring(encoding="utf-8",
+    xml_declaration=True) produces for the same tree, without building it.
+    """
+    pending: list[str] = []
+    pending_size = 0
+    written = 0
+
+    def emit(text: str) -> None:
+        nonlocal pending_size, written
+        pending.append(text)
+        pending_size += len(text)
+        if pending_size >= WRITE_CHUNK_SIZE:
+            data = "".join(pending).encode("utf-8", "xmlcharrefreplace")
+            out.write(data)
+            written += len(data)
+            pending.clear()
+            pending_size = 0
+
+    group_names = [group for group in groups if group]
+    poster_attr = _attr(poster or "")
+    emit(f"<?xml version='1.0' encoding='utf-8'?>\n<nzb xmlns=\"{NZB_XMLNS}\">")
+    for subject, segments in files:
+        emit(f'<file poster="{poster_attr}" subject="{_attr(subject)}" date="0">')
+        if group_names:
+            emit("<groups>" + "".join(f"<group>{group.translate(_CDATA_ESCAPES)}</group>" for group in group_names))
+            emit("</groups>")
+        else:
+            emit("<groups />")
+        opened = False
+        for segment in segments:
+            if not opened:
+                emit("<segments>")
+                opened = True
+            message_id = str(segment.get("message_id") or "")
+            if message_id.startswith("<") and message_id.endswith(">"):
+                message_id = message_id.removeprefix("<").removesuffix(">").strip()
+            attrs = f'bytes="{_attr(segment.get("bytes") or 0)}" number="{_attr(segment.get("number") or 0)}"'
+            if message_id:
+                emit(f"<segment {attrs}>{message_id.translate(_CDATA_ESCAPES)}</segment>")
+            else:
+                emit(f"<segment {attrs} />")
+        emit("</segments></file>" if opened else "<segments /></file>")
+    emit("</nzb>")
+    data = "".join(pending).encode("utf-8", "xmlcharrefreplace")
+    out.write(data)
+    return written + len(data)
 
 
 def build_nzb_xml(
@@ -44,34 +214,8 @@ def build_nzb_xml(
     name: str,
     poster: str | None,
     groups: list[str],
-    segments: list[NzbSegment],
+    segments: Iterable[NzbSegment],
 ) -> bytes:
-    nzb = ET.Element("nzb", {"xmlns": "http://www.newzbin.com/DTD/2003/nzb"})
-    file_elem = ET.SubElement(
-        nzb,
-        "file",
-        {
-            "poster": poster or "",
-            "subject": name or "release",
-            "date": "0",
-        },
-    )
-    groups_elem = ET.SubElement(file_elem, "groups")
-    for group in groups:
-        if group:
-            ET.SubElement(groups_elem, "group").text = group
-    segments_elem = ET.SubElement(file_elem, "segments")
-    for segment in segments:
-        message_id = segment.get("message_id") or ""
-        if message_id.startswith("<") and message_id.endswith(">"):
-            message_id = message_id.removeprefix("<").removesuffix(">").strip()
-        seg_elem = ET.SubElement(
-            segments_elem,
-            "segment",
-            {
-                "bytes": str(segment.get("bytes") or 0),
-                "number": str(segment.get("number") or 0),
-            },
-        )
-        seg_elem.text = message_id
-    return ET.tostring(nzb, encoding="utf-8", xml_declaration=True)
+    buffer = io.BytesIO()
+    write_nzb_xml(buffer, poster=poster, groups=groups, files=group_segments_by_file(segments, name or "release"))
+    return buffer.getvalue()
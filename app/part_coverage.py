@@ -0,0 +1,138 @@
+#!/usr/bin/env python3.13
+import json
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Iterator
+
+
+class PartCoverage:
+    """Set of received part numbers kept as sorted, disjoint inclusive ranges.
+
+    Stored in the DB as "1-40,42,45-50". Legacy JSON arrays still decode.
+    """
+
+    __slots__ = ("_starts", "_ends")
+
+    def __init__(self, parts: Iterable[int] = ()):
+        self._starts: list[int] = []
+        self._ends: list[int] = []
+        self.update(parts)
+
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[tuple[int, int]]) -> "PartCoverage":
+        coverage = cls()
+        for start, end in ranges:
+            coverage.add_range(start, end)
+        return coverage
+
+    @classmethod
+    def decode(cls, value: str | None) -> "PartCoverage":
+        coverage = cls()
+        if not value:
+            return coverage
+        value = value.strip()
+        if value.startswith("["):
+            try:
+                parts = json.loads(value)
+            except json.JSONDecodeError:
+                return coverage
+            coverage.update(int(part) for part in parts)
+            return coverage
+        for token in value.split(","):
+            if not token:
+                continue
+            start, _, end = token.partition("-")
+            try:
+                coverage.add_range(int(start), int(end or start))
+            except ValueError:
+                continue
+        return coverage
+
+    def encode(self) -> str:
+        return ",".join(
+            str(start) if start == end else f"{start}-{end}"
+            for start, end in zip(self._starts, self._ends)
+        )
+
+    def add(self, part: int) -> None:
+        idx = bisect_right(self._starts, part) - 1
+        if idx >= 0 and self._ends[idx] >= part:
+            return
+        joins_left = idx >= 0 and self._ends[idx] == part - 1
+        joins_right = idx + 1 < len(self._starts) and self._starts[idx + 1] == part + 1
+        if joins_left and joins_right:
+            self._ends[idx] = self._ends[idx + 1]
+            del self._starts[idx + 1]
+            del self._ends[idx + 1]
+        elif joins_left:
+            self._ends[idx] = part
+        elif joins_right:
+            self._starts[idx + 1] = part
+        else:
+            self._starts.insert(idx + 1, part)
+            self._ends.insert(idx + 1, part)
+
+    def add_range(self, start: int, end: int) -> None:
+        if end < start:
+            return
+        lo = bisect_left(self._ends, start - 1)
+        hi = bisect_right(self._starts, end + 1)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def update(self, parts: "Iterable[int] | PartCoverage") -> None:
+        if isinstance(parts, PartCoverage):
+            self.merge(parts)
+            return
+        for part in parts:
+            self.add(part)
+
+    def merge(self, other: "PartCoverage") -> None:
+        for start, end in other.ranges():
+            self.add_range(start, end)
+
+    def ranges(self) -> list[tuple[int, int]]:
+        return list(zip(self._starts, self._ends))
+
+    def count(self, upto: int | None = None) -> int:
+        total = 0
+        for start, end in zip(self._starts, self._ends):
+            if upto is not None:
+                if start > upto:
+                    break
+                end = min(end, upto)
+            total += end - start + 1
+        return total
+
+    def missing(self, expected: int) -> Iterator[int]:
+        nxt = 1
+        for start, end in zip(self._starts, self._ends):
+            if start > expected:
+                break
+            yield from range(max(nxt, 1), min(start, expected + 1))
+            nxt = max(nxt, end + 1)
+        yield from range(max(nxt, 1), expected + 1)
+
+    def covers(self, expected: int) -> bool:
+        return expected > 0 and self.count(expected) - self.count(0) == expected
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end + 1)
+
+    def __contains__(self, part: int) -> bool:
+        idx = bisect_right(self._starts, part) - 1
+        return idx >= 0 and self._ends[idx] >= part
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PartCoverage):
+            return self._starts == other._starts and self._ends == other._ends
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"PartCoverage({self.encode()!r})"
@@ -22,11 +22,11 @@ from app.ingest import (
     parse_overview,
     save_state,
 )
-from app.nzb_store import store_nzb_invalid, store_nzb_payload, verify_message_ids
-from app.nzb_utils import build_nzb_payload, parse_nzb_segments
-from app.release_utils import NZB_RE, parse_nzb, strip_article_headers
+from app.nzb_store import NzbStore, Verifier, store_nzb_invalid, store_nzb_payload, verify_message_ids
+from app.nzb_utils import read_nzb_body
+from app.release_utils import analyze_subject, strip_article_headers, subject_cache_stats
 from app.settings import get_bool_setting, get_int_setting, get_setting
-from app.db import get_ingest_db, get_state_db, init_ingest_db, init_state_db
+from app.db import CONNECTIONS, get_ingest_db, get_state_db, init_ingest_db, init_state_db
 from app.wasm_pipeline import get_wasm_pipeline
 
 
@@ -134,6 +134,8 @@ def _ingest_nzb_target(
     date: str,
     message_id: str,
     verify_nzb: bool,
+    verifier: Optional[Verifier] = None,
+    store: Optional[NzbStore] = None,
 ) -> None:
     target = message_id or article
     body_lines = _fetch_nzb_body(client, group, str(target))
@@ -152,17 +154,18 @@ def _ingest_nzb_target(
         )
         return
 
-    nzb_files = parse_nzb(body_lines)
-    raw_payload = build_nzb_payload(body_lines)
+    parsed = read_nzb_body(body_lines)
+    if parsed is None:
+        return
+    raw_payload = parsed.payload
     if raw_payload:
-        segments = parse_nzb_segments(raw_payload)
-        message_ids = [seg.get("message_id", "") for seg in segments]
+        message_ids = [seg.get("message_id", "") for seg in parsed.segments]
         ok = True
         reason = None
         if verify_nzb:
-            ok, reason = verify_message_ids(message_ids)
+            ok, reason = verifier.verify(message_ids) if verifier else verify_message_ids(message_ids)
         if ok:
-            store_nzb_payload(
+            (store.store_payload if store else store_nzb_payload)(
                 name=subject or "nzb",
                 payload=raw_payload,
                 source="found",
@@ -173,14 +176,14 @@ def _ingest_nzb_target(
                 nzb_message_id=message_id,
             )
         else:
-            store_nzb_invalid(
+            (store.store_invalid if store else store_nzb_invalid)(
                 name=subject or "nzb",
                 source="found",
                 reason=reason or "verification failed",
                 payload=raw_payload,
             )
 
-    for nzb_file in nzb_files:
+    for nzb_file in parsed.files:
         record = {
             "type": "nzb_file",
             "group": (nzb_file.get("groups") or [group])[0],
@@ -234,92 +237,112 @@ def run_pipeline_once(
     client.connect()
     client.reader_mode()
     client.auth(user, password)
+    # Shared by found-NZB checks below and generated-NZB checks in the filter.
+    verifier = Verifier()
+    store = NzbStore()
 
     try:
-        for group in groups:
-            if reset:
-                state_conn.execute("DELETE FROM state WHERE group_name = ?", (group,))
-                state.pop(group, None)
-
-            count, first_num, last_num, _ = client.group(group)
-            if group in state:
-                start = max(state[group] + 1, first_num)
-            else:
-                start = max(last_num - lookback + 1, first_num)
-            end = last_num
-
-            if start > end:
-                print(f"No new articles in {group}")
-                continue
-
-            total_range = end - start + 1
-            print(f"Scanning {group}: 0/{total_range} (fetching overview)")
-
-            overview_list = client.xover(start, end)
-            total_articles = len(overview_list)
-            if total_articles != total_range:
-                print(f"Scanning {group}: overview returned {total_articles} articles")
-
-            last_progress = time.monotonic()
-            wasm_results = None
-            if wasm_pipeline and overview_list:
-                wasm_results = wasm_pipeline.parse_overviews(overview_list)
-                if not wasm_results or len(wasm_results) != total_articles:
-                    wasm_results = None
-
-            for idx, (art_number, overview) in enumerate(overview_list, start=1):
-                if wasm_results is not None and isinstance(overview, dict):
-                    subject = overview.get("subject", "")
-                    poster = overview.get("from", "")
-                    date_raw = overview.get("date", "")
-                    message_id = overview.get("message-id", "")
-                    size, is_nzb = wasm_results[idx - 1]
+        try:
+            for group in groups:
+                if reset:
+                    state_conn.execute("DELETE FROM state WHERE group_name = ?", (group,))
+                    state.pop(group, None)
+
+                count, first_num, last_num, _ = client.group(group)
+                if group in state:
+                    start = max(state[group] + 1, first_num)
                 else:
-                    subject, poster, date_raw, size, message_id = parse_overview(overview)
-                    is_nzb = bool(NZB_RE.search(subject or ""))
-                record = {
-                    "type": "header",
-                    "group": group,
-                    "article": art_number,
-                    "subject": subject,
-                    "poster": poster,
-                    "date": date_raw,
-                    "bytes": size,
-                    "message_id": message_id,
-                }
-                append_record(ingest_conn, record)
-
-                if parse_nzb_bodies and is_nzb:
-                    _ingest_nzb_target(
-                        client=client,
-                        ingest_conn=ingest_conn,
-                        group=group,
-                        article=art_number,
-                        subject=subject,
-                        poster=poster,
-                        date=date_raw,
-                        message_id=message_id,
-                        verify_nzb=verify_nzb,
-                    )
-
-                now = time.monotonic()
-                if now - last_progress >= progress_seconds or idx == total_articles:
-                    print(f"Scanning {group}: {idx}/{total_articles}")
-                    last_progress = now
-
-            save_state(state_conn, group, end)
-            ingest_conn.commit()
-            state_conn.commit()
+                    start = max(last_num - lookback + 1, first_num)
+                end = last_num
+
+                if start > end:
+                    print(f"No new articles in {group}")
+                    continue
+
+                total_range = end - start + 1
+                print(f"Scanning {group}: 0/{total_range} (fetching overview)")
+
+                overview_list = client.xover(start, end)
+                total_articles = len(overview_list)
+                if total_articles != total_range:
+                    print(f"Scanning {group}: overview returned {total_articles} articles")
+
+                last_progress = time.monotonic()
+                wasm_results = None
+                if wasm_pipeline and overview_list:
+                    wasm_results = wasm_pipeline.parse_overviews(overview_list)
+                    if not wasm_results or len(wasm_results) != total_articles:
+                        wasm_results = None
+
+                for idx, (art_number, overview) in enumerate(overview_list, start=1):
+                    if wasm_results is not None and isinstance(overview, dict):
+                        subject = overview.get("subject", "")
+                        poster = overview.get("from", "")
+                        date_raw = overview.get("date", "")
+                        message_id = overview.get("message-id", "")
+                        size, is_nzb = wasm_results[idx - 1]
+                    else:
+                        subject, poster, date_raw, size, message_id = parse_overview(overview)
+                        is_nzb = analyze_subject(subject or "").is_nzb
+                    record = {
+                        "type": "header",
+                        "group": group,
+                        "article": art_number,
+                        "subject": subject,
+                        "poster": poster,
+                        "date": date_raw,
+                        "bytes": size,
+                        "message_id": message_id,
+                    }
+                    append_record(ingest_conn, record)
+
+                    if parse_nzb_bodies and is_nzb:
+                        _ingest_nzb_target(
+                            client=client,
+                            ingest_conn=ingest_conn,
+                            group=group,
+                            article=art_number,
+                            subject=subject,
+                            poster=poster,
+                            date=date_raw,
+                            message_id=message_id,
+                            verify_nzb=verify_nzb,
+                            verifier=verifier,
+                            store=store,
+                        )
+
+                    now = time.monotonic()
+                    if now - last_progress >= progress_seconds or idx == total_articles:
+                        print(f"Scanning {group}: {idx}/{total_articles}")
+                        last_progress = now
+
+                save_state(state_conn, group, end)
+                store.commit()
+                ingest_conn.commit()
+                state_conn.commit()
+        finally:
+            try:
+                client.quit()
+            except Exception:
+                pass
+            ingest_conn.close()
+            state_conn.close()
+
+        build_releases()
+        filter_main([], verifier=verifier, store=store)
     finally:
-        try:
-            client.quit()
-        except Exception:
-            pass
-        ingest_conn.close()
-        state_conn.close()
-
-    build_releases()
-    filter_main([])
+        store.close()
+        verifier.close()
+    for name, stats in subject_cache_stats().items():
+        print(
+            f"Subject cache ({name}): {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['evictions']} evictions, {stats['bytes'] / (1024 * 1024):.1f} MB"
+        )
+    for name, stats in CONNECTIONS.stats().items():
+        print(
+            f"DB connections ({name}): {stats['opened']} opened, {stats['reused']} reused, "
+            f"{stats['peak_in_use']} peak in use"
+        )
     return 0
 
 
@@ -1,149 +1,180 @@
 #!/usr/bin/env python3.13
 import argparse
 import json
-import re
-from typing import Dict, List, Optional
-
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from app import db
+from app.aggregate import (
+    REBUILD_WATERMARK_KEY,
+    backfill_poster_buckets,
+    load_watermark,
+    process_pool,
+    resolve_workers,
+)
 from app.db import (
+    bucket_range,
+    create_shadow_table,
     get_complete_db,
-    get_ingest_db_readonly,
+    get_releases_db,
     get_releases_db_readonly,
     init_complete_db,
+    init_releases_db,
+    iter_rows,
+    swap_shadow_tables,
 )
-from app.nzb_store import find_nzb_by_release, store_nzb_invalid, store_nzb_payload, verify_message_ids
+from app.nzb_store import NzbStore, Verifier, resolve_nzb_workers
 from app.nzb_utils import build_nzb_xml
-from app.release_utils import build_tags, normalize_subject, parse_part
-
-QUALITY_RE = re.compile(r"\b(2160p|1080p|720p|576p|480p)\b", re.IGNORECASE)
-SOURCE_RE = re.compile(r"\b(bluray|bdrip|brrip|web[-_. ]?dl|webrip|hdtv|dvd|dvdrip)\b", re.IGNORECASE)
-CODEC_RE = re.compile(r"\b(x264|x265|h\.?264|h\.?265|hevc)\b", re.IGNORECASE)
-AUDIO_RE = re.compile(r"\b(aac|ac3|eac3|dts|flac|mp3)\b", re.IGNORECASE)
-SUB_RE = re.compile(r"\b(subs?|subbed|subpack|subtitles?|multi[-_. ]?sub)\b", re.IGNORECASE)
-LANG_RE = re.compile(
-    r"\b(english|eng|french|fre|fr|spanish|spa|es|german|ger|de|italian|ita|pt|por|portuguese)\b",
-    re.IGNORECASE,
-)
-TV_TAG_RE = re.compile(r"\bS\d{1,2}E\d{1,3}\b", re.IGNORECASE)
-SEASON_RE = re.compile(r"\bS(?:eason)?\s*\d{1,2}\b", re.IGNORECASE)
-PART_RE = re.compile(r"(?:\(|\[)?\s*(\d{1,4})\s*/\s*(\d{1,4})\s*(?:\)|\])")
-PART_FILE_RE = re.compile(r"\.part\d{1,4}\.[^\s\"']+", re.IGNORECASE)
-PAR2_RE = re.compile(r"\.vol\d{1,4}\+\d{1,4}\.par2\b", re.IGNORECASE)
-PAR2_SINGLE_RE = re.compile(r"\.par2\b", re.IGNORECASE)
-NZB_RE = re.compile(r"\.nzb\b", re.IGNORECASE)
-FILENAME_QUOTED_RE = re.compile(
-    r"\"([^\"]+\.(?:mkv|mp4|avi|mov|rar|r\d+|7z|zip|par2|nzb|png|jpg|jpeg|gif|bmp))\"",
-    re.IGNORECASE,
-)
-FILENAME_TOKEN_RE = re.compile(
-    r"\b[^\s\"']+\.(?:mkv|mp4|avi|mov|rar|r\d+|7z|zip|par2|nzb|png|jpg|jpeg|gif|bmp)\b",
-    re.IGNORECASE,
+from app.part_coverage import PartCoverage
+from app.release_utils import (
+    SubjectAnalyzer,
+    analyze_name,
+    analyze_subject,
+    normalize_name,
+    pick_best_filename,
+    tag_mask,
 )
+from app.wasm_pipeline import tags_from_mask
 
-def load_releases() -> List[Dict[str, object]]:
-    conn = get_releases_db_readonly()
-    if conn is None:
-        return []
-    rows = conn.execute(
-        """
-        SELECT
-            key, name, normalized_name, filename_hint, poster, group_name, source,
-            first_seen, last_seen, bytes, size_human, parts_received, parts_expected,
-            part_numbers, part_total, articles, subjects, nzb_fetch_failed, nzb_source_subject,
-            nzb_article, nzb_message_id
-        FROM releases
-        """
-    ).fetchall()
-    conn.close()
+METADATA_ANALYZER = SubjectAnalyzer(metadata=True)
+FILTER_SEQ_KEY = "release_change_seq"
+FILTER_REBUILD_KEY = "release_rebuild"
+_IN_BATCH = 500
+NZB_COMMIT_BATCH = 100
+NZB_COMMIT_SECONDS = 2.0
 
-    payload = []
-    for row in rows:
-        part_numbers = json.loads(row["part_numbers"]) if row["part_numbers"] else []
-        subjects = json.loads(row["subjects"]) if row["subjects"] else []
-        payload.append(
-            {
-                "key": row["key"],
-                "name": row["name"],
-                "normalized_name": row["normalized_name"],
-                "filename_hint": row["filename_hint"],
-                "poster": row["poster"],
-                "group": row["group_name"],
-                "source": row["source"],
-                "first_seen": row["first_seen"],
-                "last_seen": row["last_seen"],
-                "bytes": row["bytes"],
-                "size_human": row["size_human"],
-                "parts_received": row["parts_received"],
-                "parts_expected": row["parts_expected"],
-                "part_numbers": part_numbers,
-                "part_total": row["part_total"],
-                "articles": row["articles"],
-                "subjects": subjects,
-                "nzb_fetch_failed": bool(row["nzb_fetch_failed"]),
-                "nzb_source_subject": row["nzb_source_subject"],
-                "nzb_article": row["nzb_article"],
-                "nzb_message_id": row["nzb_message_id"],
-            }
-        )
-    return payload
+_RELEASE_COLUMNS = """
+    key, name, normalized_name, filename_hint, poster, group_name, source,
+    first_seen, last_seen, bytes, size_human, parts_received, parts_expected,
+    part_numbers, part_total, articles, subjects, subject_count, filename_guess,
+    nzb_fetch_failed, nzb_source_subject, nzb_article, nzb_message_id
+"""
 
 
-def parse_metadata(name: str) -> Dict[str, object]:
-    tokens = re.split(r"[\s._-]+", name)
+def release_row_to_entry(row) -> Dict[str, object]:
+    return {
+        "key": row["key"],
+        "name": row["name"],
+        "normalized_name": row["normalized_name"],
+        "filename_hint": row["filename_hint"],
+        "poster": row["poster"],
+        "group": row["group_name"],
+        "source": row["source"],
+        "first_seen": row["first_seen"],
+        "last_seen": row["last_seen"],
+        "bytes": row["bytes"],
+        "size_human": row["size_human"],
+        "parts_received": row["parts_received"],
+        "parts_expected": row["parts_expected"],
+        "part_numbers": PartCoverage.decode(row["part_numbers"]),
+        "part_total": row["part_total"],
+        "articles": row["articles"],
+        "subjects": json.loads(row["subjects"]) if row["subjects"] else [],
+        "subject_count": row["subject_count"],
+        "filename_guess": row["filename_guess"],
+        "nzb_fetch_failed": bool(row["nzb_fetch_failed"]),
+        "nzb_source_subject": row["nzb_source_subject"],
+        "nzb_article": row["nzb_article"],
+        "nzb_message_id": row["nzb_message_id"],
+    }
 
-    def find_token(regex: re.Pattern) -> Optional[str]:
-        match = regex.search(name)
-        return match.group(1) if match else None
 
-    quality = find_token(QUALITY_RE)
-    source = find_token(SOURCE_RE)
-    codec = find_token(CODEC_RE)
-    audio = find_token(AUDIO_RE)
+def load_releases(path: Optional[str] = None, shard: Optional[tuple[int, int]] = None) -> Iterator[Dict[str, object]]:
+    conn = get_releases_db_readonly(path)
+    if conn is None:
+        return
+    where = ""
+    params: tuple = ()
+    if shard is not None:
+        # A range scan on idx_releases_poster_bucket, not a full scan per shard.
+        where = "WHERE poster_bucket BETWEEN ? AND ?"
+        params = bucket_range(shard)
+    try:
+        rows = iter_rows(
+            conn,
+            f"SELECT {_RELEASE_COLUMNS} FROM releases {where} ORDER BY IFNULL(last_seen, '') DESC, key",
+            params,
+        )
+        for row in rows:
+            yield release_row_to_entry(row)
+    finally:
+        conn.close()
 
-    languages = sorted({t.lower() for t in tokens if LANG_RE.fullmatch(t.lower())})
-    subtitles = bool(SUB_RE.search(name))
 
-    release_type = "tv" if TV_TAG_RE.search(name) or SEASON_RE.search(name) else "unknown"
+def bucket_key(entry: Dict[str, object]) -> str:
+    name = str(entry.get("name") or "")
+    normalized = str(entry.get("normalized_name") or normalize_name(name))
+    return f"{normalized}|{entry.get('poster') or ''}"
 
-    return {
-        "type": release_type,
-        "quality": quality.lower() if quality else None,
-        "source": source.lower() if source else None,
-        "codec": codec.lower() if codec else None,
-        "audio": audio.lower() if audio else None,
-        "languages": languages,
-        "subtitles": subtitles,
-    }
+
+def load_changed_buckets(conn: sqlite3.Connection, after_seq: int, upto_seq: int) -> Dict[str, tuple[str, str]]:
+    buckets = {}
+    rows = iter_rows(
+        conn,
+        f"SELECT {_RELEASE_COLUMNS} FROM releases WHERE change_seq > ? AND change_seq <= ?",
+        (after_seq, upto_seq),
+    )
+    for row in rows:
+        entry = release_row_to_entry(row)
+        buckets[bucket_key(entry)] = (row["normalized_name"], row["poster"])
+    return buckets
+
+
+def load_bucket_releases(
+    conn: sqlite3.Connection, buckets: Dict[str, tuple[str, str]]
+) -> list[Dict[str, object]]:
+    """Every release row belonging to the given buckets."""
+    entries = []
+    seen = set()
+    fallback_loaded = False
+    for normalized, poster in set(buckets.values()):
+        if normalized:
+            query = f"SELECT {_RELEASE_COLUMNS} FROM releases WHERE normalized_name = ? AND poster IS ?"
+            params: tuple = (normalized, poster)
+        elif fallback_loaded:
+            continue
+        else:
+            # Rows without a normalized name bucket on normalize_name(name);
+            # they are rare, so load them all once and filter below.
+            fallback_loaded = True
+            query = f"SELECT {_RELEASE_COLUMNS} FROM releases WHERE normalized_name IS NULL OR normalized_name = ''"
+            params = ()
+        for row in iter_rows(conn, query, params):
+            if row["key"] in seen:
+                continue
+            entry = release_row_to_entry(row)
+            if bucket_key(entry) in buckets:
+                seen.add(row["key"])
+                entries.append(entry)
+    # Same order as load_releases so buckets merge identically.
+    entries.sort(key=lambda e: e["key"])
+    entries.sort(key=lambda e: e["last_seen"] or "", reverse=True)
+    return entries
+
+
+def parse_metadata(name: str) -> Dict[str, object]:
+    return METADATA_ANALYZER.analyze(name).metadata.as_dict()
 
 
 def extract_parts_from_subjects(subjects: List[str]) -> tuple[set[int], int]:
     parts = set()
     max_total = 0
     for subject in subjects:
-        match = PART_RE.search(subject)
-        if not match:
+        info = analyze_subject(subject)
+        if not info.part_total and not info.part_num:
             continue
-        part_num = int(match.group(1))
-        part_total = int(match.group(2))
-        parts.add(part_num)
-        if part_total > max_total:
-            max_total = part_total
+        parts.add(info.part_num)
+        if info.part_total > max_total:
+            max_total = info.part_total
     return parts, max_total
 
 
-def is_complete(parts: set[int], expected: int) -> bool:
-    return expected > 0 and len(parts) == expected
-
-
-def normalize_name(value: str) -> str:
-    if not value:
-        return ""
-    cleaned = PART_RE.sub("", value)
-    cleaned = PART_FILE_RE.sub("", cleaned)
-    cleaned = PAR2_RE.sub("", cleaned)
-    cleaned = PAR2_SINGLE_RE.sub("", cleaned)
-    cleaned = NZB_RE.sub("", cleaned)
-    cleaned = re.sub(r"\s+", " ", cleaned)
-    return cleaned.strip(" -_[]()")
+def is_complete(parts: PartCoverage, expected: int) -> bool:
+    if not isinstance(parts, PartCoverage):
+        parts = PartCoverage(parts)
+    return parts.covers(expected)
 
 
 def format_bytes(size: int) -> str:
@@ -156,113 +187,163 @@ def format_bytes(size: int) -> str:
     return f"{value:.1f} PB"
 
 
-def normalize_filename(value: str) -> str:
-    name = value.strip().strip("\"'")
-    name = re.sub(r"\.part\d{1,4}(?=\.)", "", name, flags=re.IGNORECASE)
-    name = re.sub(r"\.vol\d{1,4}\+\d{1,4}\.par2$", ".par2", name, flags=re.IGNORECASE)
-    return name
-
-
 def filename_candidates(subjects: list[str]) -> list[str]:
     candidates = []
     for subject in subjects:
-        match = FILENAME_QUOTED_RE.search(subject)
-        if match:
-            candidates.append(match.group(1))
-            continue
-        match = FILENAME_TOKEN_RE.search(subject)
-        if match:
-            candidates.append(match.group(0))
-    return [normalize_filename(c) for c in candidates]
+        guess = analyze_subject(subject).filename_guess
+        if guess is not None:
+            candidates.append(guess)
+    return candidates
 
 
 def pick_filename(subjects: list[str]) -> Optional[str]:
-    candidates = filename_candidates(subjects)
-    if not candidates:
-        return None
+    return pick_best_filename(filename_candidates(subjects))
 
-    priority = [".mkv", ".mp4", ".avi", ".mov", ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".rar", ".7z", ".zip", ".par2", ".nzb"]
-    for ext in priority:
-        for name in candidates:
-            if name.lower().endswith(ext):
-                return name
-    return candidates[0]
 
+SEGMENT_HASH_JOIN_MIN = 256
 
-def build_segments_for_release(entry: Dict[str, object]) -> list[dict]:
+
+def segment_lookup_key(entry: Dict[str, object]) -> Optional[tuple[str, str]]:
     groups = entry.get("groups") or []
     poster = entry.get("poster") or ""
-    normalized = normalize_subject(str(entry.get("normalized_name") or entry.get("name") or ""))
+    normalized = analyze_subject(str(entry.get("normalized_name") or entry.get("name") or "")).normalized
     total = int(entry.get("parts_expected") or 0)
     if not groups or not poster or not normalized or total <= 0:
-        return []
-    conn = get_ingest_db_readonly()
-    if conn is None:
-        return []
-    placeholders = ",".join(["?"] * len(groups))
-    rows = conn.execute(
-        f"""
-        SELECT subject, message_id, bytes
-        FROM ingest
-        WHERE type = 'header' AND poster = ? AND group_name IN ({placeholders})
-        """,
-        (poster, *groups),
-    ).fetchall()
-    conn.close()
+        return None
+    return normalized, str(poster)
+
 
-    segments = {}
+def _assemble_segments(entry: Dict[str, object], rows: Iterable) -> list[dict]:
+    total = int(entry.get("parts_expected") or 0)
+    groups = set(entry.get("groups") or [])
+    best: Dict[int, tuple] = {}
     for row in rows:
-        subject = row["subject"] or ""
-        if normalize_subject(subject) != normalized:
-            continue
-        part_num, _ = parse_part(subject)
-        if part_num <= 0:
-            continue
-        message_id = row["message_id"]
-        if not message_id:
-            continue
-        if part_num in segments:
+        part_num = row["part_num"]
+        if part_num > total or row["group_name"] not in groups:
             continue
-        segments[part_num] = {
-            "number": part_num,
-            "bytes": int(row["bytes"] or 0),
-            "message_id": message_id,
-        }
-        if len(segments) >= total:
-            break
-    if len(segments) != total:
+        current = best.get(part_num)
+        if current is None or row["ingest_id"] < current[0]:
+            best[part_num] = (row["ingest_id"], row["message_id"], int(row["bytes"] or 0))
+    if len(best) != total:
         return []
-    return [segments[i] for i in sorted(segments)]
-
+    return [
+        {"number": part_num, "bytes": best[part_num][2], "message_id": best[part_num][1]}
+        for part_num in sorted(best)
+    ]
 
-def main(argv: Optional[list[str]] = None) -> int:
-    parser = argparse.ArgumentParser(description="Filter complete releases and extract metadata.")
-    args = parser.parse_args(argv)
 
-    releases = load_releases()
+def build_segments_for_release(entry: Dict[str, object], conn: Optional[sqlite3.Connection] = None) -> list[dict]:
+    key = segment_lookup_key(entry)
+    if key is None:
+        return []
+    owned = conn is None
+    if owned:
+        conn = get_releases_db_readonly()
+        if conn is None:
+            return []
+    groups = entry.get("groups") or []
+    placeholders = ",".join(["?"] * len(groups))
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT group_name, part_num, ingest_id, message_id, bytes
+            FROM release_segments
+            WHERE normalized_subject = ? AND poster = ? AND group_name IN ({placeholders})
+            """,
+            (*key, *groups),
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        if owned:
+            conn.close()
+    return _assemble_segments(entry, rows)
+
+
+def iter_release_segments(
+    entries: Iterable[Dict[str, object]], conn: sqlite3.Connection
+) -> Iterator[tuple[Dict[str, object], list[dict]]]:
+    """Yield (entry, segments) for each entry whose parts are all indexed.
+
+    Small batches use one indexed read per release. Larger ones make a
+    single pass over release_segments in key order and hash-join it against
+    the batch, emitting each release as soon as its key range is passed.
+    """
+    pending: Dict[tuple[str, str], list] = {}
+    for entry in entries:
+        key = segment_lookup_key(entry)
+        if key is not None:
+            pending.setdefault(key, []).append(entry)
+    if len(pending) < SEGMENT_HASH_JOIN_MIN:
+        for batch in pending.values():
+            for entry in batch:
+                segments = build_segments_for_release(entry, conn)
+                if segments:
+                    yield entry, segments
+        return
+
+    def flush(batch, rows):
+        for entry in batch:
+            segments = _assemble_segments(entry, rows)
+            if segments:
+                yield entry, segments
+
+    try:
+        rows = iter_rows(
+            conn,
+            """
+            SELECT normalized_subject, poster, group_name, part_num, ingest_id, message_id, bytes
+            FROM release_segments
+            ORDER BY normalized_subject, poster, group_name, part_num
+            """,
+        )
+        current = None
+        batch = None
+        matched: list = []
+        for row in rows:
+            key = (row["normalized_subject"], row["poster"])
+            if key != current:
+                if batch:
+                    yield from flush(batch, matched)
+                current = key
+                batch = pending.get(key)
+                matched = []
+            if batch:
+                matched.append(row)
+        if batch:
+            yield from flush(batch, matched)
+    except sqlite3.OperationalError:
+        return
+
+
+def collect_complete(entries: Iterable[Dict[str, object]]) -> List[Dict[str, object]]:
     merged: Dict[str, Dict[str, object]] = {}
 
-    for entry in releases:
+    for entry in entries:
         name = str(entry.get("name") or "")
         filename_hint = str(entry.get("filename_hint") or "")
         normalized = str(entry.get("normalized_name") or normalize_name(name))
         poster = str(entry.get("poster") or "")
-        key = f"{normalized}|{poster}"
+        key = bucket_key(entry)
 
-        parts = set(entry.get("part_numbers") or [])
+        parts = entry.get("part_numbers")
+        if not isinstance(parts, PartCoverage):
+            parts = PartCoverage(parts or [])
         part_total = entry.get("part_total") or entry.get("parts_expected") or 0
 
         if not parts:
             subjects = entry.get("subjects") or []
             if isinstance(subjects, list):
                 extracted, extracted_total = extract_parts_from_subjects(subjects)
-                parts = extracted
+                parts = PartCoverage(sorted(extracted))
                 if extracted_total > part_total:
                     part_total = extracted_total
         subjects = entry.get("subjects") or []
         if not isinstance(subjects, list):
             subjects = []
-        guessed_filename = pick_filename(subjects)
+        # Aggregation precomputes the best guess over every subject; the
+        # stored subjects are only a sample.
+        guessed_filename = entry.get("filename_guess") or pick_filename(subjects)
 
         bucket = merged.setdefault(
             key,
@@ -275,7 +356,7 @@ def main(argv: Optional[list[str]] = None) -> int:
                 "size_human": None,
                 "first_seen": entry.get("first_seen"),
                 "last_seen": entry.get("last_seen"),
-                "parts": set(),
+                "parts": PartCoverage(),
                 "parts_expected": 0,
                 "filename_guess": guessed_filename,
                 "nzb_fetch_failed": False,
@@ -288,7 +369,7 @@ def main(argv: Optional[list[str]] = None) -> int:
         bucket["groups"].add(entry.get("group"))
         bucket["bytes"] = int(bucket["bytes"]) + int(entry.get("bytes") or 0)
         bucket["size_human"] = format_bytes(int(bucket["bytes"]))
-        bucket["parts"].update(parts)
+        bucket["parts"].merge(parts)
         bucket["parts_expected"] = max(int(bucket["parts_expected"]), int(part_total or 0))
 
         first_seen = entry.get("first_seen")
@@ -307,15 +388,19 @@ def main(argv: Optional[list[str]] = None) -> int:
             bucket["nzb_message_id"] = entry.get("nzb_message_id")
 
     output = []
-    for entry in merged.values():
+    for key, entry in merged.items():
         name_value = str(entry.get("name") or "")
         filename_value = str(entry.get("filename_guess") or "")
         if name_value.lower().endswith(".nzb") or filename_value.lower().endswith(".nzb"):
             continue
         if not is_complete(entry["parts"], int(entry["parts_expected"])):
             continue
-        meta = parse_metadata(str(entry["name"]))
-        tags = build_tags(name_value, filename_value)
+        name_info = analyze_name(name_value)
+        meta = name_info.metadata.as_dict()
+        mask = name_info.tag_mask
+        if filename_value:
+            mask |= tag_mask(filename_value)
+        tags = tags_from_mask(mask)
         key_value = f"{entry.get('name')}|{entry.get('poster')}"
         output.append(
             {
@@ -333,101 +418,320 @@ def main(argv: Optional[list[str]] = None) -> int:
                 "first_seen": entry["first_seen"],
                 "last_seen": entry["last_seen"],
                 "parts_expected": entry["parts_expected"],
-                "parts_received": len(entry["parts"]),
+                "parts_received": entry["parts"].count(),
                 "tags": tags,
+                "bucket_key": key,
                 **meta,
             }
         )
 
-    output.sort(key=lambda r: r.get("last_seen") or "", reverse=True)
-
-    unique = {}
-    for item in output:
-        key = f"{item.get('name')}|{item.get('poster')}"
-        unique[key] = item
+    return output
+
+
+def collect_complete_shard(releases_path: str, shard: tuple[int, int]) -> List[Dict[str, object]]:
+    # Process pool worker: buckets are keyed by poster, so sharding on
+    # poster keeps every cross-group merge inside one worker.
+    return collect_complete(load_releases(releases_path, shard))
+
+
+_COMPLETE_INSERT_SQL = """
+    INSERT INTO {table}(
+        key, name, normalized_name, filename_guess, nzb_fetch_failed, nzb_source_subject,
+        nzb_article, nzb_message_id, download_failed, groups, poster, bytes, size_human,
+        first_seen, last_seen, parts_expected, parts_received, type,
+        quality, source, codec, audio, languages, subtitles, tags
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def complete_key(item: dict) -> str:
+    return f"{item.get('name')}|{item.get('poster')}"
+
+
+def complete_row_values(item: dict) -> tuple:
+    return (
+        complete_key(item),
+        item.get("name"),
+        item.get("normalized_name"),
+        item.get("filename_guess"),
+        1 if item.get("nzb_fetch_failed") else 0,
+        item.get("nzb_source_subject"),
+        item.get("nzb_article"),
+        item.get("nzb_message_id"),
+        0,
+        json.dumps(item.get("groups")),
+        item.get("poster"),
+        item.get("bytes"),
+        item.get("size_human"),
+        item.get("first_seen"),
+        item.get("last_seen"),
+        item.get("parts_expected"),
+        item.get("parts_received"),
+        item.get("type"),
+        item.get("quality"),
+        item.get("source"),
+        item.get("codec"),
+        item.get("audio"),
+        json.dumps(item.get("languages")),
+        1 if item.get("subtitles") else 0,
+        json.dumps(item.get("tags") or []),
+    )
+
+
+def dedupe_complete(items: Iterable[Dict[str, object]]) -> List[Dict[str, object]]:
+    # Buckets that resolve to the same name|poster keep the one with the
+    # oldest last_seen; the normalized name breaks ties.
+    unique: Dict[str, Dict[str, object]] = {}
+    for item in items:
+        key = complete_key(item)
+        current = unique.get(key)
+        if current is None or _complete_rank(item) < _complete_rank(current):
+            unique[key] = item
     output = list(unique.values())
     output.sort(key=lambda r: r.get("last_seen") or "", reverse=True)
+    return output
 
-    conn = get_complete_db()
-    init_complete_db(conn)
-    conn.execute("DELETE FROM releases_complete")
-    for item in output:
-        conn.execute(
-            """
-            INSERT INTO releases_complete(
-                key, name, normalized_name, filename_guess, nzb_fetch_failed, nzb_source_subject,
-                nzb_article, nzb_message_id, download_failed, groups, poster, bytes, size_human,
-                first_seen, last_seen, parts_expected, parts_received, type,
-                quality, source, codec, audio, languages, subtitles, tags
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                f"{item.get('name')}|{item.get('poster')}",
-                item.get("name"),
-                item.get("normalized_name"),
-                item.get("filename_guess"),
-                1 if item.get("nzb_fetch_failed") else 0,
-                item.get("nzb_source_subject"),
-                item.get("nzb_article"),
-                item.get("nzb_message_id"),
-                0,
-                json.dumps(item.get("groups")),
-                item.get("poster"),
-                item.get("bytes"),
-                item.get("size_human"),
-                item.get("first_seen"),
-                item.get("last_seen"),
-                item.get("parts_expected"),
-                item.get("parts_received"),
-                item.get("type"),
-                item.get("quality"),
-                item.get("source"),
-                item.get("codec"),
-                item.get("audio"),
-                json.dumps(item.get("languages")),
-                1 if item.get("subtitles") else 0,
-                json.dumps(item.get("tags") or []),
-            ),
-        )
-    conn.commit()
-    conn.close()
 
-    generated = 0
-    for item in output:
-        release_key = f"{item.get('name')}|{item.get('poster')}"
-        if find_nzb_by_release(release_key):
-            continue
-        segments = build_segments_for_release(item)
-        if not segments:
-            continue
-        message_ids = [seg.get("message_id", "") for seg in segments]
-        ok, reason = verify_message_ids(message_ids)
-        if not ok:
-            store_nzb_invalid(
-                name=item.get("name") or "release",
-                source="generated",
-                reason=reason or "verification failed",
-                release_key=release_key,
+def _complete_rank(item: Dict[str, object]) -> tuple[str, str]:
+    return str(item.get("last_seen") or ""), str(item.get("normalized_name") or "")
+
+
+def load_filter_state(conn: sqlite3.Connection) -> Dict[str, int]:
+    return {row["name"]: int(row["value"]) for row in conn.execute("SELECT name, value FROM filter_state")}
+
+
+def save_filter_state(conn: sqlite3.Connection, state: Dict[str, int]) -> None:
+    conn.executemany(
+        "INSERT INTO filter_state(name, value) VALUES(?, ?) ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+        list(state.items()),
+    )
+
+
+def load_release_state(path: Optional[str] = None) -> Dict[str, int]:
+    conn = get_releases_db_readonly(path)
+    if conn is None:
+        return {}
+    try:
+        return {
+            FILTER_SEQ_KEY: load_watermark(conn),
+            FILTER_REBUILD_KEY: load_watermark(conn, REBUILD_WATERMARK_KEY),
+        }
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
+
+def _bucket_rows(items: Iterable[Dict[str, object]]) -> list[tuple]:
+    return [(item["bucket_key"], item["normalized_name"], item["poster"], complete_key(item)) for item in items]
+
+
+def filter_full(conn: sqlite3.Connection, workers: int) -> List[Dict[str, object]]:
+    if workers > 1:
+        releases_conn = get_releases_db()
+        init_releases_db(releases_conn)
+        backfill_poster_buckets(releases_conn)
+        releases_conn.close()
+        candidates = []
+        with process_pool(workers) as pool:
+            futures = [
+                pool.submit(collect_complete_shard, db.RELEASES_DB_PATH, (idx, workers))
+                for idx in range(workers)
+            ]
+            for future in futures:
+                candidates.extend(future.result())
+    else:
+        candidates = collect_complete(load_releases())
+    output = dedupe_complete(candidates)
+
+    shadow = create_shadow_table(conn, "releases_complete")
+    conn.executemany(_COMPLETE_INSERT_SQL.format(table=shadow), (complete_row_values(item) for item in output))
+    swap_shadow_tables(conn, "releases_complete")
+    conn.execute("DELETE FROM complete_buckets")
+    conn.executemany("INSERT INTO complete_buckets VALUES (?, ?, ?, ?)", _bucket_rows(candidates))
+    return output
+
+
+def _select_in(conn: sqlite3.Connection, query: str, values: list) -> list:
+    rows = []
+    for idx in range(0, len(values), _IN_BATCH):
+        chunk = values[idx : idx + _IN_BATCH]
+        rows.extend(conn.execute(query.format(placeholders=",".join("?" * len(chunk))), chunk).fetchall())
+    return rows
+
+
+def filter_incremental(
+    conn: sqlite3.Connection, after_seq: int, upto_seq: int
+) -> tuple[List[Dict[str, object]], int]:
+    """Recompute only the buckets holding releases changed since after_seq.
+
+    Returns the complete rows written and the number of changed buckets.
+    """
+    releases_conn = get_releases_db_readonly()
+    if releases_conn is None:
+        return [], 0
+    try:
+        buckets = load_changed_buckets(releases_conn, after_seq, upto_seq)
+        if not buckets:
+            return [], 0
+        changed = list(buckets)
+        previous = _select_in(
+            conn,
+            "SELECT bucket_key, complete_key FROM complete_buckets WHERE bucket_key IN ({placeholders})",
+            changed,
+        )
+        candidates = collect_complete(load_bucket_releases(releases_conn, buckets))
+        affected = sorted({row["complete_key"] for row in previous} | {complete_key(item) for item in candidates})
+        # Unchanged buckets that compete for the same name|poster key.
+        rivals = {
+            row["bucket_key"]: (row["normalized_name"], row["poster"])
+            for row in _select_in(
+                conn,
+                "SELECT bucket_key, normalized_name, poster FROM complete_buckets "
+                "WHERE complete_key IN ({placeholders})",
+                affected,
             )
-            continue
+            if row["bucket_key"] not in buckets
+        }
+        if rivals:
+            candidates.extend(collect_complete(load_bucket_releases(releases_conn, rivals)))
+    finally:
+        releases_conn.close()
+
+    output = dedupe_complete(candidates)
+    conn.executemany("DELETE FROM complete_buckets WHERE bucket_key = ?", [(key,) for key in changed])
+    conn.executemany(
+        "INSERT OR REPLACE INTO complete_buckets VALUES (?, ?, ?, ?)",
+        _bucket_rows(item for item in candidates if item["bucket_key"] in buckets),
+    )
+    conn.executemany("DELETE FROM releases_complete WHERE key = ?", [(key,) for key in affected])
+    conn.executemany(
+        _COMPLETE_INSERT_SQL.format(table="releases_complete"), (complete_row_values(item) for item in output)
+    )
+    return output, len(changed)
+
+
+def prepare_nzbs(
+    pairs: Iterable[tuple[Dict[str, object], list[dict]]], workers: int, verifier: Verifier
+) -> Iterator[tuple[Dict[str, object], Optional[bytes], Optional[str]]]:
+    """Verify segments and build NZB XML on a thread pool.
+
+    Yields (item, payload, reason) in input order; payload is None when
+    verification failed. At most 2 * workers releases are in flight.
+    """
+
+    def prepare(item, segments):
+        ok, reason = verifier.verify([seg.get("message_id", "") for seg in segments])
+        if not ok:
+            return item, None, reason
         payload = build_nzb_xml(
             name=item.get("name") or "release",
             poster=item.get("poster"),
             groups=item.get("groups") or [],
             segments=segments,
         )
-        store_nzb_payload(
-            name=item.get("name") or "release",
-            payload=payload,
-            source="generated",
-            group_name=(item.get("groups") or [None])[0],
-            poster=item.get("poster"),
-            release_key=release_key,
-            tags=item.get("tags") or [],
-        )
-        generated += 1
+        return item, payload, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight: deque = deque()
+        for item, segments in pairs:
+            in_flight.append(pool.submit(prepare, item, segments))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def generate_nzbs(
+    items: Iterable[Dict[str, object]],
+    workers: Optional[int] = None,
+    verifier: Optional[Verifier] = None,
+    store: Optional[NzbStore] = None,
+) -> int:
+    segments_conn = get_releases_db_readonly()
+    if segments_conn is None:
+        return 0
+    owned_verifier = verifier is None
+    if owned_verifier:
+        verifier = Verifier()
+    owned_store = store is None
+    if owned_store:
+        store = NzbStore(batch_size=NZB_COMMIT_BATCH, batch_seconds=NZB_COMMIT_SECONDS)
+    generated = 0
+    try:
+        # One query up front instead of a lookup (and connection) per release.
+        have_nzb = store.release_keys()
+        pending = (item for item in items if complete_key(item) not in have_nzb)
+        pairs = iter_release_segments(pending, segments_conn)
+        for item, payload, reason in prepare_nzbs(pairs, resolve_nzb_workers(workers), verifier):
+            release_key = complete_key(item)
+            if payload is None:
+                store.store_invalid(
+                    name=item.get("name") or "release",
+                    source="generated",
+                    reason=reason or "verification failed",
+                    release_key=release_key,
+                )
+                continue
+            store.store_payload(
+                name=item.get("name") or "release",
+                payload=payload,
+                source="generated",
+                group_name=(item.get("groups") or [None])[0],
+                poster=item.get("poster"),
+                release_key=release_key,
+                tags=item.get("tags") or [],
+            )
+            have_nzb.add(release_key)
+            generated += 1
+        store.commit()
+    finally:
+        if owned_store:
+            store.close()
+        segments_conn.close()
+        if owned_verifier:
+            verifier.close()
+    return generated
+
+
+def main(
+    argv: Optional[list[str]] = None,
+    verifier: Optional[Verifier] = None,
+    store: Optional[NzbStore] = None,
+) -> int:
+    parser = argparse.ArgumentParser(description="Filter complete releases and extract metadata.")
+    parser.add_argument("--full", action="store_true", help="Re-evaluate every release instead of changed ones")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Processes for bucketing releases (0 = all cores); overrides TRICERAPOST_AGGREGATE_WORKERS",
+    )
+    args = parser.parse_args(argv)
+
+    release_state = load_release_state()
+    conn = get_complete_db()
+    init_complete_db(conn)
+    state = load_filter_state(conn)
+    upto_seq = release_state.get(FILTER_SEQ_KEY, 0)
+    full = (
+        args.full
+        or not release_state
+        or FILTER_SEQ_KEY not in state
+        or state.get(FILTER_REBUILD_KEY) != release_state.get(FILTER_REBUILD_KEY)
+        or upto_seq < state[FILTER_SEQ_KEY]
+    )
+    if full:
+        output = filter_full(conn, resolve_workers(args.workers))
+        message = f"Wrote {len(output)} complete releases to SQLite"
+    else:
+        output, changed = filter_incremental(conn, state[FILTER_SEQ_KEY], upto_seq)
+        message = f"Updated {len(output)} complete releases from {changed} changed buckets"
+    save_filter_state(conn, release_state)
+    conn.commit()
+    conn.close()
 
-    print(f"Wrote {len(output)} complete releases to SQLite")
+    generated = generate_nzbs(output, verifier=verifier, store=store)
+    print(message)
     if generated:
         print(f"Generated {generated} NZB files from releases")
     return 0
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3.13
 import re
-import xml.etree.ElementTree as ET
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from app.settings import get_int_setting
 
 PART_RE = re.compile(r"(?:\(|\[)?\s*(\d{1,4})\s*/\s*(\d{1,4})\s*(?:\)|\])")
 PART_FILE_RE = re.compile(r"\.part\d{1,4}\.[^\s\"']+", re.IGNORECASE)
@@ -9,29 +15,362 @@ PAR2_SINGLE_RE = re.compile(r"\.par2\b", re.IGNORECASE)
 NZB_RE = re.compile(r"\.nzb\b", re.IGNORECASE)
 FILENAME_RE = re.compile(r"\"([^\"]+\.(?:rar|r\d+|7z|zip|par2|nzb|mkv|mp4|avi))\"", re.IGNORECASE)
 EXT_RE = re.compile(r"\b[^\s\"']+\.(?:rar|r\d+|7z|zip|par2|nzb|mkv|mp4|avi)\b", re.IGNORECASE)
+FILENAME_QUOTED_RE = re.compile(
+    r"\"([^\"]+\.(?:mkv|mp4|avi|mov|rar|r\d+|7z|zip|par2|nzb|png|jpg|jpeg|gif|bmp))\"",
+    re.IGNORECASE,
+)
+FILENAME_TOKEN_RE = re.compile(
+    r"\b[^\s\"']+\.(?:mkv|mp4|avi|mov|rar|r\d+|7z|zip|par2|nzb|png|jpg|jpeg|gif|bmp)\b",
+    re.IGNORECASE,
+)
 YENC_RE = re.compile(r"\s+yenc\b.*$", re.IGNORECASE)
-NZB_HINT_RE = re.compile(r"<nzb\b", re.IGNORECASE)
+
+QUALITY_RE = re.compile(r"\b(2160p|1080p|720p|576p|480p)\b", re.IGNORECASE)
+SOURCE_RE = re.compile(r"\b(bluray|bdrip|brrip|web[-_. ]?dl|webrip|hdtv|dvd|dvdrip)\b", re.IGNORECASE)
+CODEC_RE = re.compile(r"\b(x264|x265|h\.?264|h\.?265|hevc)\b", re.IGNORECASE)
+AUDIO_RE = re.compile(r"\b(aac|ac3|eac3|dts|flac|mp3)\b", re.IGNORECASE)
+SUB_RE = re.compile(r"\b(subs?|subbed|subpack|subtitles?|multi[-_. ]?sub)\b", re.IGNORECASE)
+LANG_RE = re.compile(
+    r"\b(english|eng|french|fre|fr|spanish|spa|es|german|ger|de|italian|ita|pt|por|portuguese)\b",
+    re.IGNORECASE,
+)
+TV_TAG_RE = re.compile(r"\bS\d{1,2}E\d{1,3}\b", re.IGNORECASE)
+SEASON_RE = re.compile(r"\bS(?:eason)?\s*\d{1,2}\b", re.IGNORECASE)
+METADATA_SPLIT_RE = re.compile(r"[\s._-]+")
+FILENAME_PART_RE = re.compile(r"\.part\d{1,4}(?=\.)", re.IGNORECASE)
+FILENAME_VOLUME_RE = re.compile(r"\.vol\d{1,4}\+\d{1,4}\.par2$", re.IGNORECASE)
+
+# Every PART_RE match contains "digit / digit"; searching for that first lets
+# the regex engine skip ahead by character class instead of trying PART_RE at
+# every offset.
+_PART_HINT_RE = re.compile(r"\d\s*/\s*\d")
+_YENC_HINT_RE = re.compile(r"yenc\b", re.IGNORECASE)
+# The dotted noise patterns share a literal "." prefix, so one alternation
+# replaces four sequential substitutions.
+_DOT_NOISE_RE = re.compile(
+    r"\.(?:part\d{1,4}\.[^\s\"']+|vol\d{1,4}\+\d{1,4}\.par2\b|par2\b|nzb\b)",
+    re.IGNORECASE,
+)
+
+FILENAME_PRIORITY = [
+    ".mkv", ".mp4", ".avi", ".mov", ".png", ".jpg", ".jpeg", ".gif", ".bmp",
+    ".rar", ".7z", ".zip", ".par2", ".nzb",
+]
+
+
+@dataclass(frozen=True, slots=True)
+class SubjectMetadata:
+    type: str
+    quality: Optional[str]
+    source: Optional[str]
+    codec: Optional[str]
+    audio: Optional[str]
+    languages: tuple[str, ...]
+    subtitles: bool
+
+    def as_dict(self) -> dict[str, object]:
+        return {
+            "type": self.type,
+            "quality": self.quality,
+            "source": self.source,
+            "codec": self.codec,
+            "audio": self.audio,
+            "languages": list(self.languages),
+            "subtitles": self.subtitles,
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class SubjectInfo:
+    subject: str
+    normalized: str
+    part_num: int
+    part_total: int
+    filename: Optional[str]
+    filename_guess: Optional[str]
+    is_nzb: bool
+    metadata: Optional[SubjectMetadata] = None
+    tag_mask: int = 0
+
+    @property
+    def tags(self) -> list[str]:
+        if not self.tag_mask:
+            return []
+        from app.wasm_pipeline import tags_from_mask
+
+        return tags_from_mask(self.tag_mask)
+
+
+def _part_matches(value: str) -> list[re.Match]:
+    matches = []
+    pos = 0
+    while True:
+        hint = _PART_HINT_RE.search(value, pos)
+        if not hint:
+            return matches
+        # Step back over the digits, whitespace and bracket PART_RE may
+        # consume before the hint so the search starts no later than the match.
+        start = hint.start()
+        while start > pos and value[start - 1].isdecimal():
+            start -= 1
+        while start > pos and value[start - 1].isspace():
+            start -= 1
+        if start > pos and value[start - 1] in "([":
+            start -= 1
+        match = PART_RE.search(value, start)
+        if not match:
+            return matches
+        matches.append(match)
+        pos = match.end()
+
+
+def _yenc_cut(value: str) -> int:
+    hint = _YENC_HINT_RE.search(value)
+    while hint:
+        start = hint.start()
+        while start > 0 and value[start - 1].isspace():
+            start -= 1
+        if start < hint.start() and YENC_RE.match(value, start):
+            return start
+        hint = _YENC_HINT_RE.search(value, hint.start() + 1)
+    return len(value)
+
+
+def _clean(value: str, parts: list[re.Match], end: int) -> str:
+    if parts:
+        pieces = []
+        pos = 0
+        for match in parts:
+            if match.end() > end:
+                break
+            pieces.append(value[pos : match.start()])
+            pos = match.end()
+        pieces.append(value[pos:end])
+        value = "".join(pieces)
+    elif end < len(value):
+        value = value[:end]
+    if "." in value:
+        value = _DOT_NOISE_RE.sub("", value)
+    return " ".join(value.split()).strip(" -_[]()")
+
+
+def _find_metadata_token(regex: re.Pattern, name: str) -> Optional[str]:
+    match = regex.search(name)
+    return match.group(1).lower() if match else None
+
+
+def normalize_filename(value: str) -> str:
+    name = value.strip().strip("\"'")
+    name = FILENAME_PART_RE.sub("", name)
+    name = FILENAME_VOLUME_RE.sub(".par2", name)
+    return name
+
+
+class SubjectAnalyzer:
+    """Parses a subject once into everything the aggregate and filter stages need.
+
+    Metadata and WASM tags are only needed for release names, not for every
+    header subject, so they are opt-in.
+    """
+
+    def __init__(self, *, metadata: bool = False, tags: bool = False) -> None:
+        self.metadata = metadata
+        self.tags = tags
+
+    def analyze(self, subject: str) -> SubjectInfo:
+        subject = subject or ""
+        parts = _part_matches(subject)
+        part = parts[0] if parts else None
+        has_dot = "." in subject
+        return SubjectInfo(
+            subject=subject,
+            normalized=_clean(subject, parts, _yenc_cut(subject)),
+            part_num=int(part.group(1)) if part else 0,
+            part_total=int(part.group(2)) if part else 0,
+            filename=self._filename(subject) if has_dot else None,
+            filename_guess=self._filename_guess(subject) if has_dot else None,
+            is_nzb=bool(has_dot and NZB_RE.search(subject)),
+            metadata=self._metadata(subject) if self.metadata else None,
+            tag_mask=tag_mask(subject) if self.tags else 0,
+        )
+
+    @staticmethod
+    def _filename(subject: str) -> Optional[str]:
+        if '"' in subject:
+            match = FILENAME_RE.search(subject)
+            if match:
+                return match.group(1)
+        match = EXT_RE.search(subject)
+        return match.group(0) if match else None
+
+    @staticmethod
+    def _filename_guess(subject: str) -> Optional[str]:
+        if '"' in subject:
+            match = FILENAME_QUOTED_RE.search(subject)
+            if match:
+                return normalize_filename(match.group(1))
+        match = FILENAME_TOKEN_RE.search(subject)
+        return normalize_filename(match.group(0)) if match else None
+
+    @staticmethod
+    def _metadata(name: str) -> SubjectMetadata:
+        tokens = METADATA_SPLIT_RE.split(name)
+        is_tv = TV_TAG_RE.search(name) or SEASON_RE.search(name)
+        return SubjectMetadata(
+            type="tv" if is_tv else "unknown",
+            quality=_find_metadata_token(QUALITY_RE, name),
+            source=_find_metadata_token(SOURCE_RE, name),
+            codec=_find_metadata_token(CODEC_RE, name),
+            audio=_find_metadata_token(AUDIO_RE, name),
+            languages=tuple(sorted({t.lower() for t in tokens if LANG_RE.fullmatch(t.lower())})),
+            subtitles=bool(SUB_RE.search(name)),
+        )
+
+
+# Rough per-entry cost of the OrderedDict node, the SubjectInfo slots and the
+# small ints it holds, on top of the strings themselves.
+_CACHE_ENTRY_OVERHEAD = 240
+
+
+def _info_size(info: SubjectInfo) -> int:
+    size = _CACHE_ENTRY_OVERHEAD + 2 * sys.getsizeof(info.subject) + sys.getsizeof(info.normalized)
+    for value in (info.filename, info.filename_guess):
+        if value is not None:
+            size += sys.getsizeof(value)
+    if info.metadata is not None:
+        size += _CACHE_ENTRY_OVERHEAD
+    return size
+
+
+class SubjectCache:
+    """LRU memo of SubjectAnalyzer results keyed on the subject string.
+
+    Consecutive parts of a release share near-identical subjects, and the
+    aggregate and filter stages analyze the same subjects again, so most
+    lookups after the first pass are hits. Entries are evicted oldest-first
+    once their estimated size exceeds max_bytes; max_bytes <= 0 disables
+    caching.
+    """
+
+    def __init__(self, analyzer: SubjectAnalyzer, max_bytes: int) -> None:
+        self._analyzer = analyzer
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[SubjectInfo, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def analyze(self, subject: str) -> SubjectInfo:
+        subject = subject or ""
+        with self._lock:
+            cached = self._entries.get(subject)
+            if cached is not None:
+                self._entries.move_to_end(subject)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        info = self._analyzer.analyze(subject)
+        if self.max_bytes <= 0:
+            return info
+        size = _info_size(info)
+        with self._lock:
+            if subject in self._entries:
+                return self._entries[subject][0]
+            self._entries[subject] = (info, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return info
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+SUBJECT_ANALYZER = SubjectAnalyzer()
+NAME_ANALYZER = SubjectAnalyzer(metadata=True, tags=True)
+
+_CACHES: dict[str, SubjectCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def _cache(name: str, analyzer: SubjectAnalyzer) -> SubjectCache:
+    cache = _CACHES.get(name)
+    if cache is None:
+        with _CACHES_LOCK:
+            cache = _CACHES.get(name)
+            if cache is None:
+                max_mb = get_int_setting("TRICERAPOST_SUBJECT_CACHE_MB", 64)
+                cache = SubjectCache(analyzer, max_mb * 1024 * 1024)
+                _CACHES[name] = cache
+    return cache
+
+
+def subject_cache_stats() -> dict[str, dict[str, int]]:
+    return {name: cache.stats() for name, cache in _CACHES.items()}
+
+
+def clear_subject_caches() -> None:
+    for cache in _CACHES.values():
+        cache.clear()
+
+
+def analyze_subject(subject: str) -> SubjectInfo:
+    return _cache("subjects", SUBJECT_ANALYZER).analyze(subject)
+
+
+def analyze_name(name: str) -> SubjectInfo:
+    return _cache("names", NAME_ANALYZER).analyze(name)
 
 
 def normalize_subject(subject: str) -> str:
-    subject = YENC_RE.sub("", subject)
-    subject = PART_RE.sub("", subject)
-    subject = PART_FILE_RE.sub("", subject)
-    subject = PAR2_RE.sub("", subject)
-    subject = PAR2_SINGLE_RE.sub("", subject)
-    subject = NZB_RE.sub("", subject)
-    subject = re.sub(r"\s+", " ", subject)
-    return subject.strip(" -_[]()\t ")
+    return analyze_subject(subject).normalized
+
+
+def normalize_name(value: str) -> str:
+    if not value:
+        return ""
+    return _clean(value, _part_matches(value), len(value))
 
 
 def extract_filename(subject: str) -> str | None:
-    match = FILENAME_RE.search(subject)
-    if match:
-        return match.group(1)
-    match = EXT_RE.search(subject)
-    if match:
-        return match.group(0)
-    return None
+    return analyze_subject(subject).filename
+
+
+def parse_part(subject: str) -> tuple[int, int]:
+    info = analyze_subject(subject)
+    return info.part_num, info.part_total
+
+
+def filename_rank(name: str) -> int:
+    lowered = name.lower()
+    for idx, ext in enumerate(FILENAME_PRIORITY):
+        if lowered.endswith(ext):
+            return idx
+    return len(FILENAME_PRIORITY)
+
+
+def pick_best_filename(candidates: list[Optional[str]]) -> Optional[str]:
+    names = [name for name in candidates if name]
+    if not names:
+        return None
+    return min(names, key=filename_rank)
 
 
 _WASM_TAGGER = None
@@ -51,25 +390,22 @@ def _get_wasm_tagger():
     return None if _WASM_TAGGER is False else _WASM_TAGGER
 
 
-def build_tags(name: str, filename: str | None = None) -> list[str]:
+def tag_mask(text: str) -> int:
     wasm = _get_wasm_tagger()
-    if not wasm:
-        return []
-    from app.wasm_pipeline import tags_from_mask
+    if not wasm or not text:
+        return 0
+    return wasm.parse_tag_mask(text)
+
 
-    mask = wasm.parse_tag_mask(name or "")
+def build_tags(name: str, filename: str | None = None) -> list[str]:
+    mask = tag_mask(name or "")
     if filename:
-        mask |= wasm.parse_tag_mask(filename)
+        mask |= tag_mask(filename)
     if not mask:
         return []
-    return tags_from_mask(mask)
-
+    from app.wasm_pipeline import tags_from_mask
 
-def parse_part(subject: str) -> tuple[int, int]:
-    match = PART_RE.search(subject)
-    if not match:
-        return 0, 0
-    return int(match.group(1)), int(match.group(2))
+    return tags_from_mask(mask)
 
 
 def decode_yenc(lines: list[str]) -> bytes:
@@ -100,44 +436,6 @@ def strip_article_headers(lines: list[str]) -> list[str]:
     return lines
 
 
-def parse_nzb(lines: list[str]) -> list[dict]:
-    text = "\n".join(lines)
-    if not NZB_HINT_RE.search(text):
-        if any(line.startswith("=ybegin") for line in lines):
-            decoded = decode_yenc(lines).decode("utf-8", errors="ignore")
-            if NZB_HINT_RE.search(decoded):
-                text = decoded
-        if not NZB_HINT_RE.search(text):
-            return []
-    try:
-        root = ET.fromstring(text)
-    except ET.ParseError:
-        return []
-
-    files = []
-    for file_elem in root.findall(".//{*}file"):
-        subject = file_elem.attrib.get("subject", "")
-        poster = file_elem.attrib.get("poster", "")
-        groups = [g.text.strip() for g in file_elem.findall(".//{*}groups/{*}group") if g.text]
-        segments = file_elem.findall(".//{*}segments/{*}segment")
-        total_bytes = 0
-        for seg in segments:
-            try:
-                total_bytes += int(seg.attrib.get("bytes", "0"))
-            except ValueError:
-                pass
-        files.append(
-            {
-                "subject": subject,
-                "poster": poster,
-                "groups": groups,
-                "segments": len(segments),
-                "bytes": total_bytes,
-            }
-        )
-    return files
-
-
 def format_bytes(size: int) -> str:
     units = ["B", "KB", "MB", "GB", "TB"]
     value = float(size)
@@ -10,8 +10,19 @@ DEFAULT_WASM_PATH = os.path.join(
     "wasm",
     "pipeline.wasm",
 )
+DEFAULT_SIMD_WASM_PATH = os.path.join(
+    BASE_DIR,
+    "parsers",
+    "overview",
+    "wasm",
+    "pipeline_simd.wasm",
+)
+# Smallest module using a v128 instruction; validating it tells us whether the
+# host engine can run the simd128 build.
+_SIMD_PROBE_WAT = "(module (func (result v128) v128.const i64x2 0 0))"
 
 _ENTRY_SIZE = 8
+_MASK_SIZE = 8
 _FLAG_NZB = 1
 TAG_LIST = [
     "resolution:2160p",
@@ -52,9 +63,11 @@ TAG_LIST = [
 
 
 class WasmPipeline:
-    def __init__(self, wasm_path: str) -> None:
+    def __init__(self, wasm_path: str, simd: bool = False) -> None:
         from wasmtime import Engine, Instance, Module, Store
 
+        self.path = wasm_path
+        self.simd = simd
         self._engine = Engine()
         self._store = Store(self._engine)
         module = Module.from_file(self._engine, wasm_path)
@@ -68,6 +81,10 @@ class WasmPipeline:
             self._parse_tag_mask = exports["parse_tag_mask"]
         except KeyError:
             self._parse_tag_mask = None
+        try:
+            self._parse_tag_masks = exports["parse_tag_masks"]
+        except KeyError:
+            self._parse_tag_masks = None
 
     def _write(self, ptr: int, data: bytes) -> None:
         self._memory.write(self._store, data, ptr)
@@ -141,11 +158,68 @@ class WasmPipeline:
         finally:
             self._dealloc(self._store, in_ptr, in_size)
 
+    def parse_tag_masks(self, texts: list[str]) -> list[int]:
+        if not texts:
+            return []
+        if not self._parse_tag_masks:
+            return [self.parse_tag_mask(text) for text in texts]
+
+        buf = bytearray()
+        buf.extend(struct.pack("<I", len(texts)))
+        for text in texts:
+            data = (text or "").encode("utf-8", errors="ignore")
+            buf.extend(struct.pack("<I", len(data)))
+            buf.extend(data)
+
+        in_size = len(buf)
+        out_size = len(texts) * _MASK_SIZE
+        in_ptr = self._alloc(self._store, in_size)
+        out_ptr = self._alloc(self._store, out_size)
+        if not in_ptr or not out_ptr:
+            if in_ptr:
+                self._dealloc(self._store, in_ptr, in_size)
+            if out_ptr:
+                self._dealloc(self._store, out_ptr, out_size)
+            return [0] * len(texts)
+
+        try:
+            self._write(in_ptr, bytes(buf))
+            status = self._parse_tag_masks(self._store, in_ptr, in_size, out_ptr, out_size)
+            if status != 0:
+                return [0] * len(texts)
+            raw = self._read(out_ptr, out_size)
+        finally:
+            self._dealloc(self._store, in_ptr, in_size)
+            self._dealloc(self._store, out_ptr, out_size)
+        return [int(mask) for mask in struct.unpack(f"<{len(texts)}Q", raw)]
+
+
+def host_supports_simd() -> bool:
+    try:
+        from wasmtime import Engine, Module
+    except Exception:
+        return False
+    try:
+        Module(Engine(), _SIMD_PROBE_WAT)
+    except Exception:
+        return False
+    return True
+
 
 def get_wasm_pipeline() -> Optional[WasmPipeline]:
     if os.environ.get("TRICERAPOST_DISABLE_WASM"):
         return None
 
+    simd_path = os.environ.get("TRICERAPOST_PIPELINE_WASM_SIMD")
+    if not simd_path and not os.environ.get("TRICERAPOST_PIPELINE_WASM"):
+        simd_path = DEFAULT_SIMD_WASM_PATH
+    if simd_path and not os.environ.get("TRICERAPOST_DISABLE_WASM_SIMD"):
+        if os.path.exists(simd_path) and host_supports_simd():
+            try:
+                return WasmPipeline(simd_path, simd=True)
+            except Exception:
+                pass
+
     wasm_path = os.environ.get("TRICERAPOST_PIPELINE_WASM", DEFAULT_WASM_PATH)
     if not os.path.exists(wasm_path):
         return None
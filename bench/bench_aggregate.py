@@ -0,0 +1,169 @@
+#!/usr/bin/env python3.13
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from app import db
+from app.aggregate import ENGINES, aggregate_shard, build_releases, resolve_workers
+from app.db import get_ingest_db, get_releases_db, init_ingest_db, release_bucket
+from app.ingest import subject_columns
+from app.release_utils import clear_subject_caches
+
+WORDS = ["Movie", "Show", "Title", "Return", "Night", "City", "Blue", "Planet", "1080p", "x264", "WEB-DL"]
+POSTERS = [f"poster{idx}@example.com" for idx in range(50)]
+GROUPS = ["alt.binaries.test", "alt.binaries.misc", "alt.binaries.hdtv"]
+INSERT_SQL = """
+    INSERT INTO ingest(
+        group_name, type, article, subject, poster, date, bytes, message_id, payload,
+        normalized_subject, part_num, part_total, filename, filename_rank, release_bucket
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def iter_rows(rows: int, seed: int):
+    rng = random.Random(seed)
+    article = 0
+    release = 0
+    while article < rows:
+        release += 1
+        name = ".".join(rng.sample(WORDS, 4)) + f".{release}"
+        poster = rng.choice(POSTERS)
+        group = rng.choice(GROUPS)
+        files = rng.randint(1, 8)
+        segments = rng.randint(5, 60)
+        for file_idx in range(1, files + 1):
+            for seg in range(1, segments + 1):
+                if article >= rows:
+                    return
+                article += 1
+                subject = f'[{file_idx}/{files}] - "{name}.part{file_idx:02d}.rar" yEnc ({seg}/{segments})'
+                date = f"Mon, 01 Jan 2024 {article // 3600 % 24:02d}:{article // 60 % 60:02d}:{article % 60:02d} +0000"
+                yield (
+                    group,
+                    "header",
+                    article,
+                    subject,
+                    poster,
+                    date,
+                    rng.randint(300_000, 800_000),
+                    f"<{article}@bench>",
+                    *subject_columns("header", subject),
+                    release_bucket(poster, group),
+                )
+
+
+def populate(rows: int, seed: int) -> None:
+    conn = get_ingest_db()
+    init_ingest_db(conn)
+    batch = []
+    for row in iter_rows(rows, seed):
+        batch.append(row)
+        if len(batch) >= 50_000:
+            conn.executemany(INSERT_SQL, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(INSERT_SQL, batch)
+    conn.commit()
+    conn.close()
+
+
+def snapshot() -> list[tuple]:
+    conn = get_releases_db()
+    rows = conn.execute("SELECT * FROM releases ORDER BY key").fetchall()
+    conn.close()
+    return [tuple(row[k] for k in row.keys() if k != "change_seq") for row in rows]
+
+
+def count_mismatches(expected: list[tuple], actual: list[tuple]) -> int:
+    return sum(1 for a, b in zip(expected, actual) if a != b) + abs(len(expected) - len(actual))
+
+
+def timed_build(engine: str, workers: int = 1) -> float:
+    clear_subject_caches()
+    start = time.perf_counter()
+    build_releases(full=True, engine=engine, workers=workers)
+    return time.perf_counter() - start
+
+
+def timed_shards(engine: str, workers: int) -> list[float]:
+    # Each shard on its own, in this process: what one worker costs on a free core.
+    conn = get_ingest_db()
+    max_id = conn.execute("SELECT MAX(id) FROM ingest").fetchone()[0] or 0
+    conn.close()
+    secs = []
+    for idx in range(workers):
+        clear_subject_caches()
+        start = time.perf_counter()
+        aggregate_shard(db.INGEST_DB_PATH, engine, 0, max_id, (idx, workers))
+        secs.append(time.perf_counter() - start)
+    return secs
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare Python and SQL aggregation engines.")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="Ingest rows to generate")
+    parser.add_argument("--workers", type=int, default=0, help="Processes for the sharded run (0 = all cores)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", help="Reuse/keep the bench databases in this directory")
+    args = parser.parse_args(argv)
+
+    temp_dir = None
+    base = args.dir
+    if not base:
+        temp_dir = tempfile.TemporaryDirectory()
+        base = temp_dir.name
+    os.makedirs(base, exist_ok=True)
+    db.INGEST_DB_PATH = os.path.join(base, "bench_ingest.db")
+    db.RELEASES_DB_PATH = os.path.join(base, "bench_releases.db")
+
+    try:
+        if not os.path.exists(db.INGEST_DB_PATH):
+            start = time.perf_counter()
+            populate(args.rows, args.seed)
+            print(f"Generated {args.rows} ingest rows in {time.perf_counter() - start:.1f}s")
+
+        workers = resolve_workers(args.workers)
+        python_secs = timed_build("python")
+        python_rows = snapshot()
+        sql_secs = timed_build("sql")
+        sql_rows = snapshot()
+        sharded = {}
+        shard_secs = {}
+        for engine in ENGINES:
+            secs = timed_build(engine, workers)
+            sharded[engine] = (secs, snapshot())
+            shard_secs[engine] = (timed_shards(engine, 1)[0], timed_shards(engine, workers))
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    mismatched = count_mismatches(python_rows, sql_rows)
+    for _, rows in sharded.values():
+        mismatched += count_mismatches(python_rows, rows)
+    print(f"Releases: {len(sql_rows)}")
+    print(f"python {python_secs:8.2f}s  sql {sql_secs:8.2f}s  x{python_secs / sql_secs:.2f}")
+    for engine, serial_secs in (("python", python_secs), ("sql", sql_secs)):
+        secs = sharded[engine][0]
+        print(f"{engine} x{workers} workers {secs:8.2f}s  x{serial_secs / secs:.2f} vs serial (wall clock)")
+        # The shards run one after another on a single core; with a core each,
+        # only the slowest one stays on the critical path.
+        whole, shards = shard_secs[engine]
+        slowest = max(shards)
+        estimate = secs - sum(shards) + slowest
+        print(
+            f"{engine} slowest shard {slowest:8.2f}s  {slowest / whole:.0%} of unsharded aggregation ({whole:.2f}s); "
+            f"build ~{estimate:.2f}s (x{serial_secs / estimate:.2f}) with {workers} free cores"
+        )
+    print(f"Mismatches: {mismatched}")
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3.13
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from app.nzb_utils import build_nzb_xml, write_nzb_xml
+
+
+def build_with_elementtree(*, name: str, poster: str, groups: list[str], segments: list[dict]) -> bytes:
+    # The DOM-based serializer build_nzb_xml replaced.
+    nzb = ET.Element("nzb", {"xmlns": "http://www.newzbin.com/DTD/2003/nzb"})
+    file_elem = ET.SubElement(nzb, "file", {"poster": poster or "", "subject": name or "release", "date": "0"})
+    groups_elem = ET.SubElement(file_elem, "groups")
+    for group in groups:
+        if group:
+            ET.SubElement(groups_elem, "group").text = group
+    segments_elem = ET.SubElement(file_elem, "segments")
+    for segment in segments:
+        message_id = segment.get("message_id") or ""
+        if message_id.startswith("<") and message_id.endswith(">"):
+            message_id = message_id.removeprefix("<").removesuffix(">").strip()
+        attrs = {"bytes": str(segment.get("bytes") or 0), "number": str(segment.get("number") or 0)}
+        ET.SubElement(segments_elem, "segment", attrs).text = message_id
+    return ET.tostring(nzb, encoding="utf-8", xml_declaration=True)
+
+
+def write_to_devnull(*, name: str, poster: str, groups: list[str], segments: list[dict]) -> bytes:
+    with open(os.devnull, "wb") as handle:
+        write_nzb_xml(handle, poster=poster, groups=groups, files=[(name, iter(segments))])
+    return b""
+
+
+def measure(build, rounds: int, **kwargs) -> tuple[float, int, bytes]:
+    """Returns (seconds per round, peak traced bytes, output)."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        payload = build(**kwargs)
+    elapsed = (time.perf_counter() - start) / rounds
+    tracemalloc.start()
+    payload = build(**kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, payload
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the streaming NZB writer with ElementTree.")
+    parser.add_argument("--segments", type=int, default=200_000, help="Segments in the generated release")
+    parser.add_argument("--rounds", type=int, default=3, help="Timed rounds per writer")
+    args = parser.parse_args(argv)
+
+    segments = [
+        {"message_id": f"<part{idx}of{args.segments}.{idx * 7919:x}@news.example.com>", "bytes": 716800, "number": idx}
+        for idx in range(1, args.segments + 1)
+    ]
+    kwargs = {"name": "Some.Release.2160p.mkv", "poster": "poster <p@example.com>", "groups": ["alt.binaries.test"]}
+    print(f"Release: {len(segments)} segments, {args.rounds} rounds")
+
+    results = {}
+    for label, build in (
+        ("elementtree", build_with_elementtree),
+        ("streaming", build_nzb_xml),
+        ("to file", write_to_devnull),
+    ):
+        results[label] = measure(build, args.rounds, segments=segments, **kwargs)
+        elapsed, peak, payload = results[label]
+        size = f"  output {len(payload) / 1e6:.1f} MB" if payload else ""
+        print(f"{label:12} {elapsed:8.3f}s  peak allocated {peak / 1e6:8.1f} MB{size}")
+    identical = results["elementtree"][2] == results["streaming"][2]
+    print(f"Identical output: {identical}")
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
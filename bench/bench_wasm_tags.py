@@ -0,0 +1,102 @@
+#!/usr/bin/env python3.13
+import argparse
+import os
+import random
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from app.wasm_pipeline import (
+    DEFAULT_SIMD_WASM_PATH,
+    DEFAULT_WASM_PATH,
+    WasmPipeline,
+    host_supports_simd,
+)
+
+WORDS = [
+    "Movie", "Show", "Title", "The", "Return", "Of", "Night", "City", "Blue", "Planet",
+    "S01E02", "S03", "2019", "2024", "German", "MULTi", "iNTERNAL", "DL", "GROUP",
+]
+TAGS = [
+    "2160p", "1080p", "720p", "480p", "HDR10+", "HDR10", "DV", "Dolby Vision", "HLG", "SDR",
+    "x265", "H.264", "HEVC", "AVC", "AV1", "VP9", "WEB-DL", "WEBRip", "BluRay", "Blu-Ray",
+    "HDTV", "REMUX", "UHD", "DTS-HD", "DTS", "TrueHD", "Atmos", "AAC", "EAC3", "DDP", "AC3",
+    "REPACK", "PROPER", "REMASTERED", "EXTENDED", "10bit",
+]
+EXTENSIONS = ["mkv", "mp4", "avi", "rar", "par2", "nzb", "7z"]
+SEPARATORS = [".", " ", "_", "-"]
+
+
+def build_corpus(size: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    corpus = []
+    for idx in range(size):
+        sep = rng.choice(SEPARATORS)
+        words = rng.sample(WORDS, rng.randint(2, 6)) + rng.sample(TAGS, rng.randint(0, 6))
+        name = sep.join(words)
+        ext = rng.choice(EXTENSIONS)
+        total = rng.randint(1, 120)
+        corpus.append(f'[{idx}] - "{name}.part{rng.randint(1, 99):02d}.{ext}" ({rng.randint(1, total)}/{total}) yEnc')
+    return corpus
+
+
+def run_tags(pipeline: WasmPipeline, corpus: list[str], rounds: int) -> tuple[float, list[int]]:
+    masks = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        masks = pipeline.parse_tag_masks(corpus)
+    return time.perf_counter() - start, masks
+
+
+def run_overviews(pipeline: WasmPipeline, corpus: list[str], rounds: int) -> tuple[float, list]:
+    overviews = [(idx, {"subject": subject, "bytes": "1024"}) for idx, subject in enumerate(corpus)]
+    results = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        results = pipeline.parse_overviews(overviews) or []
+    return time.perf_counter() - start, results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare scalar and SIMD WASM token matching.")
+    parser.add_argument("--subjects", type=int, default=100_000, help="Corpus size")
+    parser.add_argument("--rounds", type=int, default=3, help="Timed rounds per module")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scalar", default=DEFAULT_WASM_PATH)
+    parser.add_argument("--simd", default=DEFAULT_SIMD_WASM_PATH)
+    args = parser.parse_args(argv)
+
+    if not host_supports_simd():
+        print("Host engine does not support wasm simd128")
+        return 1
+    for path in (args.scalar, args.simd):
+        if not os.path.exists(path):
+            print(f"Missing module: {path} (run parsers/overview/build.sh)")
+            return 1
+
+    corpus = build_corpus(args.subjects, args.seed)
+    total_bytes = sum(len(subject) for subject in corpus)
+    print(f"Corpus: {len(corpus)} subjects, {total_bytes / 1e6:.1f} MB, {args.rounds} rounds")
+
+    scalar = WasmPipeline(args.scalar)
+    simd = WasmPipeline(args.simd, simd=True)
+
+    scalar_tags, scalar_masks = run_tags(scalar, corpus, args.rounds)
+    simd_tags, simd_masks = run_tags(simd, corpus, args.rounds)
+    scalar_ov, scalar_flags = run_overviews(scalar, corpus, args.rounds)
+    simd_ov, simd_flags = run_overviews(simd, corpus, args.rounds)
+
+    mismatched = sum(1 for a, b in zip(scalar_masks, simd_masks) if a != b)
+    mismatched += sum(1 for a, b in zip(scalar_flags, simd_flags) if a != b)
+
+    print(f"parse_tag_masks scalar {scalar_tags:8.3f}s  simd {simd_tags:8.3f}s  x{scalar_tags / simd_tags:.2f}")
+    print(f"parse_overviews scalar {scalar_ov:8.3f}s  simd {simd_ov:8.3f}s  x{scalar_ov / simd_ov:.2f}")
+    print(f"Mismatches: {mismatched}")
+    return 1 if mismatched else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3.13
 import argparse
+import http.client
 import json
 import os
+import shutil
 import signal
 import sys
+import tarfile
+import tempfile
 import time
 import urllib.error
 import urllib.parse
 import urllib.request
+import zipfile
 from subprocess import DEVNULL, Popen
 
 
@@ -134,6 +139,89 @@ def cmd_nzbs(args: argparse.Namespace) -> int:
     return 0
 
 
+def _read_keys(path: str) -> list[str]:
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r", encoding="utf-8") as handle:
+            lines = handle.read().splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def _archive_error(handle, fmt: str) -> str | None:
+    # The export has no Content-Length and the server leaves the trailer off
+    # when it fails, so a body without one was cut short.
+    size = handle.seek(0, os.SEEK_END)
+    try:
+        if fmt == "zip":
+            handle.seek(0)
+            with zipfile.ZipFile(handle) as archive:
+                archive.infolist()
+            return None
+        handle.seek(max(size - 1024, 0))
+        if size < 1024 or size % tarfile.BLOCKSIZE or handle.read(1024).strip(b"\0"):
+            return "missing TAR end-of-archive blocks"
+        handle.seek(0)
+        with tarfile.open(fileobj=handle, mode="r:") as archive:
+            archive.getmembers()
+    except (zipfile.BadZipFile, tarfile.TarError) as exc:
+        return str(exc)
+    return None
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    keys = list(args.key or [])
+    if args.keys_file:
+        keys.extend(_read_keys(args.keys_file))
+    body = {
+        "format": args.format,
+        "keys": keys or None,
+        "tag": _normalize_tag(args.tag) if args.tag else None,
+        "since": args.since,
+        "until": args.until,
+    }
+    request = urllib.request.Request(
+        _base_url() + "/api/nzb/export",
+        data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as exc:
+        message = exc.read().decode("utf-8") if exc.fp else str(exc)
+        raise SystemExit(f"HTTP {exc.code}: {message}") from exc
+    except urllib.error.URLError as exc:
+        raise SystemExit(f"Request failed: {exc}") from exc
+    # Spool next to the destination: only a complete archive is renamed to
+    # the -o path (or copied to stdout), so a failed export leaves nothing.
+    directory = os.path.dirname(os.path.abspath(args.output)) if args.output else None
+    spool = tempfile.NamedTemporaryFile(dir=directory, prefix=".tricerapost-export-", delete=False)
+    try:
+        with response, spool:
+            try:
+                shutil.copyfileobj(response, spool, 64 * 1024)
+                spool.flush()
+            except (OSError, http.client.HTTPException) as exc:
+                error = f"download failed: {exc}"
+            else:
+                error = _archive_error(spool, args.format)
+            if error is None and not args.output:
+                spool.seek(0)
+                shutil.copyfileobj(spool, sys.stdout.buffer, 64 * 1024)
+        if error is not None:
+            raise SystemExit(f"Export incomplete ({error}); no archive written")
+        if args.output:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(spool.name, 0o666 & ~umask)
+            os.replace(spool.name, args.output)
+    finally:
+        if os.path.exists(spool.name):
+            os.remove(spool.name)
+    return 0
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(prog="TriceraPost")
     subparsers = parser.add_subparsers(dest="command", required=True)
@@ -151,6 +239,16 @@ def main() -> int:
     nzbs_parser.add_argument("--tag", help="Filter by tag (e.g. SDR or hdr:sdr)")
     nzbs_parser.set_defaults(func=cmd_nzbs)
 
+    export_parser = subparsers.add_parser("export", help="Download NZBs as a ZIP or TAR archive")
+    export_parser.add_argument("--format", choices=["zip", "tar"], default="zip")
+    export_parser.add_argument("--tag", help="Only NZBs with this tag")
+    export_parser.add_argument("--since", help="Only NZBs created at or after this UTC time (YYYY-MM-DD[ HH:MM:SS])")
+    export_parser.add_argument("--until", help="Only NZBs created before this UTC time")
+    export_parser.add_argument("--key", action="append", help="NZB key to include (repeatable)")
+    export_parser.add_argument("--keys-file", help="File with one NZB key per line ('-' for stdin)")
+    export_parser.add_argument("-o", "--output", help="Archive path (default: stdout)")
+    export_parser.set_defaults(func=cmd_export)
+
     args = parser.parse_args()
     return args.func(args)
 
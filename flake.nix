@@ -67,6 +67,7 @@ PY
           export ZIG_GLOBAL_CACHE_DIR="${TMPDIR:-/tmp}/zig-cache"
           ${pkgs.bash}/bin/bash ./parsers/overview/build.sh
           test -f parsers/overview/wasm/pipeline.wasm
+          test -f parsers/overview/wasm/pipeline_simd.wasm
           mkdir -p "$out"
         '';
       };
@@ -10,12 +10,15 @@ import threading
 import time
 import tty
 import termios
+from itertools import chain
+from typing import Callable, Iterable, Iterator
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if ROOT_DIR not in sys.path:
     sys.path.insert(0, ROOT_DIR)
 
 from app.db import (
+    CONNECTIONS,
     COMPLETE_DB_PATH,
     INGEST_DB_PATH,
     NZB_DB_PATH,
@@ -26,10 +29,20 @@ from app.db import (
     get_nzb_db_readonly,
     get_releases_db_readonly,
     get_state_db_readonly,
+    iter_rows,
 )
+from app.aggregate import iter_release_subjects
 from app.ingest import load_env
 from app.logging_setup import configure_logging
-from app.nzb_store import save_all_nzbs_to_disk
+from app.nzb_export import EXPORT_FORMATS, iter_export_rows, write_nzb_archive
+from app.nzb_store import (
+    PAYLOAD_CODEC,
+    decode_payload,
+    load_stored_payload,
+    migrate_stored_payloads,
+    save_all_nzbs_to_disk,
+)
+from app.part_coverage import PartCoverage
 from app.settings import get_setting
 from gui.http_assets import asset_info
 from gui.settings_api import apply_settings_payload, build_settings_payload
@@ -41,6 +54,7 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 WEB_DIR = os.path.join(BASE_DIR, "web")
 GROUPS_PATH = os.path.join(ROOT_DIR, "groups.json")
 LOGGER = logging.getLogger("tricerapost")
+_NO_ROWS = object()
 
 
 def read_json(path, default):
@@ -50,90 +64,119 @@ def read_json(path, default):
         return json.load(handle)
 
 
-def read_releases(table):
+def _complete_row(row, nzb_keys: set[str]) -> dict:
+    return {
+        "key": row["key"],
+        "name": row["name"],
+        "normalized_name": row["normalized_name"] if "normalized_name" in row.keys() else "",
+        "filename_guess": row["filename_guess"],
+        "nzb_fetch_failed": bool(row["nzb_fetch_failed"]),
+        "nzb_source_subject": row["nzb_source_subject"],
+        "nzb_article": row["nzb_article"],
+        "nzb_message_id": row["nzb_message_id"],
+        "groups": json.loads(row["groups"]) if row["groups"] else [],
+        "poster": row["poster"],
+        "bytes": row["bytes"],
+        "size_human": row["size_human"],
+        "first_seen": row["first_seen"],
+        "last_seen": row["last_seen"],
+        "parts_expected": row["parts_expected"],
+        "parts_received": row["parts_received"],
+        "type": row["type"],
+        "quality": row["quality"],
+        "source": row["source"],
+        "codec": row["codec"],
+        "audio": row["audio"],
+        "languages": json.loads(row["languages"]) if row["languages"] else [],
+        "subtitles": bool(row["subtitles"]),
+        "tags": (
+            json.loads(row["tags"])
+            if "tags" in row.keys() and row["tags"]
+            else []
+        ),
+        "nzb_created": row["key"] in nzb_keys,
+    }
+
+
+def _raw_release_row(row) -> dict:
+    return {
+        "key": row["key"],
+        "name": row["name"],
+        "normalized_name": row["normalized_name"],
+        "filename_hint": row["filename_hint"],
+        "poster": row["poster"],
+        "group": row["group_name"],
+        "source": row["source"],
+        "message_id": row["message_id"],
+        "nzb_source_subject": row["nzb_source_subject"],
+        "nzb_article": row["nzb_article"],
+        "nzb_message_id": row["nzb_message_id"],
+        "nzb_fetch_failed": bool(row["nzb_fetch_failed"]),
+        "first_seen": row["first_seen"],
+        "last_seen": row["last_seen"],
+        "bytes": row["bytes"],
+        "size_human": row["size_human"],
+        "parts_received": row["parts_received"],
+        "parts_expected": row["parts_expected"],
+        "part_numbers": list(PartCoverage.decode(row["part_numbers"])),
+        "part_total": row["part_total"],
+        "articles": row["articles"],
+        "subjects": json.loads(row["subjects"]) if row["subjects"] else [],
+        "subject_count": row["subject_count"],
+        "filename_guess": row["filename_guess"],
+    }
+
+
+def read_releases(table) -> Iterator[dict]:
     if table == "releases_complete":
         conn = get_complete_db_readonly()
     else:
         conn = get_releases_db_readonly()
     if conn is None:
-        return []
-    if table == "releases_complete":
-        nzb_keys = load_nzb_release_keys()
-        rows = conn.execute("SELECT * FROM releases_complete").fetchall()
-        payload = []
-        for row in rows:
-            name_value = str(row["name"] or "").lower()
-            if "xxx" in name_value or "porn" in name_value:
-                continue
-            if "part" in name_value or name_value.endswith(".rar"):
-                continue
-            payload.append(
-                {
-                    "key": row["key"],
-                    "name": row["name"],
-                    "normalized_name": row["normalized_name"] if "normalized_name" in row.keys() else "",
-                    "filename_guess": row["filename_guess"],
-                    "nzb_fetch_failed": bool(row["nzb_fetch_failed"]),
-                    "nzb_source_subject": row["nzb_source_subject"],
-                    "nzb_article": row["nzb_article"],
-                    "nzb_message_id": row["nzb_message_id"],
-                    "groups": json.loads(row["groups"]) if row["groups"] else [],
-                    "poster": row["poster"],
-                    "bytes": row["bytes"],
-                    "size_human": row["size_human"],
-                    "first_seen": row["first_seen"],
-                    "last_seen": row["last_seen"],
-                    "parts_expected": row["parts_expected"],
-                    "parts_received": row["parts_received"],
-                    "type": row["type"],
-                    "quality": row["quality"],
-                    "source": row["source"],
-                    "codec": row["codec"],
-                    "audio": row["audio"],
-                    "languages": json.loads(row["languages"]) if row["languages"] else [],
-                    "subtitles": bool(row["subtitles"]),
-                    "tags": (
-                        json.loads(row["tags"])
-                        if "tags" in row.keys() and row["tags"]
-                        else []
-                    ),
-                    "nzb_created": row["key"] in nzb_keys,
-                }
-            )
+        return
+    try:
+        if table == "releases_complete":
+            nzb_keys = load_nzb_release_keys()
+            # Incremental filter runs re-insert changed rows, so rowid order is not age order.
+            for row in iter_rows(conn, "SELECT * FROM releases_complete ORDER BY last_seen DESC, key"):
+                name_value = str(row["name"] or "").lower()
+                if "xxx" in name_value or "porn" in name_value:
+                    continue
+                if "part" in name_value or name_value.endswith(".rar"):
+                    continue
+                yield _complete_row(row, nzb_keys)
+            return
+
+        for row in iter_rows(conn, "SELECT * FROM releases ORDER BY last_seen DESC"):
+            yield _raw_release_row(row)
+    finally:
         conn.close()
-        return payload
 
-    rows = conn.execute("SELECT * FROM releases").fetchall()
-    payload = []
-    for row in rows:
-        payload.append(
-            {
-                "key": row["key"],
-                "name": row["name"],
-                "normalized_name": row["normalized_name"],
-                "filename_hint": row["filename_hint"],
-                "poster": row["poster"],
-                "group": row["group_name"],
-                "source": row["source"],
-                "message_id": row["message_id"],
-                "nzb_source_subject": row["nzb_source_subject"],
-                "nzb_article": row["nzb_article"],
-                "nzb_message_id": row["nzb_message_id"],
-                "nzb_fetch_failed": bool(row["nzb_fetch_failed"]),
-                "first_seen": row["first_seen"],
-                "last_seen": row["last_seen"],
-                "bytes": row["bytes"],
-                "size_human": row["size_human"],
-                "parts_received": row["parts_received"],
-                "parts_expected": row["parts_expected"],
-                "part_numbers": json.loads(row["part_numbers"]) if row["part_numbers"] else [],
-                "part_total": row["part_total"],
-                "articles": row["articles"],
-                "subjects": json.loads(row["subjects"]) if row["subjects"] else [],
-            }
-        )
+
+def read_release_subjects(key: str) -> list[str] | None:
+    conn = get_releases_db_readonly()
+    if conn is None:
+        return None
+    row = conn.execute("SELECT agg_key, subjects FROM releases WHERE key = ?", (key,)).fetchone()
     conn.close()
-    return payload
+    if row is None:
+        return None
+    if not row["agg_key"]:
+        return json.loads(row["subjects"]) if row["subjects"] else []
+    ingest_conn = get_ingest_db_readonly()
+    if ingest_conn is None:
+        return []
+    try:
+        return list(iter_release_subjects(ingest_conn, row["agg_key"]))
+    finally:
+        ingest_conn.close()
+
+
+def _close_iterator(items) -> None:
+    # Generators over a DB cursor close their connection in a finally block.
+    close = getattr(items, "close", None)
+    if close is not None:
+        close()
 
 
 def _count_rows(conn, query, params=None) -> int:
@@ -148,6 +191,28 @@ def _count_rows(conn, query, params=None) -> int:
     return int(list(row)[0] or 0)
 
 
+_SAVE_PROGRESS = {"running": False, "done": 0, "total": 0}
+_SAVE_PROGRESS_LOCK = threading.Lock()
+
+
+def save_all_nzbs(directory: str | None) -> int | None:
+    """save_all_nzbs_to_disk with its progress in read_status; None while another save runs."""
+    with _SAVE_PROGRESS_LOCK:
+        if _SAVE_PROGRESS["running"]:
+            return None
+        _SAVE_PROGRESS.update(running=True, done=0, total=0)
+
+    def progress(done: int, total: int) -> None:
+        with _SAVE_PROGRESS_LOCK:
+            _SAVE_PROGRESS.update(done=done, total=total)
+
+    try:
+        return save_all_nzbs_to_disk(directory, progress=progress)
+    finally:
+        with _SAVE_PROGRESS_LOCK:
+            _SAVE_PROGRESS["running"] = False
+
+
 def read_status() -> dict:
     state_conn = get_state_db_readonly()
     ingest_conn = get_ingest_db_readonly()
@@ -166,6 +231,9 @@ def read_status() -> dict:
     for conn in (state_conn, ingest_conn, releases_conn, nzb_conn):
         if conn is not None:
             conn.close()
+    with _SAVE_PROGRESS_LOCK:
+        status["nzb_save"] = dict(_SAVE_PROGRESS)
+    status["db_connections"] = CONNECTIONS.stats()
     return status
 
 
@@ -178,44 +246,30 @@ def load_nzb_release_keys() -> set[str]:
     return {row["release_key"] for row in rows if row["release_key"]}
 
 
-def read_nzbs() -> list[dict]:
+def read_nzbs() -> Iterator[dict]:
     conn = get_nzb_db_readonly()
     if conn is None:
-        return []
+        return
     try:
-        rows = conn.execute(
-            """
-            SELECT key, name, source, group_name, poster, release_key, bytes, path, created_at, tags
-            FROM nzbs
-            ORDER BY created_at DESC
-            """
-        ).fetchall()
-        has_tags = True
-    except sqlite3.OperationalError:
-        rows = conn.execute(
-            """
-            SELECT key, name, source, group_name, poster, release_key, bytes, path, created_at
-            FROM nzbs
-            ORDER BY created_at DESC
-            """
-        ).fetchall()
-        has_tags = False
-    conn.close()
-    return [
-        {
-            "key": row["key"],
-            "name": row["name"],
-            "source": row["source"],
-            "group": row["group_name"],
-            "poster": row["poster"],
-            "release_key": row["release_key"],
-            "bytes": row["bytes"],
-            "path": row["path"],
-            "created_at": row["created_at"],
-            "tags": json.loads(row["tags"]) if has_tags and row["tags"] else [],
-        }
-        for row in rows
-    ]
+        has_tags = "tags" in {row[1] for row in conn.execute("PRAGMA table_info(nzbs)")}
+        columns = "key, name, source, group_name, poster, release_key, bytes, path, created_at"
+        if has_tags:
+            columns += ", tags"
+        for row in iter_rows(conn, f"SELECT {columns} FROM nzbs ORDER BY created_at DESC"):
+            yield {
+                "key": row["key"],
+                "name": row["name"],
+                "source": row["source"],
+                "group": row["group_name"],
+                "poster": row["poster"],
+                "release_key": row["release_key"],
+                "bytes": row["bytes"],
+                "path": row["path"],
+                "created_at": row["created_at"],
+                "tags": json.loads(row["tags"]) if has_tags and row["tags"] else [],
+            }
+    finally:
+        conn.close()
 
 
 def _collect_tags(raw_values: list[str]) -> list[str]:
@@ -267,15 +321,33 @@ def read_nzbs_by_tag(tag: str) -> list[dict]:
     return results
 
 
-def read_nzb_payload(key: str) -> tuple[str | None, bytes | None, str | None]:
+def read_nzb_payload(key: str) -> tuple[str | None, bytes | None, str | None, str | None]:
+    """Returns (name, stored payload, codec, path); the payload may still be compressed."""
     conn = get_nzb_db_readonly()
     if conn is None:
-        return None, None, None
-    row = conn.execute("SELECT name, payload, path FROM nzbs WHERE key = ?", (key,)).fetchone()
-    conn.close()
+        return None, None, None, None
+    try:
+        row = load_stored_payload(conn, key)
+    finally:
+        conn.close()
     if not row:
-        return None, None, None
-    return row["name"], row["payload"], row["path"]
+        return None, None, None, None
+    return row["name"], row["payload"], row["codec"], row["path"]
+
+
+def accepts_encoding(header: str | None, coding: str) -> bool:
+    for part in (header or "").split(","):
+        name, _, params = part.partition(";")
+        if name.strip().lower() not in {coding, "*"}:
+            continue
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
 
 
 def clear_db() -> dict[str, list[object]]:
@@ -289,6 +361,7 @@ def clear_db() -> dict[str, list[object]]:
     removed: list[str] = []
     failed: list[dict[str, str]] = []
     errors: list[Exception] = []
+    CONNECTIONS.close_idle()
     for path in db_paths:
         if not path:
             continue
@@ -342,10 +415,71 @@ class Handler(BaseHTTPRequestHandler):
         except BrokenPipeError:
             return
 
-    def _send_bytes(self, data: bytes, content_type: str, filename: str | None = None):
+    def _send_stream(
+        self,
+        items: Iterable,
+        content_type: str,
+        write: Callable[[Iterator], object],
+        headers: tuple[tuple[str, str], ...] = (),
+    ):
+        """Send 200 and hand the rows to write(rows), which writes the body to wfile."""
+        rows = iter(items)
+        try:
+            # The first row runs the query, so an error here can still be a 500.
+            first = next(rows, _NO_ROWS)
+        except sqlite3.Error as exc:
+            LOGGER.error("%s stream failed before the first row: %s", self.path, exc)
+            _close_iterator(rows)
+            return self._send_json({"ok": False, "error": "Database error"}, HTTPStatus.INTERNAL_SERVER_ERROR)
+        # No Content-Length: the body is written as rows are read and the
+        # HTTP/1.0 connection close ends it.
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            write(rows if first is _NO_ROWS else chain([first], rows))
+        except BrokenPipeError:
+            return
+        except sqlite3.Error as exc:
+            # Headers are gone; write() stops before the closing bracket or
+            # archive trailer, so the client sees a broken body, not a short one.
+            LOGGER.error("%s stream failed mid-body: %s", self.path, exc)
+            self.close_connection = True
+        finally:
+            _close_iterator(rows)
+
+    def _send_json_stream(self, items: Iterable, chunk_size: int = 64 * 1024):
+        def write(rows: Iterator) -> None:
+            buffer = ["["]
+            size = 1
+            for idx, item in enumerate(rows):
+                text = json.dumps(item)
+                buffer.append(text if idx == 0 else "," + text)
+                size += len(text) + 1
+                if size >= chunk_size:
+                    self.wfile.write("".join(buffer).encode("utf-8"))
+                    buffer.clear()
+                    size = 0
+            buffer.append("]")
+            self.wfile.write("".join(buffer).encode("utf-8"))
+
+        return self._send_stream(items, "application/json", write)
+
+    def _send_bytes(
+        self,
+        data: bytes,
+        content_type: str,
+        filename: str | None = None,
+        content_encoding: str | None = None,
+    ):
         self.send_response(HTTPStatus.OK)
         self.send_header("Content-Type", content_type)
         self.send_header("Content-Length", str(len(data)))
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+            self.send_header("Vary", "Accept-Encoding")
         if filename:
             self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
         self.end_headers()
@@ -380,6 +514,41 @@ class Handler(BaseHTTPRequestHandler):
         except BrokenPipeError:
             return
 
+    def _send_nzb_archive(self, options: dict):
+        fmt = str(options.get("format") or "zip").lower()
+        if fmt not in EXPORT_FORMATS:
+            return self._send_json({"ok": False, "error": "Unknown format"}, HTTPStatus.BAD_REQUEST)
+        keys = options.get("keys")
+        if keys is not None and not isinstance(keys, list):
+            return self._send_json({"ok": False, "error": "keys must be a list"}, HTTPStatus.BAD_REQUEST)
+        filters = {}
+        for name in ("tag", "since", "until"):
+            value = options.get(name)
+            if value is not None and not isinstance(value, str):
+                return self._send_json({"ok": False, "error": f"{name} must be a string"}, HTTPStatus.BAD_REQUEST)
+            filters[name] = value.strip() if value and value.strip() else None
+        conn = get_nzb_db_readonly()
+        if conn is None:
+            return self._send_json({"ok": False, "error": "No NZBs"}, HTTPStatus.NOT_FOUND)
+
+        def rows() -> Iterator:
+            try:
+                yield from iter_export_rows(
+                    conn, keys=[str(key) for key in keys] if keys is not None else None, **filters
+                )
+            finally:
+                conn.close()
+
+        def skipped(key: str, exc: Exception) -> None:
+            LOGGER.warning("NZB export skipped %s: %s", key, exc)
+
+        return self._send_stream(
+            rows(),
+            EXPORT_FORMATS[fmt],
+            lambda items: write_nzb_archive(self.wfile, items, fmt, on_skip=skipped),
+            headers=(("Content-Disposition", f'attachment; filename="nzbs.{fmt}"'),),
+        )
+
     def _read_body(self):
         length = int(self.headers.get("Content-Length", "0"))
         if not length:
@@ -403,11 +572,20 @@ class Handler(BaseHTTPRequestHandler):
             case "/permissions":
                 return self._send_file(os.path.join(WEB_DIR, "permissions.html"), "text/html; charset=utf-8")
             case "/api/releases":
-                return self._send_json(read_releases("releases_complete"))
+                return self._send_json_stream(read_releases("releases_complete"))
             case "/api/releases/raw":
-                return self._send_json(read_releases("releases"))
+                return self._send_json_stream(read_releases("releases"))
+            case "/api/releases/subjects":
+                query = parse_qs(parsed.query)
+                key = (query.get("key") or [None])[0]
+                if not key:
+                    return self._send_json({"ok": False, "error": "Missing key"}, HTTPStatus.BAD_REQUEST)
+                subjects = read_release_subjects(key)
+                if subjects is None:
+                    return self._send_json({"ok": False, "error": "Not found"}, HTTPStatus.NOT_FOUND)
+                return self._send_json(subjects)
             case "/api/nzbs":
-                return self._send_json(read_nzbs())
+                return self._send_json_stream(read_nzbs())
             case "/api/tags":
                 return self._send_json(read_all_tags())
             case "/api/status":
@@ -431,19 +609,28 @@ class Handler(BaseHTTPRequestHandler):
                 key = (query.get("key") or [None])[0]
                 if not key:
                     return self._send_json({"ok": False, "error": "Missing key"}, HTTPStatus.BAD_REQUEST)
-                name, payload, path_info = read_nzb_payload(key)
+                name, payload, codec, path_info = read_nzb_payload(key)
                 if not name and not payload and not path_info:
                     return self._send_json({"ok": False, "error": "Not found"}, HTTPStatus.NOT_FOUND)
                 filename = name or "release"
                 if not filename.lower().endswith(".nzb"):
                     filename = f"{filename}.nzb"
                 if payload is not None:
-                    return self._send_bytes(payload, "application/x-nzb", filename)
+                    # Stored gzip is sent as is; decompress only for clients that can't take it.
+                    if codec == PAYLOAD_CODEC and accepts_encoding(self.headers.get("Accept-Encoding"), codec):
+                        return self._send_bytes(payload, "application/x-nzb", filename, content_encoding=codec)
+                    return self._send_bytes(decode_payload(payload, codec), "application/x-nzb", filename)
                 if path_info and os.path.exists(path_info):
                     with open(path_info, "rb") as handle:
                         data = handle.read()
                     return self._send_bytes(data, "application/x-nzb", filename)
                 return self._send_json({"ok": False, "error": "Missing payload"}, HTTPStatus.NOT_FOUND)
+            case "/api/nzb/export":
+                query = parse_qs(parsed.query)
+                options = {name: values[0] for name, values in query.items() if name != "key"}
+                if "key" in query:
+                    options["keys"] = query["key"]
+                return self._send_nzb_archive(options)
             case "/api/groups":
                 return self._send_json(read_json(GROUPS_PATH, []))
             case "/api/settings":
@@ -470,8 +657,19 @@ class Handler(BaseHTTPRequestHandler):
                     return self._send_json({"ok": False, "error": "Invalid JSON"}, HTTPStatus.BAD_REQUEST)
                 settings_payload = apply_settings_payload(payload)
                 return self._send_json({"ok": True, "settings": settings_payload})
+            case "/api/nzb/export":
+                raw = self._read_body()
+                try:
+                    options = json.loads(raw.decode("utf-8") or "{}")
+                except json.JSONDecodeError:
+                    return self._send_json({"ok": False, "error": "Invalid JSON"}, HTTPStatus.BAD_REQUEST)
+                if not isinstance(options, dict):
+                    return self._send_json({"ok": False, "error": "Invalid JSON"}, HTTPStatus.BAD_REQUEST)
+                return self._send_nzb_archive(options)
             case "/api/nzb/save_all":
-                count = save_all_nzbs_to_disk(get_setting("TRICERAPOST_NZB_DIR") or None)
+                count = save_all_nzbs(get_setting("TRICERAPOST_NZB_DIR") or None)
+                if count is None:
+                    return self._send_json({"ok": False, "error": "Save already running"}, HTTPStatus.CONFLICT)
                 return self._send_json({"ok": True, "saved": count})
             case "/api/admin/clear_db":
                 raw = self._read_body()
@@ -526,6 +724,16 @@ def wait_for_quit(server, stop_event):
         termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
 
+def migrate_payloads_in_background(stop_event: threading.Event) -> None:
+    try:
+        count = migrate_stored_payloads(stop_event=stop_event)
+    except sqlite3.Error as exc:
+        LOGGER.warning("NZB payload migration stopped: %s", exc)
+        return
+    if count:
+        LOGGER.info("Moved %s stored NZB payloads into compressed blobs", count)
+
+
 def main():
     load_env()
     configure_logging()
@@ -538,6 +746,7 @@ def main():
     stop_event = threading.Event()
     quit_thread = threading.Thread(target=wait_for_quit, args=(httpd, stop_event))
     quit_thread.start()
+    threading.Thread(target=migrate_payloads_in_background, args=(stop_event,), daemon=True).start()
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
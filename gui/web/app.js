@@ -47,6 +47,11 @@ function renderStatus(status) {
   nzbsFound.textContent = formatNumber(status.nzbs_found);
   nzbsGenerated.textContent = formatNumber(status.nzbs_generated);
   setsRejected.textContent = formatNumber(status.sets_rejected);
+  const saveStatus = qs("save-all-status");
+  const save = status.nzb_save;
+  if (saveStatus && save && save.running) {
+    saveStatus.textContent = `Saving ${formatNumber(save.done)}/${formatNumber(save.total)}...`;
+  }
 }
 
 async function loadStatusOnce() {
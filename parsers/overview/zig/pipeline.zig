@@ -1,5 +1,7 @@
 const std = @import("std");
+const builtin = @import("builtin");
 
+const has_simd = builtin.cpu.arch == .wasm32 and std.Target.wasm.featureSetHas(builtin.cpu.features, .simd128);
 const allocator = std.heap.wasm_allocator;
 const Result = struct {
     size: u32,
@@ -44,6 +46,87 @@ const TAG_OTHER_REMASTERED: u6 = 31;
 const TAG_OTHER_EXTENDED: u6 = 32;
 const TAG_OTHER_10BIT: u6 = 33;
 
+const Token = struct {
+    text: []const u8,
+    bit: u6,
+};
+
+// Every token starts with a word character, so a match can only begin at a
+// word start. The SIMD matcher finds word starts 16 bytes at a time and only
+// verifies the tokens sharing the first (lowercased) byte at those positions.
+const TOKENS = [_]Token{
+    .{ .text = "2160p", .bit = TAG_RES_2160P },
+    .{ .text = "1080p", .bit = TAG_RES_1080P },
+    .{ .text = "720p", .bit = TAG_RES_720P },
+    .{ .text = "576p", .bit = TAG_RES_576P },
+    .{ .text = "480p", .bit = TAG_RES_480P },
+    .{ .text = "hdr10+", .bit = TAG_HDR_HDR10P },
+    .{ .text = "hdr10plus", .bit = TAG_HDR_HDR10P },
+    .{ .text = "hdr10", .bit = TAG_HDR_HDR10 },
+    .{ .text = "dolby vision", .bit = TAG_HDR_DV },
+    .{ .text = "dolby-vision", .bit = TAG_HDR_DV },
+    .{ .text = "dv", .bit = TAG_HDR_DV },
+    .{ .text = "hlg", .bit = TAG_HDR_HLG },
+    .{ .text = "sdr", .bit = TAG_HDR_SDR },
+    .{ .text = "x265", .bit = TAG_FMT_HEVC },
+    .{ .text = "h265", .bit = TAG_FMT_HEVC },
+    .{ .text = "h.265", .bit = TAG_FMT_HEVC },
+    .{ .text = "hevc", .bit = TAG_FMT_HEVC },
+    .{ .text = "x264", .bit = TAG_FMT_H264 },
+    .{ .text = "h264", .bit = TAG_FMT_H264 },
+    .{ .text = "h.264", .bit = TAG_FMT_H264 },
+    .{ .text = "avc", .bit = TAG_FMT_H264 },
+    .{ .text = "av1", .bit = TAG_FMT_AV1 },
+    .{ .text = "vp9", .bit = TAG_FMT_VP9 },
+    .{ .text = "web-dl", .bit = TAG_SRC_WEBDL },
+    .{ .text = "web.dl", .bit = TAG_SRC_WEBDL },
+    .{ .text = "web dl", .bit = TAG_SRC_WEBDL },
+    .{ .text = "webdl", .bit = TAG_SRC_WEBDL },
+    .{ .text = "webrip", .bit = TAG_SRC_WEBRIP },
+    .{ .text = "bluray", .bit = TAG_SRC_BLURAY },
+    .{ .text = "blu-ray", .bit = TAG_SRC_BLURAY },
+    .{ .text = "blu ray", .bit = TAG_SRC_BLURAY },
+    .{ .text = "hdtv", .bit = TAG_SRC_HDTV },
+    .{ .text = "remux", .bit = TAG_SRC_REMUX },
+    .{ .text = "uhd", .bit = TAG_SRC_UHD },
+    .{ .text = "dts-hd", .bit = TAG_AUD_DTS },
+    .{ .text = "dts hd", .bit = TAG_AUD_DTS },
+    .{ .text = "dtshd", .bit = TAG_AUD_DTS },
+    .{ .text = "dts", .bit = TAG_AUD_DTS },
+    .{ .text = "truehd", .bit = TAG_AUD_TRUEHD },
+    .{ .text = "atmos", .bit = TAG_AUD_ATMOS },
+    .{ .text = "aac", .bit = TAG_AUD_AAC },
+    .{ .text = "eac3", .bit = TAG_AUD_EAC3 },
+    .{ .text = "ddp", .bit = TAG_AUD_EAC3 },
+    .{ .text = "ac3", .bit = TAG_AUD_AC3 },
+    .{ .text = "dolby digital", .bit = TAG_AUD_AC3 },
+    .{ .text = "mkv", .bit = TAG_CONT_MKV },
+    .{ .text = "mp4", .bit = TAG_CONT_MP4 },
+    .{ .text = "avi", .bit = TAG_CONT_AVI },
+    .{ .text = "repack", .bit = TAG_OTHER_REPACK },
+    .{ .text = "proper", .bit = TAG_OTHER_PROPER },
+    .{ .text = "remastered", .bit = TAG_OTHER_REMASTERED },
+    .{ .text = "extended", .bit = TAG_OTHER_EXTENDED },
+    .{ .text = "10bit", .bit = TAG_OTHER_10BIT },
+    .{ .text = "10-bit", .bit = TAG_OTHER_10BIT },
+    .{ .text = "10 bit", .bit = TAG_OTHER_10BIT },
+};
+
+const TokenSet = u64;
+
+const FIRST_CHAR_TOKENS: [256]TokenSet = blk: {
+    @setEvalBranchQuota(10000);
+    var table = std.mem.zeroes([256]TokenSet);
+    for (TOKENS, 0..) |token, idx| {
+        table[token.text[0]] |= @as(TokenSet, 1) << @intCast(idx);
+    }
+    break :blk table;
+};
+
+const LANES = 16;
+const Block = @Vector(LANES, u8);
+const LaneMask = u16;
+
 pub export fn alloc(size: usize) usize {
     const buf = allocator.alloc(u8, size) catch return 0;
     return @intFromPtr(buf.ptr);
@@ -176,6 +259,77 @@ fn tagMask(text: []const u8) TagMask {
     return mask;
 }
 
+fn loadBlock(text: []const u8, start: usize) Block {
+    if (start + LANES <= text.len) return text[start..][0..LANES].*;
+    var padded = std.mem.zeroes([LANES]u8);
+    @memcpy(padded[0 .. text.len - start], text[start..]);
+    return padded;
+}
+
+fn laneMask(bits: @Vector(LANES, bool)) LaneMask {
+    return @bitCast(bits);
+}
+
+fn wordCharMask(block: Block) LaneMask {
+    const folded = block | @as(Block, @splat(0x20));
+    const alpha = laneMask(folded >= @as(Block, @splat('a'))) & laneMask(folded <= @as(Block, @splat('z')));
+    const digit = laneMask(block >= @as(Block, @splat('0'))) & laneMask(block <= @as(Block, @splat('9')));
+    const underscore = laneMask(block == @as(Block, @splat('_')));
+    return alpha | digit | underscore;
+}
+
+fn tokenEndsAt(text: []const u8, next_idx: usize) bool {
+    return next_idx >= text.len or !isWordChar(text[next_idx]);
+}
+
+fn matchTokensAt(text: []const u8, pos: usize, mask: TagMask) TagMask {
+    var found = mask;
+    var candidates = FIRST_CHAR_TOKENS[asciiLower(text[pos])];
+    while (candidates != 0) : (candidates &= candidates - 1) {
+        const token = TOKENS[@ctz(candidates)];
+        const bit = @as(TagMask, 1) << token.bit;
+        if (found & bit != 0) continue;
+        if (!matchesAt(text, token.text, pos)) continue;
+        if (!tokenEndsAt(text, pos + token.text.len)) continue;
+        found |= bit;
+    }
+    return found;
+}
+
+fn tagMaskSimd(text: []const u8) TagMask {
+    var mask: TagMask = 0;
+    var prev_word: LaneMask = 0;
+    var base: usize = 0;
+    while (base < text.len) : (base += LANES) {
+        const word = wordCharMask(loadBlock(text, base));
+        var starts = word & ~((word << 1) | prev_word);
+        prev_word = word >> (LANES - 1);
+        while (starts != 0) : (starts &= starts - 1) {
+            const pos = base + @ctz(starts);
+            if (pos >= text.len) break;
+            mask = matchTokensAt(text, pos, mask);
+        }
+    }
+    return mask;
+}
+
+fn hasNzbSimd(subject: []const u8) bool {
+    if (subject.len < 4) return false;
+    var base: usize = 0;
+    while (base + 3 < subject.len) : (base += LANES) {
+        var dots = laneMask(loadBlock(subject, base) == @as(Block, @splat('.')));
+        while (dots != 0) : (dots &= dots - 1) {
+            const i = base + @ctz(dots);
+            if (i + 3 >= subject.len) break;
+            if (asciiLower(subject[i + 1]) != 'n') continue;
+            if (asciiLower(subject[i + 2]) != 'z') continue;
+            if (asciiLower(subject[i + 3]) != 'b') continue;
+            if (tokenEndsAt(subject, i + 4)) return true;
+        }
+    }
+    return false;
+}
+
 fn hasNzb(subject: []const u8) bool {
     if (subject.len < 4) return false;
     var i: usize = 0;
@@ -225,7 +379,8 @@ pub export fn parse_overviews(in_ptr: usize, in_len: usize, out_ptr: usize, out_
 
         const size_value = parseSize(size_raw);
         var flags: u32 = 0;
-        if (hasNzb(subject)) flags |= FLAG_NZB;
+        const is_nzb = if (has_simd) hasNzbSimd(subject) else hasNzb(subject);
+        if (is_nzb) flags |= FLAG_NZB;
 
         const output = @as([*]Result, @ptrFromInt(out_ptr));
         output[out_index] = Result{ .size = size_value, .flags = flags };
@@ -236,5 +391,24 @@ pub export fn parse_overviews(in_ptr: usize, in_len: usize, out_ptr: usize, out_
 pub export fn parse_tag_mask(in_ptr: usize, in_len: usize) u64 {
     if (in_ptr == 0 or in_len == 0) return 0;
     const input = @as([*]const u8, @ptrFromInt(in_ptr))[0..in_len];
+    if (has_simd) return tagMaskSimd(input);
     return tagMask(input);
 }
+
+pub export fn parse_tag_masks(in_ptr: usize, in_len: usize, out_ptr: usize, out_len: usize) u32 {
+    if (in_ptr == 0 or out_ptr == 0) return 1;
+    const input = @as([*]const u8, @ptrFromInt(in_ptr))[0..in_len];
+    var idx: usize = 0;
+    const count = readU32(input, &idx) catch return 1;
+    const needed = @as(usize, count) * @sizeOf(TagMask);
+    if (out_len < needed) return 2;
+
+    const output = @as([*]align(1) TagMask, @ptrFromInt(out_ptr));
+    var out_index: usize = 0;
+    while (out_index < count) : (out_index += 1) {
+        const text_len = readU32(input, &idx) catch return 1;
+        const text = readBytes(input, &idx, text_len) catch return 1;
+        output[out_index] = if (has_simd) tagMaskSimd(text) else tagMask(text);
+    }
+    return 0;
+}
@@ -0,0 +1,412 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import db
+from app.aggregate import build_releases
+from app.db import (
+    bucket_range,
+    get_complete_db,
+    get_ingest_db,
+    get_releases_db,
+    get_releases_db_readonly,
+    init_ingest_db,
+    iter_rows,
+    release_bucket,
+)
+from app.ingest import append_record
+from app.nzb_store import load_nzb_release_keys, store_nzb_payload
+from app.release_filter import main as filter_main
+from app.release_filter import build_segments_for_release, iter_release_segments, pick_filename
+from gui.server import read_release_subjects
+
+
+def _header(subject, article, date="", poster="poster@example", group="alt.binaries.test"):
+    return {
+        "type": "header",
+        "group": group,
+        "article": article,
+        "subject": subject,
+        "poster": poster,
+        "date": date,
+        "bytes": 1000,
+        "message_id": f"<{article}@test>",
+    }
+
+
+BATCH_ONE = [
+    _header('"show.part01.rar" yEnc (1/3)', 1, "Mon, 01 Jan 2024 00:00:00 +0000"),
+    _header('"show.part01.rar" yEnc (2/3)', 2),
+    _header('"film.mkv" yEnc (1/2)', 3, "Mon, 01 Jan 2024 01:00:00 +0000", poster="other@example"),
+    {
+        "type": "nzb_failed",
+        "group": "alt.binaries.test",
+        "article": 4,
+        "subject": '"broken.nzb" yEnc (1/1)',
+        "poster": "poster@example",
+        "date": "",
+        "bytes": 0,
+        "message_id": "<4@test>",
+    },
+]
+NZB_FILE = {
+    "type": "nzb_file",
+    "group": "alt.binaries.test",
+    "article": 7,
+    "subject": '"show.part01.rar" yEnc (1/3)',
+    "poster": "poster@example",
+    "date": "Wed, 03 Jan 2024 00:00:00 +0000",
+    "bytes": 5000,
+    "message_id": "<7@test>",
+    "payload": {"segments": 4, "nzb_source_subject": "show.nzb", "nzb_article": 9, "nzb_message_id": "<9@test>"},
+}
+BATCH_TWO = [
+    _header('"show.part01.rar" yEnc (3/3)', 5, "Tue, 02 Jan 2024 00:00:00 +0000"),
+    _header('"new.release.mkv" yEnc (1/1)', 6, "Tue, 02 Jan 2024 01:00:00 +0000"),
+]
+
+
+class TestIncrementalAggregate(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._old_ingest_path = db.INGEST_DB_PATH
+        self._old_releases_path = db.RELEASES_DB_PATH
+        self._old_complete_path = db.COMPLETE_DB_PATH
+        self._old_nzb_path = db.NZB_DB_PATH
+        db.INGEST_DB_PATH = os.path.join(self._temp_dir.name, "ingest.db")
+        db.RELEASES_DB_PATH = os.path.join(self._temp_dir.name, "releases.db")
+        db.COMPLETE_DB_PATH = os.path.join(self._temp_dir.name, "complete.db")
+        db.NZB_DB_PATH = os.path.join(self._temp_dir.name, "nzbs.db")
+
+    def tearDown(self):
+        db.INGEST_DB_PATH = self._old_ingest_path
+        db.RELEASES_DB_PATH = self._old_releases_path
+        db.COMPLETE_DB_PATH = self._old_complete_path
+        db.NZB_DB_PATH = self._old_nzb_path
+        self._temp_dir.cleanup()
+
+    def _ingest(self, records):
+        conn = get_ingest_db()
+        init_ingest_db(conn)
+        for record in records:
+            append_record(conn, record)
+        conn.commit()
+        conn.close()
+
+    def _snapshot(self):
+        conn = get_releases_db()
+        rows = conn.execute("SELECT * FROM releases ORDER BY key").fetchall()
+        conn.close()
+        skip = {"change_seq"}
+        return [{k: row[k] for k in row.keys() if k not in skip} for row in rows]
+
+    def test_incremental_matches_full_rebuild(self):
+        self._ingest(BATCH_ONE)
+        first = build_releases()
+        self.assertEqual(3, len(first))
+
+        self._ingest(BATCH_TWO)
+        changed = build_releases()
+        self.assertEqual(2, len(changed))
+        self.assertTrue(any(key.endswith('"show"') for key in changed))
+        incremental = self._snapshot()
+
+        build_releases(full=True)
+        self.assertEqual(self._snapshot(), incremental)
+
+        show = next(row for row in incremental if row["key"].endswith('"show"'))
+        self.assertEqual("1-3", show["part_numbers"])
+        self.assertEqual(3, show["articles"])
+        self.assertEqual("Tue, 02 Jan 2024 00:00:00 +0000", show["last_seen"])
+
+    def test_no_new_rows_changes_nothing(self):
+        self._ingest(BATCH_ONE)
+        build_releases()
+        self.assertEqual(set(), build_releases())
+
+    def test_change_seq_marks_touched_rows(self):
+        self._ingest(BATCH_ONE)
+        build_releases()
+        self._ingest(BATCH_TWO)
+        changed = build_releases()
+        conn = get_releases_db()
+        latest = conn.execute("SELECT MAX(change_seq) FROM releases").fetchone()[0]
+        rows = conn.execute("SELECT key FROM releases WHERE change_seq = ?", (latest,)).fetchall()
+        conn.close()
+        self.assertEqual(changed, {row["key"] for row in rows})
+
+    def test_sql_engine_matches_python_engine(self):
+        undated = _header('"undated.bin" yEnc (1/2)', 8)
+        self._ingest(BATCH_ONE + [NZB_FILE] + BATCH_TWO + [undated, _header("", 9)])
+        build_releases(full=True, engine="python")
+        expected = self._snapshot()
+        build_releases(full=True, engine="sql")
+        self.assertEqual(expected, self._snapshot())
+
+    def test_sql_engine_incremental_matches_full(self):
+        self._ingest(BATCH_ONE)
+        build_releases(engine="sql")
+        self._ingest([NZB_FILE] + BATCH_TWO)
+        build_releases(engine="sql")
+        incremental = self._snapshot()
+        build_releases(full=True, engine="python")
+        self.assertEqual(self._snapshot(), incremental)
+
+    def test_sql_engine_backfills_precomputed_columns(self):
+        self._ingest(BATCH_ONE + BATCH_TWO)
+        conn = get_ingest_db()
+        conn.execute("UPDATE ingest SET normalized_subject=NULL, part_num=NULL, part_total=NULL, filename=NULL")
+        conn.commit()
+        conn.close()
+        build_releases(full=True, engine="python")
+        expected = self._snapshot()
+        build_releases(full=True, engine="sql")
+        self.assertEqual(expected, self._snapshot())
+
+    def test_subjects_are_sampled_with_full_list_on_demand(self):
+        subjects = [f'[{idx}/13] - "big.vol{idx:02d}+01.par2" yEnc (1/1)' for idx in range(1, 13)]
+        subjects.append('[13/13] - "big.part01.rar" yEnc (1/1)')
+        records = [_header(subject, idx) for idx, subject in enumerate(subjects, start=1)]
+        self._ingest(records[:7])
+        build_releases(engine="sql")
+        # Reposts of known subjects, split across runs, must not inflate the count.
+        self._ingest(records[7:] + records[:2])
+        build_releases(engine="sql")
+        incremental = self._snapshot()
+        build_releases(full=True, engine="python")
+        self.assertEqual(self._snapshot(), incremental)
+        self._ingest(records[2:4])
+        build_releases(engine="python")
+        self.assertEqual(13, self._snapshot()[0]["subject_count"])
+        build_releases(full=True, engine="sql")
+        self.assertEqual(13, self._snapshot()[0]["subject_count"])
+
+        (row,) = incremental
+        self.assertEqual(subjects[:5], json.loads(row["subjects"]))
+        self.assertEqual(13, row["subject_count"])
+        self.assertEqual(pick_filename(sorted(subjects)), row["filename_guess"])
+        self.assertEqual("big.rar", row["filename_guess"])
+        self.assertEqual(sorted(subjects), read_release_subjects(row["key"]))
+        self.assertIsNone(read_release_subjects("missing"))
+
+    def test_sharded_rebuild_matches_serial(self):
+        records = []
+        article = 0
+        for poster_idx in range(6):
+            for group in ("alt.binaries.a", "alt.binaries.b"):
+                for set_idx in range(3):
+                    for part in range(1, 6):
+                        article += 1
+                        subject = f'"set{set_idx}.mkv" yEnc ({part}/5)'
+                        date = f"2024-01-{article % 28 + 1:02d}"
+                        records.append(_header(subject, article, date, f"poster{poster_idx}@example", group))
+        self._ingest(records + [NZB_FILE])
+        ranges = [bucket_range((idx, 3)) for idx in range(3)]
+        buckets = {release_bucket(r["poster"], r["group"]) for r in records}
+        owners = {idx for bucket in buckets for idx, (lo, hi) in enumerate(ranges) if lo <= bucket <= hi}
+        self.assertGreater(len(owners), 1)
+        # Rows from before release_bucket existed are backfilled by the sharded rebuild.
+        conn = get_ingest_db()
+        conn.execute("UPDATE ingest SET release_bucket = NULL WHERE id % 2 = 0")
+        conn.commit()
+        conn.close()
+        for engine in ("python", "sql"):
+            build_releases(full=True, engine=engine, workers=1)
+            serial = self._snapshot()
+            build_releases(full=True, engine=engine, workers=3)
+            self.assertEqual(serial, self._snapshot())
+        conn = get_ingest_db()
+        self.assertEqual(0, conn.execute("SELECT COUNT(*) FROM ingest WHERE release_bucket IS NULL").fetchone()[0])
+        conn.close()
+
+        # Filter shards read their poster_bucket range; older rows are backfilled first.
+        conn = get_releases_db()
+        conn.execute("UPDATE releases SET poster_bucket = NULL WHERE rowid % 2 = 0")
+        conn.commit()
+        plan = " ".join(
+            row[3]
+            for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT key FROM releases WHERE poster_bucket BETWEEN ? AND ?", bucket_range((0, 3))
+            )
+        )
+        self.assertIn("idx_releases_poster_bucket", plan)
+        conn.close()
+        with mock.patch("app.nzb_store.verify_message_ids", return_value=(False, "offline")):
+            filter_main(["--full", "--workers", "1"])
+            serial = self._complete_snapshot()
+            filter_main(["--full", "--workers", "3"])
+            self.assertEqual(serial, self._complete_snapshot())
+        self.assertEqual(19, len(serial))
+        conn = get_releases_db()
+        self.assertEqual(0, conn.execute("SELECT COUNT(*) FROM releases WHERE poster_bucket IS NULL").fetchone()[0])
+        conn.close()
+
+    def test_filter_skips_releases_that_already_have_nzbs(self):
+        self._ingest(
+            [
+                _header(f'"set{idx}.mkv" yEnc ({part}/2)', idx * 2 + part, "2024-01-01")
+                for idx in range(3)
+                for part in (1, 2)
+            ]
+        )
+        build_releases()
+        store_nzb_payload(name="set1.mkv", payload=b"<nzb/>", source="found", release_key="set1.mkv|poster@example")
+        verify = mock.Mock(return_value=(False, "offline"))
+        with mock.patch("app.nzb_store.verify_message_ids", verify):
+            filter_main(["--workers", "1"])
+        verified = sorted(call.args[0][0] for call in verify.call_args_list)
+        self.assertEqual(["<1@test>", "<5@test>"], verified)
+
+    def test_nzb_generation_reuses_one_session_per_worker(self):
+        self._ingest(
+            [
+                _header(f'"set{idx}.mkv" yEnc ({part}/2)', idx * 2 + part, "2024-01-01")
+                for idx in range(8)
+                for part in (1, 2)
+            ]
+        )
+        build_releases()
+        sessions = []
+
+        def verify(message_ids, session=None):
+            sessions.append(session)
+            return True, None
+
+        with mock.patch("app.nzb_store.verify_message_ids", side_effect=verify), mock.patch(
+            "app.release_filter.NZB_COMMIT_BATCH", 3
+        ), mock.patch.dict(os.environ, {"TRICERAPOST_NZB_WORKERS": "2"}):
+            filter_main([])
+        self.assertEqual(8, len(sessions))
+        self.assertLessEqual(len({id(session) for session in sessions}), 2)
+        self.assertEqual(8, len(load_nzb_release_keys()))
+
+    def test_nzb_generation_records_segment_status(self):
+        # Real Verifier, NzbStore and segment status cache; only the NNTP server is faked.
+        self._ingest(
+            [
+                _header(f'"set{idx}.mkv" yEnc ({part}/2)', idx * 2 + part, "2024-01-01")
+                for idx in range(6)
+                for part in (1, 2)
+            ]
+        )
+        build_releases()
+        client = mock.Mock()
+        env = {"TRICERAPOST_NZB_WORKERS": "4", "TRICERAPOST_SEGMENT_STATUS_TTL": "3600"}
+        with mock.patch("app.nzb_store._connect_nntp", return_value=client), mock.patch.dict(os.environ, env):
+            filter_main([])
+        self.assertEqual(6, len(load_nzb_release_keys()))
+        self.assertEqual(12, client.stat.call_count)
+        conn = db.get_nzb_db_readonly()
+        self.assertEqual(12, conn.execute("SELECT COUNT(*) FROM segment_status WHERE present = 1").fetchone()[0])
+        conn.close()
+
+    def test_incremental_filter_matches_full(self):
+        dup = _header('"dup.part01.rar" yEnc (1/1)', 20, "2024-01-05")
+        self._ingest(BATCH_ONE + [dup])
+        build_releases()
+        offline = mock.patch("app.nzb_store.verify_message_ids", return_value=(False, "offline"))
+        with offline:
+            filter_main([])
+            self.assertEqual(["dup.part01.rar|poster@example"], [row["key"] for row in self._complete_snapshot()])
+
+            rival = _header('Prefix - "dup.part01.rar" yEnc (1/1)', 21, "2024-01-03")
+            self._ingest(BATCH_TWO + [rival])
+            build_releases()
+            with mock.patch("app.release_filter.load_releases", side_effect=AssertionError("full reload")):
+                filter_main([])
+            incremental = self._complete_snapshot()
+            filter_main(["--full"])
+        self.assertEqual(self._complete_snapshot(), incremental)
+        by_key = {row["key"]: row for row in incremental}
+        self.assertEqual(
+            {"dup.part01.rar|poster@example", "show.part01.rar|poster@example", "new.release.mkv|poster@example"},
+            set(by_key),
+        )
+        self.assertEqual("Prefix - \"dup\"", by_key["dup.part01.rar|poster@example"]["normalized_name"])
+
+    def _complete_snapshot(self):
+        conn = get_complete_db()
+        rows = conn.execute("SELECT * FROM releases_complete ORDER BY key").fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def test_full_rebuild_swaps_table_under_open_reader(self):
+        self._ingest(BATCH_ONE)
+        build_releases()
+        reader = get_releases_db_readonly()
+        rows = iter_rows(reader, "SELECT key FROM releases ORDER BY key", arraysize=1)
+        first = next(rows)
+
+        self._ingest(BATCH_TWO)
+        build_releases(full=True)
+        self.assertEqual(3, 1 + len(list(rows)))
+        self.assertEqual(first["key"], min(row["key"] for row in self._snapshot()))
+        reader.close()
+
+        self.assertEqual(4, len(self._snapshot()))
+        conn = get_releases_db()
+        names = {row["name"] for row in conn.execute("SELECT name FROM sqlite_master")}
+        conn.close()
+        self.assertIn("idx_releases_agg_key", names)
+        self.assertIn("idx_releases_change_seq", names)
+        self.assertNotIn(db.shadow_name("releases"), names)
+
+    def _segments(self):
+        conn = get_releases_db()
+        rows = conn.execute("SELECT * FROM release_segments ORDER BY ingest_id").fetchall()
+        conn.close()
+        return [tuple(row) for row in rows]
+
+    def test_segment_index_serves_release_segments(self):
+        self._ingest(BATCH_ONE)
+        build_releases()
+        self._ingest(BATCH_TWO + [_header('"show.part01.rar" yEnc (2/3)', 10, group="alt.binaries.other")])
+        build_releases()
+        entry = {
+            "name": "show.rar",
+            "normalized_name": '"show"',
+            "poster": "poster@example",
+            "groups": ["alt.binaries.other", "alt.binaries.test"],
+            "parts_expected": 3,
+        }
+        segments = build_segments_for_release(entry)
+        self.assertEqual(
+            [(1, "<1@test>"), (2, "<2@test>"), (3, "<5@test>")],
+            [(seg["number"], seg["message_id"]) for seg in segments],
+        )
+        self.assertEqual([], build_segments_for_release({**entry, "parts_expected": 4}))
+
+        incremental = self._segments()
+        build_releases(full=True)
+        self.assertEqual(incremental, self._segments())
+
+        entries = [entry, {**entry, "normalized_name": '"film"', "poster": "other@example"}]
+        conn = get_releases_db_readonly()
+        looked_up = list(iter_release_segments(entries, conn))
+        with mock.patch("app.release_filter.SEGMENT_HASH_JOIN_MIN", 0):
+            joined = list(iter_release_segments(entries, conn))
+        conn.close()
+        self.assertEqual([(entry, segments)], looked_up)
+        self.assertEqual(looked_up, joined)
+
+        conn = get_releases_db()
+        conn.execute("DELETE FROM release_segments")
+        conn.execute("DELETE FROM aggregate_state WHERE name = 'segment_watermark'")
+        conn.commit()
+        conn.close()
+        build_releases()
+        self.assertEqual(incremental, self._segments())
+
+    def test_ingest_reset_forces_full_rebuild(self):
+        self._ingest(BATCH_ONE + BATCH_TWO)
+        build_releases()
+        os.remove(db.INGEST_DB_PATH)
+        self._ingest(BATCH_TWO)
+        build_releases()
+        self.assertEqual(2, len(self._snapshot()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from app.db import ConnectionManager, PragmaProfile, init_state_db
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "state.db")
+        self.manager = ConnectionManager(PragmaProfile(cache_mb=4, mmap_mb=8, wal_autocheckpoint=500), pool_size=2)
+
+    def tearDown(self):
+        self.manager.close_idle()
+        self.tmpdir.cleanup()
+
+    def _create(self):
+        conn = self.manager.acquire(self.path)
+        init_state_db(conn)
+        conn.commit()
+        conn.close()
+
+    def test_close_returns_connection_to_pool(self):
+        first = self.manager.acquire(self.path)
+        first.close()
+        second = self.manager.acquire(self.path)
+        self.assertIs(first, second)
+        second.execute("SELECT 1").fetchone()
+        second.close()
+        stats = self.manager.stats()["state.db"]
+        self.assertEqual((stats["opened"], stats["reused"], stats["in_use"], stats["idle"]), (1, 1, 0, 1))
+
+    def test_concurrent_leases_get_separate_connections(self):
+        first = self.manager.acquire(self.path)
+        second = self.manager.acquire(self.path)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.manager.stats()["state.db"]["peak_in_use"], 2)
+        first.close()
+        second.close()
+        first.close()
+        self.assertEqual(self.manager.stats()["state.db"]["in_use"], 0)
+
+    def test_pool_size_limits_idle_connections(self):
+        conns = [self.manager.acquire(self.path) for _ in range(3)]
+        for conn in conns:
+            conn.close()
+        stats = self.manager.stats()["state.db"]
+        self.assertEqual((stats["idle"], stats["closed"]), (2, 1))
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conns[2].execute("SELECT 1")
+
+    def test_release_rolls_back_uncommitted_writes(self):
+        self._create()
+        conn = self.manager.acquire(self.path)
+        conn.execute("INSERT INTO state (group_name, last_article) VALUES ('g', 1)")
+        conn.close()
+        conn = self.manager.acquire(self.path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM state").fetchone()[0], 0)
+        conn.close()
+
+    def test_pragma_profile_applied(self):
+        self._create()
+        writer = self.manager.acquire(self.path)
+        reader = self.manager.acquire(self.path, readonly=True)
+        self.assertEqual(writer.execute("PRAGMA cache_size").fetchone()[0], -4096)
+        self.assertEqual(writer.execute("PRAGMA temp_store").fetchone()[0], 2)
+        self.assertEqual(writer.execute("PRAGMA wal_autocheckpoint").fetchone()[0], 500)
+        self.assertEqual(writer.execute("PRAGMA query_only").fetchone()[0], 0)
+        self.assertEqual(reader.execute("PRAGMA query_only").fetchone()[0], 1)
+        self.assertEqual(reader.execute("PRAGMA mmap_size").fetchone()[0], 8 * 1024 * 1024)
+        with self.assertRaises(sqlite3.OperationalError):
+            reader.execute("CREATE TEMP TABLE scratch (x)")
+        writer.close()
+        reader.close()
+
+    def test_readonly_missing_file_returns_none(self):
+        self.assertIsNone(self.manager.acquire(self.path, readonly=True))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_replaced_file_gets_fresh_connection(self):
+        self._create()
+        stale = self.manager.acquire(self.path, readonly=True)
+        stale.close()
+        os.remove(self.path)
+        self.assertIsNone(self.manager.acquire(self.path, readonly=True))
+        self._create()
+        fresh = self.manager.acquire(self.path, readonly=True)
+        self.assertIsNot(fresh, stale)
+        self.assertEqual(fresh.execute("SELECT COUNT(*) FROM state").fetchone()[0], 0)
+        fresh.close()
+
+    def test_connection_can_move_between_threads(self):
+        self._create()
+        conn = self.manager.acquire(self.path)
+        conn.close()
+        seen = []
+
+        def worker():
+            leased = self.manager.acquire(self.path)
+            seen.append((leased, leased.execute("SELECT COUNT(*) FROM state").fetchone()[0]))
+            leased.close()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [(conn, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import io
+import os
+import sqlite3
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from app import db
+from app.nzb_export import iter_export_rows, write_nzb_archive
+from app.nzb_store import NzbStore
+
+
+class TestNzbExport(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._old_nzb_path = db.NZB_DB_PATH
+        db.NZB_DB_PATH = os.path.join(self._temp_dir.name, "nzbs.db")
+        self.keys = {}
+        created = {}
+        with NzbStore() as store:
+            for name, tags, created_at in (
+                ("Show.S01E01", ["resolution:1080p"], "2024-01-01 10:00:00"),
+                ("Show.S01E02", ["resolution:720p"], "2024-02-01 10:00:00"),
+                ("Movie", ["Resolution:1080p", "hdr:hdr"], "2024-03-01 10:00:00"),
+            ):
+                payload = f"<nzb>{name}</nzb>".encode()
+                key, _ = store.store_payload(name=name, payload=payload, source="found", tags=tags)
+                self.keys[name] = key
+                created[key] = created_at
+        conn = db.get_nzb_db()
+        conn.executemany("UPDATE nzbs SET created_at = ? WHERE key = ?", [(at, key) for key, at in created.items()])
+        conn.commit()
+        conn.close()
+        self.conn = db.get_nzb_db_readonly()
+
+    def tearDown(self):
+        self.conn.close()
+        db.NZB_DB_PATH = self._old_nzb_path
+        self._temp_dir.cleanup()
+
+    def _names(self, **filters):
+        return sorted(row["name"] for row in iter_export_rows(self.conn, **filters))
+
+    def test_filters(self):
+        self.assertEqual(["Movie", "Show.S01E01", "Show.S01E02"], self._names())
+        self.assertEqual(["Movie", "Show.S01E01"], self._names(tag="resolution:1080P"))
+        self.assertEqual(["Show.S01E02"], self._names(since="2024-02-01", until="2024-03-01T10:00:00"))
+        self.assertEqual(["Movie"], self._names(tag="resolution:1080p", since="2024-02-01"))
+        keys = [self.keys["Movie"], self.keys["Show.S01E02"], self.keys["Movie"], "missing"]
+        self.assertEqual(["Movie", "Show.S01E02"], self._names(keys=keys))
+        self.assertEqual([], self._names(keys=[]))
+
+    def test_zip_archive(self):
+        out = io.BytesIO()
+        self.assertEqual(2, write_nzb_archive(out, iter_export_rows(self.conn, tag="resolution:1080p"), "zip"))
+        with zipfile.ZipFile(io.BytesIO(out.getvalue())) as archive:
+            members = {info.filename: info for info in archive.infolist()}
+            name = f"{self.keys['Movie'][:8]}_Movie.nzb"
+            self.assertEqual(b"<nzb>Movie</nzb>", archive.read(name))
+            self.assertEqual((2024, 3, 1, 10, 0, 0), members[name].date_time)
+            self.assertEqual(2, len(members))
+
+    def test_tar_archive_on_unseekable_stream(self):
+        class Pipe:
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, data):
+                self.chunks.append(bytes(data))
+                return len(data)
+
+        pipe = Pipe()
+        self.assertEqual(3, write_nzb_archive(pipe, iter_export_rows(self.conn), "tar"))
+        with tarfile.open(fileobj=io.BytesIO(b"".join(pipe.chunks)), mode="r:") as archive:
+            contents = {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+        self.assertEqual(b"<nzb>Show.S01E02</nzb>", contents[f"{self.keys['Show.S01E02'][:8]}_Show.S01E02.nzb"])
+        self.assertEqual(3, len(contents))
+
+    def test_corrupt_payload_is_skipped(self):
+        conn = db.get_nzb_db()
+        conn.execute(
+            "UPDATE nzb_blobs SET payload = ? WHERE hash = (SELECT payload_hash FROM nzbs WHERE key = ?)",
+            (b"not gzip", self.keys["Movie"]),
+        )
+        conn.commit()
+        conn.close()
+        skipped = []
+        out = io.BytesIO()
+        count = write_nzb_archive(out, iter_export_rows(self.conn), "zip", on_skip=lambda key, exc: skipped.append(key))
+        self.assertEqual((2, [self.keys["Movie"]]), (count, skipped))
+        with zipfile.ZipFile(io.BytesIO(out.getvalue())) as archive:
+            self.assertEqual(2, len(archive.namelist()))
+
+    def test_failed_rows_leave_no_trailer(self):
+        def rows():
+            yield from iter_export_rows(self.conn, keys=[self.keys["Movie"]])
+            raise sqlite3.OperationalError("disk I/O error")
+
+        for fmt, error in (("zip", zipfile.BadZipFile), ("tar", tarfile.ReadError)):
+            out = io.BytesIO()
+            with self.assertRaises(sqlite3.OperationalError):
+                write_nzb_archive(out, rows(), fmt)
+            with self.assertRaises(error):
+                if fmt == "zip":
+                    zipfile.ZipFile(io.BytesIO(out.getvalue()))
+                else:
+                    tarfile.open(fileobj=io.BytesIO(out.getvalue()), mode="r:").getmembers()
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            write_nzb_archive(io.BytesIO(), [], "rar")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,386 @@
+import gzip
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app import db
+from app.bloom_filter import BloomFilter
+from app.nntp_client import NNTPError
+from app import nzb_store
+from app.nzb_store import (
+    NNTPSession,
+    NzbStore,
+    Verifier,
+    decode_payload,
+    load_stored_payload,
+    migrate_stored_payloads,
+    save_all_nzbs_to_disk,
+    save_nzb_to_disk,
+    segment_status_cache,
+    store_nzb_payload,
+    verify_message_ids,
+)
+
+
+class _NzbDbTestCase(unittest.TestCase):
+    ttl = "0"
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._old_nzb_path = db.NZB_DB_PATH
+        db.NZB_DB_PATH = os.path.join(self._temp_dir.name, "nzbs.db")
+        env = mock.patch.dict(os.environ, {"TRICERAPOST_SEGMENT_STATUS_TTL": self.ttl})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def tearDown(self):
+        db.NZB_DB_PATH = self._old_nzb_path
+        self._temp_dir.cleanup()
+
+
+class TestVerifySession(_NzbDbTestCase):
+    def test_session_keeps_connection_between_calls(self):
+        client = mock.Mock()
+        with mock.patch("app.nzb_store._connect_nntp", return_value=client) as connect:
+            session = NNTPSession()
+            self.assertEqual((True, None), verify_message_ids(["a@b"], session))
+            self.assertEqual((True, None), verify_message_ids(["<c@d>"], session))
+            session.close()
+        self.assertEqual(1, connect.call_count)
+        client.stat.assert_has_calls([mock.call("<a@b>"), mock.call("<c@d>")])
+        client.quit.assert_called_once()
+
+    def test_missing_article_keeps_connection(self):
+        client = mock.Mock()
+        client.stat.side_effect = [NNTPError("430 no such article"), "223 ok"]
+        with mock.patch("app.nzb_store._connect_nntp", return_value=client) as connect:
+            session = NNTPSession()
+            self.assertEqual((False, "430 no such article"), verify_message_ids(["a@b"], session))
+            self.assertEqual((True, None), verify_message_ids(["a@b"], session))
+        self.assertEqual(1, connect.call_count)
+        client.quit.assert_not_called()
+
+    def test_other_status_errors_close_connection(self):
+        for status in ("480 authentication required", "502 service unavailable"):
+            dead = mock.Mock()
+            dead.stat.side_effect = NNTPError(status)
+            fresh = mock.Mock()
+            with mock.patch("app.nzb_store._connect_nntp", side_effect=[dead, fresh]) as connect:
+                with Verifier() as verifier:
+                    self.assertEqual((False, status), verifier.verify(["a@b"]))
+                    dead.quit.assert_called_once()
+                    self.assertEqual((True, None), verifier.verify(["a@b"]))
+                    self.assertEqual(1, verifier.session_count())
+            self.assertEqual(2, connect.call_count)
+            dead.stat.assert_called_once_with("<a@b>")
+            fresh.stat.assert_called_once_with("<a@b>")
+
+    def test_dropped_connection_reconnects_and_retries(self):
+        broken = mock.Mock()
+        broken.stat.side_effect = NNTPError("Connection closed")
+        fresh = mock.Mock()
+        with mock.patch("app.nzb_store._connect_nntp", side_effect=[broken, fresh]):
+            session = NNTPSession()
+            self.assertEqual((True, None), verify_message_ids(["a@b"], session))
+        broken.quit.assert_called_once()
+        fresh.stat.assert_called_once_with("<a@b>")
+
+    def test_gives_up_after_one_retry(self):
+        with mock.patch("app.nzb_store._connect_nntp", side_effect=OSError("refused")) as connect:
+            self.assertEqual((False, "refused"), verify_message_ids(["a@b"]))
+        self.assertEqual(2, connect.call_count)
+
+    def test_without_session_connection_is_closed(self):
+        client = mock.Mock()
+        with mock.patch("app.nzb_store._connect_nntp", return_value=client):
+            self.assertEqual((True, None), verify_message_ids(["a@b"]))
+        client.quit.assert_called_once()
+
+
+class TestVerifier(_NzbDbTestCase):
+    def test_sessions_are_reused_across_calls_and_closed_once(self):
+        clients = []
+
+        def connect():
+            clients.append(mock.Mock())
+            return clients[-1]
+
+        with mock.patch("app.nzb_store._connect_nntp", side_effect=connect):
+            with Verifier() as verifier:
+                for _ in range(5):
+                    self.assertEqual((True, None), verifier.verify(["a@b"]))
+                self.assertEqual(1, verifier.session_count())
+        self.assertEqual(1, len(clients))
+        self.assertEqual(5, clients[0].stat.call_count)
+        clients[0].quit.assert_called_once()
+
+    def test_concurrent_callers_get_separate_sessions(self):
+        release = threading.Event()
+        started = threading.Barrier(3)
+
+        def stat(_msg):
+            started.wait(timeout=5)
+            release.wait(timeout=5)
+
+        with mock.patch("app.nzb_store._connect_nntp", side_effect=lambda: mock.Mock(stat=stat)):
+            verifier = Verifier()
+            threads = [threading.Thread(target=verifier.verify, args=(["a@b"],)) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            started.wait(timeout=5)
+            release.set()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(2, verifier.session_count())
+            verifier.close()
+            self.assertEqual(0, verifier.session_count())
+
+
+class TestSegmentStatusCache(_NzbDbTestCase):
+    ttl = "3600"
+
+    def test_present_ids_are_not_checked_again(self):
+        client = mock.Mock()
+        with mock.patch("app.nzb_store._connect_nntp", return_value=client):
+            self.assertEqual((True, None), verify_message_ids(["a@b", "c@d"]))
+            self.assertEqual((True, None), verify_message_ids(["<c@d>", "e@f"]))
+        self.assertEqual(["<a@b>", "<c@d>", "<e@f>"], [call.args[0] for call in client.stat.call_args_list])
+
+    def test_known_missing_id_fails_without_nntp(self):
+        client = mock.Mock()
+        client.stat.side_effect = ["223 ok", NNTPError("430 no such article")]
+        with mock.patch("app.nzb_store._connect_nntp", return_value=client) as connect:
+            self.assertEqual((False, "430 no such article"), verify_message_ids(["a@b", "gone@x"]))
+            ok, reason = verify_message_ids(["new@x", "gone@x"])
+        self.assertFalse(ok)
+        self.assertIn("<gone@x>", reason)
+        self.assertEqual(1, connect.call_count)
+
+        cache = segment_status_cache()
+        self.assertEqual("<gone@x>", cache.known_missing(["<a@b>", "<gone@x>"]))
+        self.assertEqual(["<new@x>"], cache.unchecked(["<a@b>", "<new@x>"]))
+
+    def test_entries_expire_after_ttl(self):
+        cache = segment_status_cache()
+        with mock.patch("app.nzb_store.time.time", return_value=1000):
+            cache.record(["<a@b>"], "<gone@x>")
+        self.assertEqual(["<a@b>"], cache.unchecked(["<a@b>"]))
+        self.assertIsNone(cache.known_missing(["<gone@x>"]))
+
+    def test_verify_while_store_transaction_is_open(self):
+        client = mock.Mock()
+        client.stat.side_effect = ["223 ok", "223 ok", NNTPError("430 no such article")]
+        with mock.patch("app.nzb_store._connect_nntp", return_value=client):
+            store = NzbStore(batch_size=100, batch_seconds=3600)
+            store.store_payload(name="one", payload=b"<nzb/>", source="found", tags=[])
+            self.assertEqual((True, None), verify_message_ids(["a@b"]))
+            store.store_payload(name="two", payload=b"<nzb/>", source="found", tags=[])
+            self.assertEqual((False, "430 no such article"), verify_message_ids(["a@b", "c@d", "gone@x"]))
+            # Buffered rows already answer lookups before the store commits.
+            self.assertEqual((False, "430 <gone@x> (cached)"), verify_message_ids(["gone@x"]))
+            store.commit()
+            store.close()
+        self.assertEqual(3, client.stat.call_count)
+        conn = db.get_nzb_db_readonly()
+        rows = dict(conn.execute("SELECT message_id, present FROM segment_status").fetchall())
+        conn.close()
+        self.assertEqual({"<a@b>": 1, "<c@d>": 1, "<gone@x>": 0}, rows)
+
+    def test_other_status_errors_are_not_cached(self):
+        client = mock.Mock()
+        client.stat.side_effect = NNTPError("480 authentication required")
+        with mock.patch("app.nzb_store._connect_nntp", return_value=client):
+            verify_message_ids(["a@b"])
+        self.assertIsNone(segment_status_cache().known_missing(["<a@b>"]))
+
+
+class TestNzbStore(_NzbDbTestCase):
+    def _count(self, table="nzbs"):
+        conn = db.get_nzb_db_readonly()
+        try:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_second_writer_waits_at_most_batch_seconds(self):
+        store = NzbStore(batch_size=100, batch_seconds=0.2)
+        store.store_payload(name="one", payload=b"<nzb/>", source="found", tags=[])
+        other = sqlite3.connect(db.NZB_DB_PATH, timeout=5)
+        try:
+            started = time.monotonic()
+            other.execute("INSERT INTO nzb_invalid (key, name, source, reason) VALUES ('k', 'bad', 'found', '430')")
+            other.commit()
+            self.assertLess(time.monotonic() - started, 4)
+        finally:
+            other.close()
+        # The timer committed the batch without another store call.
+        self.assertEqual(1, self._count())
+        store.store_invalid(name="worse", source="found", reason="430")
+        store.commit()
+        store.close()
+        self.assertEqual(2, self._count("nzb_invalid"))
+
+    def test_initializes_once_and_commits_in_batches(self):
+        with mock.patch("app.nzb_store.init_nzb_db", wraps=db.init_nzb_db) as init:
+            store = NzbStore(batch_size=3, batch_seconds=3600)
+            for idx in range(4):
+                store.store_payload(name=f"set{idx}", payload=b"<nzb/>", source="generated", tags=[])
+            store.store_invalid(name="bad", source="generated", reason="430")
+            self.assertEqual(3, self._count())
+            self.assertEqual(0, self._count("nzb_invalid"))
+            self.assertEqual("", store.store_payload(name="set0", payload=b"x", source="generated")[1])
+            store.commit()
+            self.assertEqual(4, self._count())
+            self.assertEqual(1, self._count("nzb_invalid"))
+            store.close()
+        self.assertEqual(1, init.call_count)
+
+    def test_commit_auto_saves_new_nzbs(self):
+        out_dir = os.path.join(self._temp_dir.name, "out")
+        with mock.patch("app.nzb_store._auto_save_enabled", return_value=True), mock.patch(
+            "app.nzb_store._nzb_dir", return_value=out_dir
+        ):
+            key, path = store_nzb_payload(name="My Set", payload=b"<nzb/>", source="found", release_key="r1")
+            with NzbStore() as store:
+                self.assertEqual(key, store.find_by_release("r1"))
+                again = store.store_payload(name="My Set", payload=b"", source="found", release_key="r1")
+                self.assertEqual((key, path), again)
+        self.assertEqual(os.path.join(out_dir, f"{key[:8]}_My_Set.nzb"), path)
+        with open(path, "rb") as handle:
+            self.assertEqual(b"<nzb/>", handle.read())
+
+
+class TestPayloadBlobs(_NzbDbTestCase):
+    PAYLOAD = b"<nzb>\n" + b"  <segment>x</segment>\n" * 200 + b"</nzb>\n"
+
+    def _query(self, sql):
+        conn = db.get_nzb_db_readonly()
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_payload_is_stored_once_gzipped(self):
+        key, _ = store_nzb_payload(name="set", payload=self.PAYLOAD, source="found", group_name="a.b.one")
+        reposted = self.PAYLOAD.replace(b"\n", b"\r\n").replace(b"  <", b"\t<")
+        store_nzb_payload(name="set", payload=reposted, source="found", group_name="a.b.two")
+        store_nzb_payload(name="other", payload=b"<nzb/>", source="found")
+
+        blobs = self._query("SELECT hash, codec, bytes, payload FROM nzb_blobs ORDER BY bytes DESC")
+        self.assertEqual(2, len(blobs))
+        self.assertEqual("gzip", blobs[0]["codec"])
+        self.assertEqual(len(self.PAYLOAD), blobs[0]["bytes"])
+        self.assertLess(len(blobs[0]["payload"]), len(self.PAYLOAD) // 5)
+        self.assertEqual(self.PAYLOAD, gzip.decompress(blobs[0]["payload"]))
+        rows = self._query("SELECT payload_hash, payload FROM nzbs WHERE name = 'set'")
+        self.assertEqual([blobs[0]["hash"]] * 2, [row["payload_hash"] for row in rows])
+        self.assertEqual([None, None], [row["payload"] for row in rows])
+
+        path = save_nzb_to_disk(key, os.path.join(self._temp_dir.name, "out"))
+        with open(path, "rb") as handle:
+            self.assertEqual(self.PAYLOAD, handle.read())
+
+    def test_save_all_hardlinks_duplicates(self):
+        for group in ("a.b.one", "a.b.two", "a.b.three"):
+            store_nzb_payload(name="set", payload=self.PAYLOAD, source="found", group_name=group)
+        store_nzb_payload(name="other", payload=b"<nzb/>", source="found")
+        out_dir = os.path.join(self._temp_dir.name, "out")
+
+        with mock.patch("app.nzb_store._write_nzb_file", wraps=nzb_store._write_nzb_file) as write:
+            self.assertEqual(4, save_all_nzbs_to_disk(out_dir))
+        self.assertEqual(2, write.call_count)
+        paths = [row["path"] for row in self._query("SELECT path FROM nzbs WHERE name = 'set'")]
+        self.assertEqual(1, len({os.stat(path).st_ino for path in paths}))
+        self.assertEqual(3, os.stat(paths[0]).st_nlink)
+
+        store_nzb_payload(name="set", payload=self.PAYLOAD, source="found", group_name="a.b.four")
+        with mock.patch("app.nzb_store._write_nzb_file") as write:
+            self.assertEqual(1, save_all_nzbs_to_disk(out_dir))
+        write.assert_not_called()
+        self.assertEqual(4, os.stat(paths[0]).st_nlink)
+
+    def test_save_all_in_parallel_reports_progress(self):
+        keys = [
+            store_nzb_payload(name=f"set{idx}", payload=f"<nzb>{idx}</nzb>".encode(), source="found")[0]
+            for idx in range(30)
+        ]
+        out_dir = os.path.join(self._temp_dir.name, "out")
+        os.makedirs(out_dir)
+        done_path = save_nzb_to_disk(keys[0], out_dir)
+        conn = db.get_nzb_db()
+        conn.execute("UPDATE nzbs SET path = ? WHERE key = ?", (done_path, keys[0]))
+        conn.commit()
+        conn.close()
+
+        updates = []
+
+        def progress(done, total):
+            updates.append((done, total))
+
+        with mock.patch("app.nzb_store.SAVE_BATCH", 7):
+            saved = save_all_nzbs_to_disk(out_dir, workers=3, progress=progress)
+        self.assertEqual(29, saved)
+        self.assertEqual((0, 29), updates[0])
+        self.assertEqual((29, 29), updates[-1])
+        self.assertEqual(sorted(updates), updates)
+        self.assertEqual(30, len(os.listdir(out_dir)))
+        rows = self._query("SELECT key, path FROM nzbs")
+        for row in rows:
+            with open(row["path"], "rb") as handle:
+                self.assertEqual(f"<nzb>{keys.index(row['key'])}</nzb>".encode(), handle.read())
+        self.assertEqual(0, save_all_nzbs_to_disk(out_dir))
+
+    def test_migration_moves_legacy_rows_into_blobs(self):
+        store_nzb_payload(name="new", payload=self.PAYLOAD, source="found")
+        conn = db.get_nzb_db()
+        for idx in range(4):
+            conn.execute(
+                "INSERT INTO nzbs(key, name, source, path, payload) VALUES (?, ?, 'found', '', ?)",
+                (f"k{idx}", f"old{idx}", sqlite3.Binary(self.PAYLOAD)),
+            )
+        conn.execute(
+            "INSERT INTO nzbs(key, name, source, path, payload, codec) VALUES ('gz', 'gz', 'found', '', ?, 'gzip')",
+            (sqlite3.Binary(gzip.compress(b"<nzb>gz</nzb>")),),
+        )
+        conn.execute("INSERT INTO nzbs(key, name, source, path) VALUES ('empty', 'empty', 'found', '')")
+        conn.commit()
+        conn.close()
+
+        self.assertEqual(5, migrate_stored_payloads(batch_size=2))
+        self.assertEqual(0, migrate_stored_payloads())
+        self.assertEqual([], self._query("SELECT key FROM nzbs WHERE payload IS NOT NULL"))
+        blobs = {row["bytes"]: row for row in self._query("SELECT * FROM nzb_blobs")}
+        self.assertEqual({len(self.PAYLOAD), len(b"<nzb>gz</nzb>")}, set(blobs))
+        conn = db.get_nzb_db_readonly()
+        try:
+            for key, expected in (("k3", self.PAYLOAD), ("gz", b"<nzb>gz</nzb>")):
+                row = load_stored_payload(conn, key)
+                self.assertEqual(expected, decode_payload(row["payload"], row["codec"]))
+            self.assertIsNone(load_stored_payload(conn, "empty")["payload"])
+        finally:
+            conn.close()
+
+    def test_migration_stops_when_asked(self):
+        stop = threading.Event()
+        stop.set()
+        self.assertEqual(0, migrate_stored_payloads(stop_event=stop))
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        values = [f"<{idx}@test>" for idx in range(1000)]
+        for value in values:
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in values))
+        false_hits = sum(f"<{idx}@other>" in bloom for idx in range(10_000))
+        self.assertLess(false_hits, 300)
+        self.assertTrue(bloom.is_full())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,36 @@
+import io
 import unittest
+import xml.etree.ElementTree as ET
+from unittest import mock
 
-from app.nzb_utils import build_nzb_xml, parse_nzb_segments
+from app import nzb_utils
+from app.nzb_utils import (
+    build_nzb_xml,
+    group_segments_by_file,
+    iter_nzb_events,
+    parse_nzb_segments,
+    read_nzb_body,
+    write_nzb_xml,
+)
+
+
+def _etree_nzb(files, poster, groups):
+    # Reference: the ElementTree serialization the writer must match byte for byte.
+    nzb = ET.Element("nzb", {"xmlns": "http://www.newzbin.com/DTD/2003/nzb"})
+    for subject, segments in files:
+        file_elem = ET.SubElement(nzb, "file", {"poster": poster or "", "subject": subject, "date": "0"})
+        groups_elem = ET.SubElement(file_elem, "groups")
+        for group in groups:
+            if group:
+                ET.SubElement(groups_elem, "group").text = group
+        segments_elem = ET.SubElement(file_elem, "segments")
+        for segment in segments:
+            message_id = segment.get("message_id") or ""
+            if message_id.startswith("<") and message_id.endswith(">"):
+                message_id = message_id.removeprefix("<").removesuffix(">").strip()
+            attrs = {"bytes": str(segment.get("bytes") or 0), "number": str(segment.get("number") or 0)}
+            ET.SubElement(segments_elem, "segment", attrs).text = message_id
+    return ET.tostring(nzb, encoding="utf-8", xml_declaration=True)
 
 
 class TestNzbUtils(unittest.TestCase):
@@ -15,6 +45,78 @@ class TestNzbUtils(unittest.TestCase):
         self.assertEqual(1, len(segments))
         self.assertEqual("abc@xyz", segments[0]["message_id"])
 
+    def test_read_nzb_body_files_and_segments(self):
+        lines = [
+            '<?xml version="1.0" encoding="utf-8"?>',
+            '<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">',
+            ' <file poster="p@x" subject="a.part1.rar (1/2)" date="0">',
+            "  <groups><group>alt.binaries.a</group><group> alt.binaries.b </group></groups>",
+            "  <segments>",
+            '   <segment bytes="100" number="1">a1@x</segment>',
+            '   <segment bytes="50" number="2">&lt;a2@x&gt;</segment>',
+            '   <segment bytes="7" number="3"> </segment>',
+            "  </segments>",
+            " </file>",
+            ' <file poster="p@x" subject="caf\u00e9.nfo" date="0">',
+            '  <segments><segment bytes="x" number="1">b1@x</segment></segments>',
+            " </file>",
+            "</nzb>",
+        ]
+        with mock.patch.object(nzb_utils, "PARSE_CHUNK_SIZE", 16):
+            parsed = read_nzb_body(lines)
+        self.assertEqual("\n".join(lines).encode("utf-8"), parsed.payload)
+        self.assertEqual(
+            [
+                {
+                    "subject": "a.part1.rar (1/2)",
+                    "poster": "p@x",
+                    "groups": ["alt.binaries.a", "alt.binaries.b"],
+                    "segments": 3,
+                    "bytes": 157,
+                },
+                {"subject": "caf\u00e9.nfo", "poster": "p@x", "groups": [], "segments": 1, "bytes": 0},
+            ],
+            parsed.files,
+        )
+        self.assertEqual(
+            [
+                {"message_id": "a1@x", "bytes": 100, "number": 1},
+                {"message_id": "a2@x", "bytes": 50, "number": 2},
+                {"message_id": "b1@x", "bytes": 0, "number": 1},
+            ],
+            parsed.segments,
+        )
+
+    def test_read_nzb_body_without_nzb_or_with_bad_xml(self):
+        self.assertIsNone(read_nzb_body(["just text"]))
+        parsed = read_nzb_body(["<nzb><file>", "<segments>"])
+        self.assertEqual(b"<nzb><file>\n<segments>", parsed.payload)
+        self.assertEqual(([], []), (parsed.files, parsed.segments))
+
+    def test_read_nzb_body_ignores_declared_encoding(self):
+        lines = [
+            '<?xml version="1.0" encoding="iso-8859-1"?>',
+            '<nzb xmlns="http://www.newzbin.com/DTD/2003/nzb">',
+            '<file poster="José" subject="Café [1/1]" date="0">',
+            "<groups><group>alt.binaries.test</group></groups>",
+            '<segments><segment bytes="10" number="1">a@x</segment></segments>',
+            "</file></nzb>",
+        ]
+        with mock.patch.object(nzb_utils, "PARSE_CHUNK_SIZE", 3):
+            parsed = read_nzb_body(lines)
+        self.assertEqual([("Café [1/1]", "José")], [(f["subject"], f["poster"]) for f in parsed.files])
+
+    def test_events_interleave_segments_and_files(self):
+        payload = build_nzb_xml(
+            name="big",
+            poster="p",
+            groups=["alt.binaries.test"],
+            segments=[{"message_id": f"s{idx}@x", "bytes": 10, "number": idx} for idx in range(1, 2001)],
+        )
+        with mock.patch.object(nzb_utils, "PARSE_CHUNK_SIZE", 1000):
+            kinds = [kind for kind, _ in iter_nzb_events(payload)]
+        self.assertEqual(["segment"] * 2000 + ["file"], kinds)
+
     def test_build_nzb_xml_strips_brackets(self):
         payload = build_nzb_xml(
             name="test",
@@ -25,3 +127,47 @@ class TestNzbUtils(unittest.TestCase):
         segments = parse_nzb_segments(payload)
         self.assertEqual(1, len(segments))
         self.assertEqual("abc@xyz", segments[0]["message_id"])
+
+
+class TestNzbWriter(unittest.TestCase):
+    SEGMENTS = [
+        {"message_id": "<a&b@x>", "bytes": 10, "number": 1},
+        {"message_id": "c<d>@x", "bytes": 0, "number": 2},
+        {"message_id": "", "bytes": None, "number": 3},
+        {"message_id": "< spaced@x >", "bytes": "12\"", "number": 4},
+        {"message_id": "caf\u00e9\ud800@x", "bytes": 5, "number": 5},
+    ]
+
+    def test_matches_elementtree_bytes(self):
+        cases = [
+            ('Show "S01" <E01> & more\tname\r\n', 'Poster "p" <p@x>', ["alt.binaries.a&b", "", "alt.binaries.b"]),
+            ("", None, []),
+            ("empty", "p", ["g"]),
+        ]
+        for name, poster, groups in cases:
+            segments = [] if name == "empty" else self.SEGMENTS
+            expected = _etree_nzb([(name or "release", segments)], poster, groups)
+            self.assertEqual(expected, build_nzb_xml(name=name, poster=poster, groups=groups, segments=segments))
+
+    def test_streams_multiple_files_in_chunks(self):
+        files = [
+            (f"file{idx}.rar", [{"message_id": f"{idx}-{num}@x", "bytes": 100, "number": num} for num in range(1, 300)])
+            for idx in range(5)
+        ]
+        out = io.BytesIO()
+        with mock.patch.object(nzb_utils, "WRITE_CHUNK_SIZE", 512):
+            size = write_nzb_xml(out, poster="p", groups=["g"], files=((name, iter(segs)) for name, segs in files))
+        self.assertEqual(_etree_nzb(files, "p", ["g"]), out.getvalue())
+        self.assertEqual(len(out.getvalue()), size)
+        self.assertEqual(5, len(read_nzb_body(out.getvalue().decode("utf-8").split("\n")).files))
+
+    def test_group_segments_by_file(self):
+        segments = [
+            {"message_id": "1@x", "filename": "b.rar"},
+            {"message_id": "2@x"},
+            {"message_id": "3@x", "filename": "b.rar"},
+        ]
+        grouped = group_segments_by_file(segments, "release")
+        self.assertEqual(["b.rar", "release"], [name for name, _ in grouped])
+        self.assertEqual(["1@x", "3@x"], [seg["message_id"] for seg in grouped[0][1]])
+        self.assertEqual([("release", [])], group_segments_by_file([], "release"))
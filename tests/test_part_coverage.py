@@ -0,0 +1,56 @@
+import random
+import unittest
+
+from app.part_coverage import PartCoverage
+from app.release_filter import is_complete
+
+
+class TestPartCoverage(unittest.TestCase):
+    def test_adds_merge_into_ranges(self):
+        coverage = PartCoverage([5, 1, 2, 3, 7, 6, 10])
+        self.assertEqual([(1, 3), (5, 7), (10, 10)], coverage.ranges())
+        coverage.add(4)
+        self.assertEqual([(1, 7), (10, 10)], coverage.ranges())
+        self.assertEqual(8, coverage.count())
+        self.assertEqual(8, len(coverage))
+
+    def test_add_range_spans_existing_ranges(self):
+        coverage = PartCoverage.from_ranges([(1, 2), (5, 6), (9, 9), (20, 30)])
+        coverage.add_range(3, 10)
+        self.assertEqual([(1, 10), (20, 30)], coverage.ranges())
+
+    def test_encode_decode_round_trip(self):
+        coverage = PartCoverage.from_ranges([(1, 40), (42, 42), (45, 50)])
+        self.assertEqual("1-40,42,45-50", coverage.encode())
+        self.assertEqual(coverage, PartCoverage.decode(coverage.encode()))
+        self.assertEqual(PartCoverage([1, 2, 3, 9]), PartCoverage.decode("[3, 1, 2, 9]"))
+        self.assertEqual(0, PartCoverage.decode(None).count())
+
+    def test_missing_and_completeness(self):
+        coverage = PartCoverage.from_ranges([(2, 4), (7, 8)])
+        self.assertEqual([1, 5, 6, 9, 10], list(coverage.missing(10)))
+        self.assertEqual([1], list(coverage.missing(4)))
+        self.assertFalse(coverage.covers(8))
+        coverage.update([1, 5, 6])
+        self.assertTrue(coverage.covers(8))
+        self.assertTrue(is_complete(coverage, 8))
+        self.assertFalse(is_complete(PartCoverage([2, 3, 4]), 3))
+        self.assertFalse(is_complete(PartCoverage(), 0))
+
+    def test_matches_set_semantics(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            parts = {rng.randint(1, 200) for _ in range(rng.randint(0, 150))}
+            coverage = PartCoverage()
+            other = PartCoverage()
+            for part in parts:
+                (coverage if part % 2 else other).add(part)
+            coverage.merge(other)
+            self.assertEqual(sorted(parts), list(coverage))
+            self.assertEqual(len(parts), coverage.count())
+            self.assertEqual(sorted(set(range(1, 201)) - parts), list(coverage.missing(200)))
+            self.assertEqual(coverage, PartCoverage.decode(coverage.encode()))
+
+
+if __name__ == "__main__":
+    unittest.main()
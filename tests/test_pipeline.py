@@ -4,6 +4,8 @@ import tempfile
 import unittest
 from unittest import mock
 
+from app.nzb_utils import ParsedNzb
+
 
 def _make_db(path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(path, timeout=30)
@@ -165,14 +167,8 @@ class PipelineTests(unittest.TestCase):
         }
 
         with mock.patch("app.pipeline._fetch_nzb_body", return_value=["<nzb></nzb>"]), mock.patch(
-            "app.pipeline.parse_nzb",
-            return_value=[nzb_file],
-        ), mock.patch(
-            "app.pipeline.build_nzb_payload",
-            return_value=b"payload",
-        ), mock.patch(
-            "app.pipeline.parse_nzb_segments",
-            return_value=[{"message_id": "<seg>"}],
+            "app.pipeline.read_nzb_body",
+            return_value=ParsedNzb(b"payload", [nzb_file], [{"message_id": "<seg>"}]),
         ), mock.patch(
             "app.pipeline.verify_message_ids",
             return_value=(True, None),
@@ -211,14 +207,8 @@ class PipelineTests(unittest.TestCase):
         app_db.init_ingest_db(ingest_conn)
         self.addCleanup(ingest_conn.close)
         with mock.patch("app.pipeline._fetch_nzb_body", return_value=["<nzb></nzb>"]), mock.patch(
-            "app.pipeline.parse_nzb",
-            return_value=[],
-        ), mock.patch(
-            "app.pipeline.build_nzb_payload",
-            return_value=b"payload",
-        ), mock.patch(
-            "app.pipeline.parse_nzb_segments",
-            return_value=[{"message_id": "<seg>"}],
+            "app.pipeline.read_nzb_body",
+            return_value=ParsedNzb(b"payload", [], [{"message_id": "<seg>"}]),
         ), mock.patch(
             "app.pipeline.verify_message_ids",
             return_value=(False, "bad"),
@@ -302,7 +292,9 @@ class PipelineTests(unittest.TestCase):
             "app.pipeline.build_releases"
         ) as build_releases, mock.patch(
             "app.pipeline.filter_main"
-        ) as filter_main:
+        ) as filter_main, mock.patch(
+            "app.pipeline.NzbStore"
+        ) as nzb_store:
             code = pipeline.run_pipeline_once(
                 groups=["alt.binaries.test"],
                 parse_nzb_bodies=False,
@@ -313,6 +305,8 @@ class PipelineTests(unittest.TestCase):
         self.assertEqual(code, 0)
         self.assertTrue(build_releases.called)
         self.assertTrue(filter_main.called)
+        self.assertIs(nzb_store.return_value, filter_main.call_args.kwargs["store"])
+        nzb_store.return_value.close.assert_called_once()
         check_conn = _make_db(ingest_path)
         try:
             rows = check_conn.execute("SELECT * FROM ingest").fetchall()
@@ -1,3 +1,4 @@
+import os
 import unittest
 
 from app.release_utils import build_tags
@@ -29,3 +30,32 @@ class TestReleaseTags(unittest.TestCase):
         self.assertIn("resolution:1080p", tags)
         self.assertIn("source:bluray", tags)
         self.assertIn("format:h264", tags)
+
+
+class TestSimdTagger(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from app.wasm_pipeline import DEFAULT_SIMD_WASM_PATH, DEFAULT_WASM_PATH, WasmPipeline, host_supports_simd
+
+        if not host_supports_simd() or not os.path.exists(DEFAULT_SIMD_WASM_PATH):
+            raise unittest.SkipTest("SIMD WASM module not available")
+        cls.scalar = WasmPipeline(DEFAULT_WASM_PATH)
+        cls.simd = WasmPipeline(DEFAULT_SIMD_WASM_PATH, simd=True)
+
+    def test_simd_matches_scalar(self):
+        subjects = [
+            "Movie.Title.2024.2160p.WEB-DL.DV.HDR10+.HEVC.Atmos.TrueHD.mkv",
+            '[01/40] - "Show.S01E02.1080p.Blu-Ray.x264-GRP.part01.rar" yEnc (1/120)',
+            "Some Film (1999) Dolby Vision HDR10 DTS-HD 10 bit REMUX",
+            "avc.aac.ac3.mp4.avi repack proper remastered extended uhd hlg sdr",
+            "nodv hdr10plus h.265 web dl blu ray dolby digital 10-bit",
+            "release.nzb",
+            "",
+        ]
+        self.assertEqual(self.scalar.parse_tag_masks(subjects), self.simd.parse_tag_masks(subjects))
+        self.assertEqual(
+            [self.scalar.parse_tag_mask(s) for s in subjects],
+            self.simd.parse_tag_masks(subjects),
+        )
+        overviews = [(idx, {"subject": s, "bytes": "10"}) for idx, s in enumerate(subjects)]
+        self.assertEqual(self.scalar.parse_overviews(overviews), self.simd.parse_overviews(overviews))
@@ -1,6 +1,17 @@
+import gzip
+import io
+import json
+import os
+import sqlite3
+import tarfile
+import tempfile
 import unittest
+from unittest import mock
 
+from app import db
+from app.nzb_store import store_nzb_payload
 from gui.http_assets import asset_info
+from gui.server import Handler, accepts_encoding, read_releases
 
 
 class TestServerAssets(unittest.TestCase):
@@ -12,3 +23,168 @@ class TestServerAssets(unittest.TestCase):
 
     def test_asset_info_unknown(self):
         self.assertIsNone(asset_info("/assets/missing.css"))
+
+
+class _StreamHandler(Handler):
+    def __init__(self):
+        self.wfile = io.BytesIO()
+        self.headers_sent = []
+
+    def send_response(self, code, message=None):
+        self.status = code
+
+    def send_header(self, keyword, value):
+        self.headers_sent.append((keyword, value))
+
+    def end_headers(self):
+        pass
+
+
+class TestJsonStream(unittest.TestCase):
+    def _stream(self, items, chunk_size):
+        handler = _StreamHandler()
+        handler.path = "/api/releases"
+        handler._send_json_stream(iter(items), chunk_size=chunk_size)
+        return handler
+
+    def test_streams_valid_array_across_chunks(self):
+        items = [{"key": f"k{idx}", "name": "x" * 50} for idx in range(200)]
+        handler = self._stream(items, chunk_size=256)
+        self.assertEqual(items, json.loads(handler.wfile.getvalue()))
+        self.assertNotIn("Content-Length", dict(handler.headers_sent))
+
+    def test_empty_stream(self):
+        self.assertEqual([], json.loads(self._stream([], chunk_size=256).wfile.getvalue()))
+
+    def test_error_before_first_row_is_500(self):
+        def rows():
+            raise sqlite3.OperationalError("no such table: releases")
+            yield {}
+
+        with self.assertLogs("tricerapost", "ERROR"):
+            handler = self._stream(rows(), chunk_size=256)
+        self.assertEqual(500, handler.status)
+        self.assertFalse(json.loads(handler.wfile.getvalue())["ok"])
+
+    def test_error_mid_stream_leaves_invalid_json(self):
+        def rows():
+            yield {"key": "a"}
+            raise sqlite3.OperationalError("database disk image is malformed")
+
+        with self.assertLogs("tricerapost", "ERROR"):
+            handler = self._stream(rows(), chunk_size=1)
+        self.assertEqual(200, handler.status)
+        self.assertTrue(handler.close_connection)
+        with self.assertRaises(json.JSONDecodeError):
+            json.loads(handler.wfile.getvalue())
+
+
+class TestNzbFile(unittest.TestCase):
+    PAYLOAD = b"<nzb>" + b"<file/>" * 50 + b"</nzb>"
+
+    def _get(self, accept_encoding, codec="gzip"):
+        stored = gzip.compress(self.PAYLOAD) if codec == "gzip" else self.PAYLOAD
+        handler = _StreamHandler()
+        handler.path = "/api/nzb/file?key=abc"
+        handler.headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+        with mock.patch("gui.server.read_nzb_payload", return_value=("set", stored, codec, "")):
+            handler.do_GET()
+        return handler, dict(handler.headers_sent)
+
+    def test_sends_stored_gzip_when_accepted(self):
+        handler, headers = self._get("gzip, deflate")
+        self.assertEqual("gzip", headers["Content-Encoding"])
+        self.assertEqual(self.PAYLOAD, gzip.decompress(handler.wfile.getvalue()))
+        self.assertEqual(str(len(handler.wfile.getvalue())), headers["Content-Length"])
+        self.assertEqual('attachment; filename="set.nzb"', headers["Content-Disposition"])
+
+    def test_decompresses_for_other_clients(self):
+        for accept in (None, "identity", "gzip;q=0"):
+            handler, headers = self._get(accept)
+            self.assertNotIn("Content-Encoding", headers)
+            self.assertEqual(self.PAYLOAD, handler.wfile.getvalue())
+
+    def test_legacy_raw_payload(self):
+        handler, headers = self._get("gzip", codec=None)
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(self.PAYLOAD, handler.wfile.getvalue())
+
+    def test_accepts_encoding(self):
+        self.assertTrue(accepts_encoding("br, gzip;q=0.8", "gzip"))
+        self.assertTrue(accepts_encoding("*", "gzip"))
+        self.assertFalse(accepts_encoding("GZIP;q=0", "gzip"))
+        self.assertFalse(accepts_encoding("deflate", "gzip"))
+
+
+class TestNzbExportEndpoint(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._old_nzb_path = db.NZB_DB_PATH
+        db.NZB_DB_PATH = os.path.join(self._temp_dir.name, "nzbs.db")
+
+    def tearDown(self):
+        db.NZB_DB_PATH = self._old_nzb_path
+        self._temp_dir.cleanup()
+
+    def _get(self, path):
+        handler = _StreamHandler()
+        handler.path = path
+        handler.headers = {}
+        handler.do_GET()
+        return handler, dict(handler.headers_sent)
+
+    def test_streams_tar_of_selected_keys(self):
+        first, _ = store_nzb_payload(name="one", payload=b"<nzb>1</nzb>", source="found")
+        store_nzb_payload(name="two", payload=b"<nzb>2</nzb>", source="found")
+        handler, headers = self._get(f"/api/nzb/export?format=tar&key={first}")
+        self.assertEqual("application/x-tar", headers["Content-Type"])
+        self.assertNotIn("Content-Length", headers)
+        with tarfile.open(fileobj=io.BytesIO(handler.wfile.getvalue())) as archive:
+            self.assertEqual([f"{first[:8]}_one.nzb"], archive.getnames())
+
+    def test_rejects_non_string_filters_before_streaming(self):
+        store_nzb_payload(name="one", payload=b"<nzb>1</nzb>", source="found")
+        for body in ({"tag": 5}, {"since": ["2024-01-01"]}, {"until": {"day": 1}}):
+            raw = json.dumps(body).encode("utf-8")
+            handler = _StreamHandler()
+            handler.path = "/api/nzb/export"
+            handler.headers = {"Content-Length": str(len(raw))}
+            handler.rfile = io.BytesIO(raw)
+            handler.do_POST()
+            self.assertEqual(400, handler.status)
+            self.assertFalse(json.loads(handler.wfile.getvalue())["ok"])
+
+    def test_rejects_unknown_format(self):
+        store_nzb_payload(name="one", payload=b"<nzb>1</nzb>", source="found")
+        handler, _ = self._get("/api/nzb/export?format=rar")
+        self.assertEqual(400, handler.status)
+
+
+class TestReadReleases(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._old_complete_path = db.COMPLETE_DB_PATH
+        self._old_nzb_path = db.NZB_DB_PATH
+        db.COMPLETE_DB_PATH = os.path.join(self._temp_dir.name, "complete.db")
+        db.NZB_DB_PATH = os.path.join(self._temp_dir.name, "nzbs.db")
+
+    def tearDown(self):
+        db.COMPLETE_DB_PATH = self._old_complete_path
+        db.NZB_DB_PATH = self._old_nzb_path
+        self._temp_dir.cleanup()
+
+    def test_complete_releases_newest_first(self):
+        conn = db.get_complete_db()
+        db.init_complete_db(conn)
+        for key, last_seen in (("b", "2024-01-02"), ("c", "2024-01-03"), ("a", "2024-01-01")):
+            conn.execute("INSERT INTO releases_complete (key, name, last_seen) VALUES (?, ?, ?)", (key, key, last_seen))
+        # What an incremental filter run does: the refreshed row gets a new rowid.
+        conn.execute("DELETE FROM releases_complete WHERE key = 'b'")
+        conn.execute("INSERT INTO releases_complete (key, name, last_seen) VALUES ('b', 'b', '2024-01-02')")
+        conn.commit()
+        conn.close()
+        self.assertEqual(["c", "b", "a"], [row["key"] for row in read_releases("releases_complete")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import dataclasses
+import unittest
+
+from app.release_filter import extract_parts_from_subjects, parse_metadata, pick_filename
+from app.release_utils import (
+    SubjectAnalyzer,
+    SubjectCache,
+    analyze_subject,
+    extract_filename,
+    normalize_name,
+    normalize_subject,
+    parse_part,
+)
+
+
+class TestSubjectAnalyzer(unittest.TestCase):
+    def test_analyze_header_subject(self):
+        subject = '[01/40] - "Show.S01E02.1080p.WEB-DL.x264-GRP.part01.rar" yEnc (1/120)'
+        info = analyze_subject(subject)
+        self.assertEqual('"Show.S01E02.1080p.WEB-DL.x264-GRP"', info.normalized)
+        self.assertEqual((1, 40), (info.part_num, info.part_total))
+        self.assertEqual("Show.S01E02.1080p.WEB-DL.x264-GRP.part01.rar", info.filename)
+        self.assertEqual("Show.S01E02.1080p.WEB-DL.x264-GRP.rar", info.filename_guess)
+        self.assertFalse(info.is_nzb)
+        self.assertIsNone(info.metadata)
+
+    def test_yenc_tail_parts_are_parsed_but_not_stripped_twice(self):
+        info = analyze_subject('Movie.2024 - "movie.vol03+04.par2" yEnc (2/7)')
+        self.assertEqual('Movie.2024 - "movie"', info.normalized)
+        self.assertEqual((2, 7), (info.part_num, info.part_total))
+        self.assertEqual("movie.par2", info.filename_guess)
+
+    def test_nzb_subject(self):
+        info = analyze_subject('"Release.Name.nzb" yEnc (1/1)')
+        self.assertTrue(info.is_nzb)
+        self.assertEqual('"Release.Name"', info.normalized)
+
+    def test_metadata_is_opt_in(self):
+        info = SubjectAnalyzer(metadata=True).analyze("Show.S02E03.720p.HDTV.x264.AAC.ENG.FRENCH.Subs")
+        self.assertEqual(
+            {
+                "type": "tv",
+                "quality": "720p",
+                "source": "hdtv",
+                "codec": "x264",
+                "audio": "aac",
+                "languages": ["eng", "french"],
+                "subtitles": True,
+            },
+            info.metadata.as_dict(),
+        )
+
+    def test_result_is_frozen(self):
+        info = analyze_subject("a (1/2)")
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            info.part_num = 3
+
+    def test_wrappers_agree_with_analyzer(self):
+        subject = 'Some.Film.1999 [3/9] - "film.part03.rar" yEnc (10/50)'
+        info = analyze_subject(subject)
+        self.assertEqual(info.normalized, normalize_subject(subject))
+        self.assertEqual((info.part_num, info.part_total), parse_part(subject))
+        self.assertEqual(info.filename, extract_filename(subject))
+        self.assertEqual("Some.Film.1999 - \"film\" yEnc", normalize_name(subject))
+        self.assertEqual(({3}, 9), extract_parts_from_subjects([subject]))
+        self.assertEqual("unknown", parse_metadata("Some.Film.1999")["type"])
+
+    def test_pick_filename_prefers_video(self):
+        subjects = [
+            '"film.part01.rar" yEnc (1/10)',
+            '"film.vol00+01.par2" yEnc (1/2)',
+            '"film.mkv" yEnc (1/90)',
+        ]
+        self.assertEqual("film.mkv", pick_filename(subjects))
+        self.assertIsNone(pick_filename(["no filename here"]))
+
+
+class TestSubjectCache(unittest.TestCase):
+    def test_counts_hits_and_misses(self):
+        cache = SubjectCache(SubjectAnalyzer(), 1024 * 1024)
+        first = cache.analyze('"film.part01.rar" yEnc (1/10)')
+        second = cache.analyze('"film.part01.rar" yEnc (1/10)')
+        cache.analyze('"film.part02.rar" yEnc (2/10)')
+        self.assertIs(first, second)
+        stats = cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(2, stats["misses"])
+        self.assertEqual(2, stats["entries"])
+        self.assertEqual(0, stats["evictions"])
+
+    def test_evicts_least_recently_used(self):
+        probe = SubjectCache(SubjectAnalyzer(), 1024 * 1024)
+        probe.analyze("a (1/3)")
+        entry_size = probe.stats()["bytes"]
+        cache = SubjectCache(SubjectAnalyzer(), entry_size * 2)
+        cache.analyze("a (1/3)")
+        cache.analyze("b (1/3)")
+        cache.analyze("a (1/3)")
+        cache.analyze("c (1/3)")
+        stats = cache.stats()
+        self.assertEqual(1, stats["evictions"])
+        self.assertLessEqual(stats["bytes"], stats["max_bytes"])
+        cache.analyze("a (1/3)")
+        self.assertEqual(2, cache.stats()["hits"])
+
+    def test_zero_cap_disables_cache(self):
+        cache = SubjectCache(SubjectAnalyzer(), 0)
+        cache.analyze("a (1/3)")
+        cache.analyze("a (1/3)")
+        stats = cache.stats()
+        self.assertEqual(0, stats["entries"])
+        self.assertEqual(2, stats["misses"])
+
+
+if __name__ == "__main__":
+    unittest.main()